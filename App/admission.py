@@ -0,0 +1,48 @@
+import logging, uuid
+from decouple import config
+from . import call_registry, metrics
+
+logger = logging.getLogger(__name__)
+
+BUSY_MESSAGE = "Iris is chatting with a lot of people right now. Please try again in a few minutes."
+HOLD_MESSAGE = "All of our lines are busy. Please hold on, Iris will be with you shortly."
+
+
+async def admit(channel, local=True):
+    """
+    Decides whether a new call can be taken, and reserves its slot if so:
+    - MAX_CALLS_PER_WORKER: with `local`, calls live on this worker plus the ones it admitted that have not
+      connected yet. Twilio webhooks are admitted with local=False, because the media websocket usually lands
+      on another worker; for them the limit caps the cluster at that many calls per live worker instead.
+    - MAX_CALLS_CLUSTER: calls live across all workers plus unexpired reservations, checked and reserved
+      atomically in Redis.
+    0 disables a limit. A registry that cannot be reached does not block calls.
+    The reservation is consumed by `call_registry.register_call` (or `release_reservation`), and expires after
+    ADMISSION_RESERVATION_TTL seconds if the call never connects.
+    Returns the reservation token if the call is admitted, otherwise None.
+    """
+    token = uuid.uuid4().hex
+    ttl = config('ADMISSION_RESERVATION_TTL', default=30, cast=int)
+    admitted = not call_registry.draining and \
+        (not local or call_registry.reserve_local(token, config('MAX_CALLS_PER_WORKER', default=0, cast=int), ttl))
+    if admitted:
+        try:
+            limit = await cluster_limit(local)
+            if limit > 0:
+                admitted = await call_registry.reserve_slot(token, limit, ttl)
+        except Exception as e:
+            logger.warning("Admission registry error: %s", e)
+            metrics.UPSTREAM_ERRORS.inc("redis")
+        if not admitted:
+            call_registry.local_reservations.pop(token, None)
+
+    metrics.ADMISSION.inc(channel, "admitted" if admitted else "rejected")
+    return token if admitted else None
+
+async def cluster_limit(local):
+    limit = config('MAX_CALLS_CLUSTER', default=0, cast=int)
+    per_worker = config('MAX_CALLS_PER_WORKER', default=0, cast=int)
+    if local or per_worker <= 0:
+        return limit
+    capacity = per_worker * max(1, await call_registry.live_worker_count())
+    return min(limit, capacity) if limit > 0 else capacity
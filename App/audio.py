@@ -0,0 +1,155 @@
+import math
+import numpy as np
+
+PCM_DTYPE = np.dtype("<i2")
+
+
+def mulaw_decode_table():
+    ulaw = ~np.arange(256, dtype=np.uint8)
+    exponent = (ulaw >> 4) & 0x07
+    mantissa = (ulaw & 0x0F).astype(np.int32)
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(ulaw & 0x80, -magnitude, magnitude).astype(np.int16)
+
+def alaw_decode_table():
+    alaw = np.arange(256, dtype=np.uint8) ^ 0x55
+    segment = ((alaw & 0x70) >> 4).astype(np.int32)
+    magnitude = ((alaw & 0x0F).astype(np.int32) << 4) + np.where(segment == 0, 8, 0x108)
+    magnitude = np.where(segment > 1, magnitude << np.maximum(segment - 1, 0), magnitude)
+    return np.where(alaw & 0x80, magnitude, -magnitude).astype(np.int16)
+
+def mulaw_encode_table():
+    # Indexed by the int16 sample reinterpreted as uint16, so encoding is a single lookup.
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), 8159) + 0x21
+    segment = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), magnitude)
+    value = np.where(segment >= 8, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    return (value ^ mask).astype(np.uint8)
+
+def alaw_encode_table():
+    pcm = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32) >> 3
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    magnitude = np.where(pcm >= 0, pcm, -pcm - 1)
+    segment = np.searchsorted(np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF]), magnitude)
+    mantissa = np.where(segment < 2, magnitude >> 1, magnitude >> np.minimum(segment, 7)) & 0x0F
+    value = np.where(segment >= 8, 0x7F, (np.minimum(segment, 7) << 4) | mantissa)
+    return (value ^ mask).astype(np.uint8)
+
+MULAW_TO_PCM = mulaw_decode_table()
+ALAW_TO_PCM = alaw_decode_table()
+PCM_TO_MULAW = mulaw_encode_table()
+PCM_TO_ALAW = alaw_encode_table()
+
+
+def as_pcm(buffer):
+    """
+    Zero-copy int16 view of little-endian PCM16 `bytes` / `bytearray` / `memoryview` (or an int16 array as is).
+    """
+    if isinstance(buffer, np.ndarray):
+        return buffer
+    return np.frombuffer(buffer, dtype=PCM_DTYPE)
+
+def as_bytes(buffer):
+    return np.frombuffer(buffer, dtype=np.uint8) if not isinstance(buffer, np.ndarray) else buffer
+
+def mulaw_to_pcm(buffer):
+    return MULAW_TO_PCM[as_bytes(buffer)]
+
+def alaw_to_pcm(buffer):
+    return ALAW_TO_PCM[as_bytes(buffer)]
+
+def pcm_to_mulaw(pcm):
+    return PCM_TO_MULAW[as_pcm(pcm).view(np.uint16)]
+
+def pcm_to_alaw(pcm):
+    return PCM_TO_ALAW[as_pcm(pcm).view(np.uint16)]
+
+DECODERS = {"mulaw": mulaw_to_pcm, "alaw": alaw_to_pcm, "linear16": as_pcm}
+ENCODERS = {"mulaw": pcm_to_mulaw, "alaw": pcm_to_alaw, "linear16": lambda pcm: as_pcm(pcm)}
+
+
+def apply_gain(pcm, gain):
+    """
+    Scales PCM16 samples by `gain`, saturating instead of wrapping around.
+    """
+    scaled = as_pcm(pcm).astype(np.float32) * gain
+    return np.clip(scaled, -32768, 32767).astype(np.int16)
+
+def normalize_gain(pcm, target_dbfs=-20.0, max_gain=8.0):
+    """
+    Brings the RMS level of PCM16 audio to `target_dbfs`, never amplifying by more than `max_gain`
+    (so near-silence is not blown up into noise).
+    """
+    pcm = as_pcm(pcm)
+    if not len(pcm):
+        return pcm
+    samples = pcm.astype(np.float32)
+    rms = float(np.sqrt(np.mean(samples * samples)))
+    if rms < 1:
+        return pcm
+    gain = min(max_gain, 32768 * 10 ** (target_dbfs / 20) / rms)
+    return apply_gain(pcm, gain)
+
+
+class Resampler:
+    """
+    Streaming polyphase resampler between 8/16/24/48 kHz (any rational ratio works).
+    A Kaiser-windowed sinc low-pass is split into one filter per output phase, so each output sample costs
+    `taps` multiply-adds; filter history is carried across `process` calls, so chunks join without clicks.
+    """
+    def __init__(self, from_rate, to_rate, taps=24, beta=8.0):
+        divisor = math.gcd(from_rate, to_rate)
+        self.up, self.down = to_rate // divisor, from_rate // divisor
+        # Decimating needs a proportionally longer filter for the same transition band.
+        self.taps = taps = taps * -(-self.down // self.up)
+
+        length = taps * self.up
+        cutoff = 0.5 / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta) * self.up
+        # phases[p, i] = prototype[p + i * up]: the taps applied to input x[base - i] for output phase p.
+        self.phases = prototype.reshape(taps, self.up).T.astype(np.float32)
+        self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.next_index = (taps - 1) * self.up      # next output position, at the upsampled rate
+
+    def process(self, pcm):
+        pcm = as_pcm(pcm)
+        if self.up == self.down:
+            return pcm
+        buffer = np.concatenate((self.history, pcm.astype(np.float32)))
+        end = len(buffer) * self.up
+        positions = np.arange(self.next_index, end, self.down)
+
+        # Outputs up apart share a phase filter and step `down` input samples: one C-level convolution per phase.
+        out = np.empty(len(positions), dtype=np.float32)
+        for first in range(min(self.up, len(positions))):
+            base, phase = divmod(int(positions[first]), self.up)
+            filtered = np.convolve(buffer, self.phases[phase], mode="valid")
+            count = len(out[first::self.up])
+            out[first::self.up] = filtered[base - (self.taps - 1):base - (self.taps - 1) + count * self.down:self.down]
+
+        self.next_index = (positions[-1] + self.down if len(positions) else self.next_index) - len(pcm) * self.up
+        self.history = buffer[len(buffer) - (self.taps - 1):]
+        return np.clip(np.rint(out), -32768, 32767).astype(np.int16)
+
+def resample(pcm, from_rate, to_rate):
+    """
+    One-shot resampling of a whole clip; use `Resampler` for streams.
+    """
+    return Resampler(from_rate, to_rate).process(pcm)
+
+
+def transcode(data, from_encoding, from_rate, to_encoding, to_rate, gain=None):
+    """
+    Converts a whole clip between mulaw / alaw / linear16 encodings and sample rates, e.g. one synthesized
+    24 kHz linear16 asset into 8 kHz mulaw for Twilio. Returns bytes.
+    """
+    pcm = DECODERS[from_encoding](data)
+    if from_rate != to_rate:
+        pcm = resample(pcm, from_rate, to_rate)
+    if gain == "normalize":
+        pcm = normalize_gain(pcm)
+    elif gain is not None:
+        pcm = apply_gain(pcm, gain)
+    return ENCODERS[to_encoding](pcm).tobytes()
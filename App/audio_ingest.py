@@ -0,0 +1,70 @@
+import asyncio
+
+MEDIA_EVENT = '"event":"media"'
+PAYLOAD_KEY = '"payload":"'
+
+
+def extract_media_payload(text_data):
+    """
+    Fast path for Twilio `media` frames: slices the base64 payload out of the raw JSON without a full parse.
+    Returns None for any other event, or unexpected formatting, which should go through json.loads instead.
+    """
+    if MEDIA_EVENT not in text_data:
+        return None
+
+    start = text_data.find(PAYLOAD_KEY)
+    if start < 0:
+        return None
+    start += len(PAYLOAD_KEY)
+
+    end = text_data.find('"', start)
+    if end < 0 or "\\" in text_data[start:end]:
+        return None
+    return text_data[start:end]
+
+
+class AudioCoalescer:
+    """
+    Batches small inbound audio frames into larger upstream writes.
+    A batch is flushed as soon as it reaches `flush_bytes`, or `flush_interval` seconds after its first frame.
+    Timed flushes run as tasks started by `spawn` (e.g. the call's `TaskSupervisor`, so their failures are logged).
+    """
+    def __init__(self, send, flush_bytes, flush_interval, spawn=asyncio.create_task):
+        self.send = send
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.spawn = spawn
+        self.buffer = bytearray()
+        self.timer = None
+        self.flush_task = None
+
+    async def add(self, frame):
+        self.buffer += frame
+        if len(self.buffer) >= self.flush_bytes:
+            await self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.flush_interval, self.flush_later)
+
+    def flush_later(self):
+        self.timer = None
+        self.flush_task = self.spawn(self.flush())
+
+    async def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.buffer:
+            return
+
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        await self.send(data)
+
+    def close(self):
+        """
+        Drops any pending audio and stops the flush timer.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.buffer.clear()
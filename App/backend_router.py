@@ -0,0 +1,229 @@
+import asyncio, contextlib, json, logging, random, time
+import aiohttp
+from decouple import config
+from . import logs, metrics, upstream
+
+logger = logging.getLogger(__name__)
+
+# Background probes in flight; held here so they are not garbage-collected (`Router.probe` logs failures).
+probe_tasks = set()
+
+
+def ewma_alpha():
+    return config('ROUTER_EWMA_ALPHA', default=0.2, cast=float)
+
+def is_backend_fault(status):
+    # Server errors and rejected credentials say something about the backend; other 4xx are about the request.
+    return status >= 500 or status in (401, 403, 404)
+
+
+class Backend:
+    """
+    One backend of a routed stage: where requests go (url, model, api_key), its routing weight, and what
+    the router has learned about it: EWMA time to first byte, EWMA error rate and circuit breaker state.
+    """
+    def __init__(self, stage, stage_upstream, name, url, model, api_key, weight=1.0):
+        self.stage = stage
+        self.name = name
+        self.url = url
+        self.model = model
+        self.api_key = api_key
+        self.weight = max(float(weight), 0.01)
+        self.upstream = stage_upstream.for_backend()
+        self.first_byte = None
+        self.error_rate = 0.0
+        self.failures = 0           # in a row
+        self.open_until = None      # monotonic time the open circuit allows a probe; None while closed
+        self.open_seconds = 0.0
+        self.probing = False
+        self.last_used = 0.0
+
+    def score(self):
+        """
+        Expected time to first byte, inflated by the error rate and divided by the weight (lower is better).
+        A backend with no history scores 0, so it is tried and measured.
+        """
+        if self.first_byte is None:
+            return 0.0
+        return self.first_byte * (1 + config('ROUTER_ERROR_PENALTY', default=4, cast=float) * self.error_rate) / self.weight
+
+    def observe_first_byte(self, seconds):
+        alpha = ewma_alpha()
+        self.first_byte = seconds if self.first_byte is None else self.first_byte + alpha * (seconds - self.first_byte)
+        metrics.BACKEND_FIRST_BYTE.set(self.stage, self.name, value=round(self.first_byte, 4))
+
+    def observe_outcome(self, ok):
+        self.error_rate += ewma_alpha() * ((0.0 if ok else 1.0) - self.error_rate)
+        if ok:
+            self.failures = 0
+            if self.open_until is not None:
+                self.close_circuit()
+            return
+
+        self.failures += 1
+        if self.open_until is not None:
+            # The probe failed: stay open, waiting twice as long before the next one.
+            self.open_circuit(min(self.open_seconds * 2, config('ROUTER_BREAKER_MAX_SECONDS', default=120, cast=float)))
+        elif self.failures >= config('ROUTER_BREAKER_FAILURES', default=3, cast=int) or \
+                self.error_rate >= config('ROUTER_BREAKER_ERROR_RATE', default=0.6, cast=float):
+            self.open_circuit(config('ROUTER_BREAKER_SECONDS', default=10, cast=float))
+
+    def open_circuit(self, seconds):
+        if self.open_until is None:
+            logger.warning("%s backend %s circuit opened (error rate %.2f)", self.stage, self.name, self.error_rate)
+        self.open_seconds = seconds
+        self.open_until = time.monotonic() + seconds
+        metrics.BACKEND_CIRCUIT_OPEN.set(self.stage, self.name, value=1)
+
+    def close_circuit(self):
+        logger.warning("%s backend %s circuit closed", self.stage, self.name)
+        self.open_until = None
+        self.open_seconds = 0.0
+        metrics.BACKEND_CIRCUIT_OPEN.set(self.stage, self.name, value=0)
+
+
+class Router:
+    """
+    Routes one stage's requests (LLM completions, TTS) across its configured backends:
+    - each request goes to the healthy backend with the best score (EWMA first byte, error rate, weight)
+    - a backend that keeps failing has its circuit opened for ROUTER_BREAKER_SECONDS; then a single probe
+      request is sent to it, closing the circuit on success or doubling the wait (up to ROUTER_BREAKER_MAX_SECONDS)
+    - a healthy backend that has not been used for ROUTER_PROBE_INTERVAL seconds also gets a probe, so
+      its EWMA catches up once a brownout is over
+    - probes are background copies of a live request, whose responses are dropped: the caller's own request
+      only goes to closed circuits (or, if every circuit is open, to just the one due soonest)
+    - a request that fails before responding, or gets a server error or credential rejection, moves on to the
+      next candidate (up to ROUTER_FAILOVER times)
+    With a single backend this is a plain `Upstream.post`.
+    """
+    def __init__(self, stage, backends):
+        self.stage = stage
+        self.backends = backends
+
+    def candidates(self):
+        """
+        Backends for a live request, best first.
+        """
+        closed = [backend for backend in self.backends if backend.open_until is None]
+        random.shuffle(closed)
+        closed.sort(key=Backend.score)
+        if not closed:
+            return [min(self.backends, key=lambda backend: backend.open_until)]
+        return closed[:1 + config('ROUTER_FAILOVER', default=1, cast=int)]
+
+    def next_probe(self, candidates):
+        """
+        A backend to probe alongside a live request going to `candidates`, marked as probing, or None.
+        """
+        now = time.monotonic()
+        due = sorted((backend for backend in self.backends if backend.open_until is not None and backend.open_until <= now),
+                     key=lambda backend: backend.open_until)
+        interval = config('ROUTER_PROBE_INTERVAL', default=30, cast=float)
+        idle = [backend for backend in self.backends if backend.open_until is None and now - backend.last_used >= interval]
+        probe = next((backend for backend in due + idle if backend is not candidates[0] and not backend.probing), None)
+        if probe is not None:
+            probe.probing = True
+            probe.last_used = now
+        return probe
+
+    async def probe(self, session, backend, url, kwargs):
+        started = time.perf_counter()
+        try:
+            async with backend.upstream.post(session, url, retries=0, hedge=False, **kwargs) as response:
+                if is_backend_fault(response.status):
+                    raise upstream.UpstreamError(f"{self.stage} backend {backend.name} HTTP {response.status}")
+                backend.observe_first_byte(time.perf_counter() - started)
+        except (upstream.UpstreamError, aiohttp.ClientError, TimeoutError) as e:
+            if isinstance(e, TimeoutError):
+                backend.observe_first_byte(time.perf_counter() - started)
+            backend.observe_outcome(False)
+            metrics.ROUTED_REQUESTS.inc(self.stage, backend.name, "probe_error")
+            logger.warning("%s backend %s probe failed: %r", self.stage, backend.name, e)
+        else:
+            backend.observe_outcome(True)
+            metrics.ROUTED_REQUESTS.inc(self.stage, backend.name, "probe_ok")
+        finally:
+            backend.probing = False
+
+    @contextlib.asynccontextmanager
+    async def post(self, session, request, retries=None, hedge=True):
+        """
+        POSTs to the best backend and yields the response once its headers are in. `request(backend)` returns
+        the backend's `(url, kwargs)` for `Upstream.post`; it is called once per backend tried, in order, so its
+        last call is for the backend that answered. Only the last candidate gets the stage's retries.
+        A backend due a probe gets its own copy of the request first, in the background.
+        """
+        candidates = self.candidates()
+        probe = self.next_probe(candidates)
+        if probe is not None:
+            url, kwargs = request(probe)
+            task = asyncio.create_task(self.probe(session, probe, url, kwargs), context=logs.worker_context())
+            probe_tasks.add(task)
+            task.add_done_callback(probe_tasks.discard)
+        async with contextlib.AsyncExitStack() as stack:
+            for index, backend in enumerate(candidates):
+                last = index == len(candidates) - 1
+                url, kwargs = request(backend)
+                backend.last_used = time.monotonic()
+                started = time.perf_counter()
+                try:
+                    response = await stack.enter_async_context(
+                        backend.upstream.post(session, url, retries=retries if last else 0, hedge=hedge, **kwargs))
+                    if is_backend_fault(response.status):
+                        response.release()
+                        raise upstream.UpstreamError(f"{self.stage} backend {backend.name} HTTP {response.status}")
+                except (upstream.UpstreamError, aiohttp.ClientError, TimeoutError) as e:
+                    if isinstance(e, TimeoutError):
+                        # A timed-out attempt is slow at least this much; keep that in the EWMA.
+                        backend.observe_first_byte(time.perf_counter() - started)
+                    backend.observe_outcome(False)
+                    metrics.ROUTED_REQUESTS.inc(self.stage, backend.name, "error")
+                    logs.record("route", stage=self.stage, backend=backend.name, outcome=repr(e))
+                    if last:
+                        raise
+                    logger.warning("%s backend %s failed, failing over: %r", self.stage, backend.name, e)
+                    continue
+                break
+
+            backend.observe_first_byte(time.perf_counter() - started)
+            logs.record("route", stage=self.stage, backend=backend.name, status=response.status)
+            try:
+                yield response
+            except Exception:
+                backend.observe_outcome(False)
+                metrics.ROUTED_REQUESTS.inc(self.stage, backend.name, "error")
+                raise
+            backend.observe_outcome(True)
+            metrics.ROUTED_REQUESTS.inc(self.stage, backend.name, "ok")
+
+
+def load_backends(stage, setting, stage_upstream, default, key_setting):
+    """
+    Backends from a JSON list setting, e.g.
+    LLM_BACKENDS='[{"name": "primary", "url": "...", "model": "gpt-4o-mini", "api_key_env": "OPENAI_API_KEY", "weight": 2}, ...]'.
+    Each entry has its key as `api_key`, or names the setting holding it in `api_key_env` (default `key_setting`).
+    Without the setting, the stage's single legacy backend is used.
+    """
+    entries = config(setting, default="", cast=lambda value: json.loads(value) if value else None) or [default()]
+    return [
+        Backend(stage, stage_upstream, entry.get("name", f"{stage}-{index}"), entry["url"], entry["model"],
+                entry.get("api_key") or config(entry.get("api_key_env", key_setting)), entry.get("weight", 1.0))
+        for index, entry in enumerate(entries)
+    ]
+
+
+routers = {}
+
+def llm():
+    if "llm" not in routers:
+        routers["llm"] = Router("llm", load_backends("llm", 'LLM_BACKENDS', upstream.OPENAI, lambda: {
+            "name": "openai", "url": config('OPENAI_API_ENDPOINT'), "model": config('OPENAI_MODEL')
+        }, 'OPENAI_API_KEY'))
+    return routers["llm"]
+
+def tts():
+    if "tts" not in routers:
+        routers["tts"] = Router("tts", load_backends("tts", 'TTS_BACKENDS', upstream.DEEPGRAM_TTS, lambda: {
+            "name": "deepgram", "url": config('DEEPGRAM_TTS_API_ENDPOINT'), "model": config('DEEPGRAM_TTS_MODEL')
+        }, 'DEEPGRAM_API_KEY'))
+    return routers["tts"]
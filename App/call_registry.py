@@ -0,0 +1,219 @@
+import asyncio, atexit, json, logging, os, signal, socket, time
+from decouple import config
+from . import conversation_context, logs
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+EXIT_DRAINED = 75                 # exit status of a worker that drained on purpose: `runworkers` does not restart it
+
+CALLS_KEY = "iris:calls"          # session id -> {worker, channel, started, state}
+WORKERS_KEY = "iris:workers"      # worker id -> {heartbeat, draining, calls}
+DRAIN_KEY = "iris:drain"          # worker ids / host names asked to drain
+RESERVATIONS_KEY = "iris:call_reservations"     # admission token -> expiry, for admitted calls not yet connected
+
+# Sets one call's state in place, so a concurrent re-registration or sweep is never overwritten by a stale copy.
+UPDATE_CALL_STATE = """
+local data = redis.call('HGET', KEYS[1], ARGV[1])
+if not data then return 0 end
+local call = cjson.decode(data)
+call['state'] = ARGV[2]
+redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(call))
+return 1
+"""
+
+# Takes a cluster call slot if live calls plus unexpired reservations are under the limit, atomically.
+RESERVE_CALL_SLOT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+if redis.call('HLEN', KEYS[1]) + redis.call('ZCARD', KEYS[2]) >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('ZADD', KEYS[2], tonumber(ARGV[1]) + tonumber(ARGV[2]), ARGV[4])
+return 1
+"""
+
+local_calls = {}                  # session id -> consumer, for calls owned by this worker
+local_reservations = {}           # admission token -> expiry (monotonic), for calls admitted on this worker
+draining = False
+heartbeat_task = None
+stop_tasks = set()                # `stop` of a drained worker, held until done so it is not garbage-collected
+
+
+def call_group(session_id):
+    """
+    Channel layer group a call's consumer joins, so any worker can send it commands.
+    """
+    return f"call.{session_id}"
+
+def heartbeat_interval():
+    return config('CALL_REGISTRY_HEARTBEAT', default=5, cast=int)
+
+async def register_call(session_id, channel, consumer, reservation=None):
+    """
+    Adds a connected call to the registry, consuming the slot its admission reserved (if any).
+    """
+    local_calls[session_id] = consumer
+    local_reservations.pop(reservation, None)
+    client = await conversation_context.get_redis_client()
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.hset(CALLS_KEY, session_id, json.dumps({
+            "worker": WORKER_ID, "channel": channel, "started": time.time(), "state": "connected"
+        }))
+        if reservation:
+            pipe.zrem(RESERVATIONS_KEY, reservation)
+        await pipe.execute()
+
+def reserve_local(token, limit, ttl):
+    """
+    Takes one of this worker's `limit` call slots for `token` if one is free (live calls plus reservations
+    that have not expired). There is no await between the check and the reservation.
+    """
+    now = time.monotonic()
+    for expired in [token for token, expiry in local_reservations.items() if expiry <= now]:
+        del local_reservations[expired]
+    if limit > 0 and len(local_calls) + len(local_reservations) >= limit:
+        return False
+    local_reservations[token] = now + ttl
+    return True
+
+async def reserve_slot(token, limit, ttl):
+    """
+    Takes one of the cluster's `limit` call slots for `token`; it is held until the call registers or `ttl` passes.
+    """
+    client = await conversation_context.get_redis_client()
+    return bool(await client.eval(RESERVE_CALL_SLOT, 2, CALLS_KEY, RESERVATIONS_KEY, time.time(), ttl, limit, token))
+
+async def release_reservation(token):
+    local_reservations.pop(token, None)
+    client = await conversation_context.get_redis_client()
+    await client.zrem(RESERVATIONS_KEY, token)
+
+async def update_call_state(session_id, state):
+    client = await conversation_context.get_redis_client()
+    await client.eval(UPDATE_CALL_STATE, 1, CALLS_KEY, session_id, state)
+
+async def unregister_call(session_id):
+    local_calls.pop(session_id, None)
+    try:
+        client = await conversation_context.get_redis_client()
+        await client.hdel(CALLS_KEY, session_id)
+    finally:
+        # A registry outage must not keep a draining worker from exiting.
+        if draining and not local_calls:
+            finish_drain()
+
+async def list_calls():
+    client = await conversation_context.get_redis_client()
+    return {session_id: json.loads(data) for session_id, data in (await client.hgetall(CALLS_KEY)).items()}
+
+async def cluster_call_count():
+    client = await conversation_context.get_redis_client()
+    return await client.hlen(CALLS_KEY)
+
+async def live_worker_count():
+    """
+    Workers heartbeating into the registry that are not draining.
+    """
+    client = await conversation_context.get_redis_client()
+    return sum(not json.loads(data)["draining"] for data in (await client.hvals(WORKERS_KEY)))
+
+async def send_command(session_id, command, **params):
+    """
+    Sends a command (e.g. "hangup") to whichever worker owns the call, over the channel layer.
+    """
+    from channels.layers import get_channel_layer
+    await get_channel_layer().group_send(call_group(session_id), {"type": "call.command", "command": command, **params})
+
+
+def start_drain():
+    """
+    Stops this worker taking new calls; it exits once its existing calls have ended.
+    """
+    global draining
+    if draining:
+        return
+    draining = True
+    logger.info("Worker draining: %s, %d calls left", WORKER_ID, len(local_calls))
+    if not local_calls:
+        finish_drain()
+
+def finish_drain():
+    logger.info("Worker drained: %s", WORKER_ID)
+    task = asyncio.create_task(stop())
+    stop_tasks.add(task)
+    task.add_done_callback(stopped)
+    atexit.register(exit_drained)
+    # Daphne stops its reactor cleanly on SIGTERM.
+    asyncio.get_running_loop().call_later(1, os.kill, os.getpid(), signal.SIGTERM)
+
+def stopped(task):
+    stop_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Call registry stop error: %s", task.exception())
+
+def exit_drained():
+    # Runs first of the exit handlers (they run last-registered first): flush the log queue, then exit
+    # with a status that tells the supervisor this worker is not to be replaced.
+    logs.stop()
+    os._exit(EXIT_DRAINED)
+
+def install_drain_signal():
+    """
+    SIGUSR1 starts a graceful drain (sent by `manage.py runworkers` on shutdown, or by deploy tooling).
+    """
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, start_drain)
+    except (NotImplementedError, RuntimeError, ValueError):
+        pass
+
+async def heartbeat():
+    """
+    Publishes this worker's liveness and picks up drain requests made through the registry.
+    Calls of workers that stopped heartbeating (crashed or killed) are swept from the registry.
+    """
+    client = await conversation_context.get_redis_client()
+    interval = heartbeat_interval()
+    beats = 0
+    while True:
+        try:
+            await client.hset(WORKERS_KEY, WORKER_ID, json.dumps({
+                "heartbeat": time.time(), "draining": draining, "calls": len(local_calls)
+            }))
+            if await client.smismember(DRAIN_KEY, [WORKER_ID, socket.gethostname()]) != [0, 0]:
+                start_drain()
+            if beats % 6 == 0:
+                await sweep_stale(client, interval * 3)
+        except Exception as e:
+            logger.warning("Call registry heartbeat error: %s", e)
+        beats += 1
+        await asyncio.sleep(interval)
+
+async def sweep_stale(client, max_age):
+    now = time.time()
+    workers = {worker: json.loads(data) for worker, data in (await client.hgetall(WORKERS_KEY)).items()}
+    stale = {worker for worker, data in workers.items() if now - data["heartbeat"] > max_age}
+    if stale:
+        await client.hdel(WORKERS_KEY, *stale)
+        await client.srem(DRAIN_KEY, *stale)
+
+    orphaned = []
+    for session_id, data in (await client.hgetall(CALLS_KEY)).items():
+        call = json.loads(data)
+        # A call of a worker that has not heartbeated yet is only orphaned once it is older than max_age.
+        if call["worker"] in stale or (call["worker"] not in workers and now - call["started"] > max_age):
+            orphaned.append(session_id)
+    if orphaned:
+        await client.hdel(CALLS_KEY, *orphaned)
+
+def start():
+    global heartbeat_task
+    install_drain_signal()
+    if heartbeat_task is None:
+        heartbeat_task = asyncio.create_task(heartbeat())
+
+async def stop():
+    if heartbeat_task:
+        heartbeat_task.cancel()
+    client = await conversation_context.get_redis_client()
+    await client.hdel(WORKERS_KEY, WORKER_ID)
+    await client.srem(DRAIN_KEY, WORKER_ID)
@@ -1,233 +1,587 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-import asyncio, aiohttp, json, time, uuid, base64
-from . import conversation_response, conversation_context
+import asyncio, json, time, uuid, base64, binascii
+from . import conversation_response, conversation_context, http_client, speech_synthesis, greeting_pool, audio_ingest, twilio_audio, metrics, call_registry, voice_activity, pipeline, admission, speech_recognition, logs, fillers, rate_limit
 from decouple import config
 
-class WebVoiceConsumer(AsyncWebsocketConsumer):
+class VoiceConsumer(AsyncWebsocketConsumer):
+    """
+    Call plumbing shared by both consumers:
+    - every background task of the call runs under one `TaskSupervisor`, cancelled on disconnect
+    - each reply (LLM -> TTS -> transport) runs as one tracked turn, a pipeline of bounded stages;
+      starting a new turn or the caller barging in cancels the one in flight
+    - each call logs with its session id and keeps a flight recorder of recent events, dumped on errors and slow turns
+    Subclasses set `channel` and, before speaking, `audio_out` (their outbound audio transport).
+    """
+    channel = None
+    admit_on_connect = True     # False where calls were already admitted before the websocket opened
+    turn_task = None
+    joined = False
+
+    def open_call_log(self):
+        session_id = self.scope["session"]["session_id"]
+        self.log = logs.call_logger(__name__, session_id, self.channel)
+        self.recorder = logs.start_recorder(session_id, self.channel)
+
+    async def join_call(self):
+        """
+        Registers the call in the cluster-wide registry and its command group.
+        Returns False, rejecting the websocket, if this worker is draining or the call is over capacity.
+        """
+        self.tasks = pipeline.TaskSupervisor(self.channel, self.log)
+        reservation = await admission.admit(self.channel) if self.admit_on_connect else None
+        if call_registry.draining or (self.admit_on_connect and reservation is None):
+            await self.reject_call()
+            return False
+
+        session_id = self.scope["session"]["session_id"]
+        self.joined = True
+        # Every connection is a new call (with a fresh session id), so there is no conversation to load.
+        await conversation_context.open_call_context(session_id, self.tasks)
+        try:
+            await call_registry.register_call(session_id, self.channel, self, reservation)
+            await self.channel_layer.group_add(call_registry.call_group(session_id), self.channel_name)
+        except Exception as e:
+            # Without the registry the call only loses cluster-wide listing and commands, so it goes on.
+            self.log.warning("Call registry error: %s", e)
+            metrics.UPSTREAM_ERRORS.inc("redis")
+        metrics.ACTIVE_CALLS.inc(self.channel)
+        metrics.CALLS.inc(self.channel)
+        return True
+
+    async def leave_call(self):
+        """
+        Stops everything the call still has running and removes it from the registry.
+        """
+        self.discard_speculation()
+        await self.tasks.cancel_all()
+        if not self.joined:
+            return
+        session_id = self.scope["session"]["session_id"]
+        metrics.ACTIVE_CALLS.dec(self.channel)
+        self.joined = False
+        try:
+            await self.channel_layer.group_discard(call_registry.call_group(session_id), self.channel_name)
+            await call_registry.unregister_call(session_id)
+        except Exception as e:
+            self.log.warning("Call registry error: %s", e)
+            metrics.UPSTREAM_ERRORS.inc("redis")
+
+    async def reject_call(self):
+        await self.close()
+
+    async def call_command(self, event):
+        """
+        Commands sent to this call from any worker through `call_registry.send_command`.
+        """
+        self.recorder.record("call_command", command=event["command"])
+        if event["command"] == "hangup":
+            await self.close()
+        elif event["command"] == "flush":
+            # Another worker is taking the call over: make Redis current.
+            context = conversation_context.live_contexts.get(self.scope["session"]["session_id"])
+            if context:
+                await context.flush()
+
+    async def start_turn(self, coro):
+        await self.cancel_turn()
+        self.turn_task = self.tasks.spawn(coro, "turn")
+
+    async def cancel_turn(self):
+        """
+        Cancels the in-flight turn, which closes its OpenAI and Deepgram TTS streams mid-read.
+        Returns True if a turn was interrupted.
+        """
+        task, self.turn_task = self.turn_task, None
+        if task is None or task.done():
+            return False
+
+        task.cancel()
+        await asyncio.wait([task])
+        self.recorder.record("turn_cancelled")
+        return True
+
+    # Speculative generation: start the completion on a stable interim transcript, commit it only if the final matches.
+    speculation = None          # (interim transcript, completion task)
+    stability_task = None
+    interim_transcript = None
+
+    def on_interim_transcript(self, transcript):
+        """
+        Restarts the stability timer whenever the interim transcript changes.
+        """
+        if not transcript or transcript == self.interim_transcript:
+            return
+        self.interim_transcript = transcript
+        if self.stability_task:
+            self.stability_task.cancel()
+        self.stability_task = self.tasks.spawn(self.speculate_when_stable(transcript), "speculation")
+
+    async def speculate_when_stable(self, transcript):
+        await asyncio.sleep(config('SPECULATIVE_STABLE_MS', default=250, cast=int) / 1000)
+        self.discard_speculation(keep_timer=True)
+        self.speculation = (transcript, self.tasks.spawn(
+            conversation_response.speculate(self.aiohttp_session, transcript, self.scope["session"]["session_id"]),
+            "speculation"
+        ))
+
+    def discard_speculation(self, keep_timer=False):
+        if not keep_timer:
+            self.interim_transcript = None
+        if self.stability_task and not keep_timer:
+            self.stability_task.cancel()
+            self.stability_task = None
+        if self.speculation:
+            self.speculation[1].cancel()
+            self.speculation = None
+            metrics.SPECULATION.inc("discarded")
+
+    async def claim_speculation(self, transcript):
+        """
+        Returns the speculative reply if it was generated for this final transcript, otherwise discards it and returns None.
+        """
+        speculation, self.speculation = self.speculation, None
+        self.interim_transcript = None
+        if self.stability_task:
+            self.stability_task.cancel()
+            self.stability_task = None
+        if speculation is None:
+            return None
+
+        interim, task = speculation
+        if conversation_response.normalize_transcript(interim) != conversation_response.normalize_transcript(transcript):
+            task.cancel()
+            metrics.SPECULATION.inc("discarded")
+            self.recorder.record("speculation", result="discarded")
+            return None
+
+        reply = await task
+        metrics.SPECULATION.inc("committed" if reply else "failed")
+        self.recorder.record("speculation", result="committed" if reply else "failed")
+        return reply
+
+    async def reply_for(self, transcript):
+        """
+        Reply segments for a final transcript. A matching speculative reply is committed to the context
+        (user and assistant message together, then folded into the summary like any turn once over budget);
+        otherwise the reply is generated now.
+        """
+        session_id = self.scope["session"]["session_id"]
+        reply = await self.claim_speculation(transcript)
+
+        if reply is None:
+            async for segment in conversation_response.get_response_segments(self.aiohttp_session, transcript, session_id):
+                yield segment
+            return
+
+        await conversation_context.append_conversation_messages(session_id, [
+            {"role": "user", "content": transcript},
+            {"role": "assistant", "content": reply}
+        ])
+        conversation_context.summarize_later(session_id, conversation_response.summarize)
+        async for segment in conversation_response.reply_segments(reply):
+            yield segment
+
+    async def speak(self, text, turn_timer=None, filler=False):
+        """
+        Speaks `text` (a string or an async iterator of reply segments) through `audio_out`.
+        Reply segments, synthesized audio chunks and transport writes are linked by bounded queues, so the
+        reply keeps streaming in while earlier segments are synthesized, and a slow caller connection holds
+        back synthesis instead of piling audio up in memory.
+        With `filler`, a pre-synthesized filler clip starts playing at once and the reply is queued behind it.
+        """
+        audio_out = self.audio_out
+        lead_in = fillers.library.pick(audio_out.audio_format) if filler else None
+        # Written alongside the reply request, so pacing the filler out never delays the LLM or TTS.
+        filler_task = self.tasks.spawn(audio_out.write(lead_in), "filler") if lead_in else None
+        if lead_in:
+            self.recorder.record("filler", bytes=len(lead_in))
+            metrics.AUDIO_BYTES.inc(self.channel, "outbound", amount=len(lead_in))
+
+        rate_limited = False
+
+        async def synthesize(segment):
+            nonlocal rate_limited
+            if rate_limited:
+                return
+            try:
+                async for chunk in speech_synthesis.synthesize(self.aiohttp_session, segment, audio_out.audio_format):
+                    yield chunk
+            except rate_limit.RateLimited:
+                # Out of TTS budget: say the (preseeded) fallback line once, rather than leave the caller in silence.
+                rate_limited = True
+                self.log.warning("TTS rate limited, playing the fallback reply")
+                audio = await speech_synthesis.cached_phrase(conversation_response.FALLBACK_REPLY, audio_out.audio_format)
+                if audio:
+                    yield audio
+
+        async def play(chunk):
+            if filler_task:
+                await filler_task
+            await audio_out.write(chunk)
+            metrics.AUDIO_BYTES.inc(self.channel, "outbound", amount=len(chunk))
+            if turn_timer:
+                turn_timer.audio_sent()
+
+        try:
+            await pipeline.run_stages(conversation_response.iter_segments(text), [synthesize], play)
+            if filler_task:
+                await filler_task
+        finally:
+            if filler_task:
+                filler_task.cancel()
+        await audio_out.finish()
+        if turn_timer:
+            turn_timer.finished()
+
+
+class WebVoiceConsumer(VoiceConsumer):
+    channel = "web"
+
+    async def reject_call(self):
+        # Accept first so the page can show why, instead of treating it as a broken connection.
+        await self.accept()
+        await self.send(text_data=json.dumps({"command": "busy", "message": admission.BUSY_MESSAGE}))
+        await self.close(code=4503)
+
     async def connect(self):
         self.scope["session"]["session_id"] = str(uuid.uuid4())
+        self.open_call_log()
         self.recording = False           # True if actively recording
         self.user_stop = False           # True if user manually stops recording
-        self.aiohttp_session = aiohttp.ClientSession()
-        self.deepgram_ws = None
+        self.aiohttp_session = await http_client.get_http_session()
+        # One STT stream for the whole call, opened on the first `start` (opus in webm stays well under 8 kB/s).
+        self.stt = speech_recognition.TranscriptionStream(self.aiohttp_session, "web", bytes_per_second=8000, replay_header=True)
+        self.stt_task = None
+        self.listening_since = None
+        self.turn_timer = None
+        self.audio_out = pipeline.WebAudioTransport(self.send)
 
+        if not await self.join_call():
+            return
         await self.accept()
-        print("WebSocket Connected: ", self.scope["session"]["session_id"])
+        self.tasks.spawn(self.stt.keepalive(), "stt_keepalive")
+        self.log.info("Web call connected")
 
     async def receive(self, text_data=None, bytes_data=None):
         if text_data:
             message = json.loads(text_data)
             command = message.get("command")
+            self.recorder.record("command", command=command)
     
             if command == "start":
+                await self.cancel_turn()
                 self.recording = True
                 self.user_stop = False    
-                self.deepgram_ws = await self.aiohttp_session.ws_connect(
-                    f"{config('DEEPGRAM_WS_URL')}?model={config('DEEPGRAM_STT_MODEL')}"
-                    f"&smart_format=true&interim_results=false&endpointing={config('DEEPGRAM_STT_ENDPOINTING')}",
-                    headers={"Authorization": f"Token {config('DEEPGRAM_API_KEY')}"}
-                )
-                asyncio.create_task(self.speech_to_text())
+                self.listening_since = time.time()
+                self.turn_timer = metrics.TurnTimer("web")
+                if self.stt_task is None or self.stt_task.done():
+                    # Audio arriving before the socket is up is buffered by the stream, not dropped.
+                    self.stt_task = self.tasks.spawn(self.speech_to_text(), "stt")
     
             elif command == "stop":
                 self.recording = False
                 self.user_stop = True
-                if self.deepgram_ws:
-                    await self.deepgram_ws.close()
-                self.deepgram_ws = None
     
-        elif bytes_data and self.recording and self.deepgram_ws:
-            await self.deepgram_ws.send_bytes(bytes_data)
+        elif bytes_data:
+            # The browser records one continuous webm stream, paused between turns. Every chunk goes to Deepgram
+            # so it can keep decoding it; transcripts only count while recording.
+            if self.recording and self.turn_timer.audio_started is None:
+                self.turn_timer.speech_started()
+            metrics.AUDIO_BYTES.inc("web", "inbound", amount=len(bytes_data))
+            await self.stt.send(bytes_data)
     
     async def speech_to_text(self):
         """
-        Listens to Deepgram's WebSocket for final transcription messages.
-        - If a final transcript is non-empty, sends it immediately.
-        - If a final transcript is empty, waits until 10 seconds. If no non-empty final transcript is received still, send the 'auto_stop' command to frontend.
+        Listens to the call's Deepgram stream for final transcription messages while the user is recording.
+        - If a final transcript is non-empty, sends it immediately and starts the reply.
+        - If final transcripts stay empty for SPEECH_INACTIVITY_THRESHOLD seconds of recording, sends the 'auto_stop' command to frontend.
+        The stream stays open between turns (kept alive while Iris speaks), so the next `start` transcribes right away.
         """
-        speech_session_start = time.time()
         inactivity_threshold = config('SPEECH_INACTIVITY_THRESHOLD', cast=int)
 
         try:
-            async for message in self.deepgram_ws:
-                if message.type == aiohttp.WSMsgType.TEXT:
-                    response = json.loads(message.data)
-                    transcript = response.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "").strip()
+            async for response in self.stt.messages():
+                if not self.recording or response.get("type", "Results") != "Results":
+                    continue
+                transcript = speech_recognition.transcript_of(response)
+
+                if not response.get("is_final", True):
+                    self.on_interim_transcript(transcript)
+                    continue
+                
+                if transcript:
+                    self.recording = False
+                    self.recorder.record("transcript", text=transcript)
+                    self.turn_timer.final_transcript()
+
+                    # Non-empty final transcript
+                    await self.send(text_data=json.dumps({
+                        "command":"user_speech_end",
+                        "transcription": transcript
+                    }))
                     
-                    if transcript:
-                        self.recording = False
-
-                        # Non-empty final transcript
-                        await self.send(text_data=json.dumps({
-                            "command":"user_speech_end",
-                            "transcription": transcript
-                        }))
-                        
-                        gpt_response = await conversation_response.get_response(self.aiohttp_session, transcript, self.scope["session"]["session_id"])
-                        
-                        # Convert OpenAI response to speech via Deepgram TTS and stream audio.
-                        asyncio.create_task(self.text_to_speech(gpt_response))
-                        break
-                    else:
-                        # Final transcript is empty - indicating speech inactivity
-                        if time.time() - speech_session_start >= inactivity_threshold:
-                            # 30 seconds of empty final transcripts detected: auto-stop.
-                            await self.send(text_data=json.dumps({
-                                "command": "auto_stop"
-                            }))
-                            break
+                    gpt_response = self.reply_for(transcript)
+                    
+                    # Convert OpenAI response to speech via Deepgram TTS sentence by sentence as it streams in.
+                    await self.start_turn(self.text_to_speech(gpt_response, self.turn_timer, filler=True))
+                elif time.time() - self.listening_since >= inactivity_threshold:
+                    # Only empty final transcripts since recording started: auto-stop.
+                    self.recording = False
+                    self.recorder.record("auto_stop")
+                    await self.send(text_data=json.dumps({
+                        "command": "auto_stop"
+                    }))
 
         except Exception as e:
-            print("Deepgram WS error:", e)
+            self.log.warning("Deepgram STT error: %s", e)
+            self.recorder.dump("Deepgram STT error", error=repr(e))
+            metrics.UPSTREAM_ERRORS.inc("deepgram_stt")
 
         finally:
             self.recording = False
-            if self.deepgram_ws:
-                await self.deepgram_ws.close()
-            self.deepgram_ws = None
 
-    async def text_to_speech(self, text):
+    async def text_to_speech(self, text, turn_timer=None, filler=False):
+        """
+        Streams Deepgram TTS audio (mp3) to the client.
+        `text` is a string or an async iterator of reply segments; segments are synthesized in order and played back to back.
+        """
+        spoken = []
 
-        TTS_URL = f"{config('DEEPGRAM_TTS_API_ENDPOINT')}?model={config('DEEPGRAM_TTS_MODEL')}&encoding=mp3"
-        headers = {
-            "Authorization": f"Token {config('DEEPGRAM_API_KEY')}",
-            "Content-Type": "application/json"
-        }
-        payload = { "text": text }
+        async def record(segments):
+            async for segment in segments:
+                spoken.append(segment)
+                yield segment
 
         try:
-           async with self.aiohttp_session.post(TTS_URL, json=payload, headers=headers) as response:
-                async for chunk in response.content.iter_chunked(1024):
-                    if chunk:
-                        await self.send(bytes_data=chunk)
+            await self.speak(record(conversation_response.iter_segments(text)), turn_timer, filler)
 
-        
         except Exception as e:
-            print('Deepgram TTS error: ', e)
+            self.log.warning("Deepgram TTS error: %s", e)
+            self.recorder.dump("Deepgram TTS error", error=repr(e))
+            metrics.UPSTREAM_ERRORS.inc("deepgram_tts")
         finally:
             await self.send(text_data=json.dumps({
                 "command": "final",
-                "response": text,
+                "response": " ".join(spoken),
                 "auto_restart": not self.user_stop
             }))
 
     
     async def disconnect(self, close_code):
-        print("WebSocket Disconnected", self.scope["session"]["session_id"])
-        if self.deepgram_ws:
-            await self.deepgram_ws.close()
-        if self.aiohttp_session:
-            await self.aiohttp_session.close()
+        self.log.info("Web call disconnected: %s", close_code)
+        await self.leave_call()
+        await self.stt.close()
 
         await conversation_context.remove_conversation_context(key=self.scope["session"]["session_id"])
-        self.deepgram_ws, self.aiohttp_session = None, None
+        self.aiohttp_session = None
 
 
-class TwilioVoiceConsumer(AsyncWebsocketConsumer):
+class TwilioVoiceConsumer(VoiceConsumer):
+    channel = "twilio"
+    admit_on_connect = False    # admitted by the voice webhook (views.receive_twilio_call)
+
     async def connect(self):
         self.scope["session"]["session_id"] = str(uuid.uuid4())
-        self.aiohttp_session = aiohttp.ClientSession()
-        self.deepgram_ws = None
+        self.open_call_log()
+        self.aiohttp_session = await http_client.get_http_session()
+        self.stt = speech_recognition.TranscriptionStream(self.aiohttp_session, "twilio", bytes_per_second=8000)
+        self.audio_out = None
+        self.watchdog_task = None
+        self.caller_speaking = False
+        self.last_activity = time.time()
+
+        # Local VAD keeps silence away from Deepgram; the endpointing silence after speech still goes through.
+        self.inbound_gate = None
+        if config('VAD_ENABLED', default=True, cast=bool):
+            self.inbound_gate = voice_activity.VoiceActivityGate(
+                self.forward_audio, keepalive=self.stt.keep_alive,
+                on_speech_start=self.on_local_speech_start, on_speech_end=self.on_local_speech_end,
+                pre_roll_ms=config('VAD_PRE_ROLL_MS', default=300, cast=int),
+                hangover_ms=config('VAD_HANGOVER_MS', default=config('DEEPGRAM_STT_ENDPOINTING', default=300, cast=int) + 500, cast=int),
+                min_rms=config('VAD_MIN_RMS', default=200, cast=float)
+            )
+        # Twilio sends ~20 ms (160 byte) frames; batch them into larger writes to Deepgram.
+        self.inbound_audio = audio_ingest.AudioCoalescer(
+            self.inbound_gate.add if self.inbound_gate else self.forward_audio,
+            flush_bytes=config('TWILIO_INGEST_FLUSH_BYTES', default=800, cast=int),
+            flush_interval=config('TWILIO_INGEST_FLUSH_MS', default=100, cast=int) / 1000,
+            spawn=lambda coro: self.tasks.spawn(coro, "audio_flush")
+        )
+        self.turn_timer = metrics.TurnTimer("twilio")
 
+        if not await self.join_call():
+            return
         await self.accept()
-        print("Twilio WebSocket Connected: ", self.scope["session"]["session_id"])
+        self.log.info("Twilio call connected")
 
     async def receive(self, text_data=None, bytes_data=None):
         if text_data:
+            payload = audio_ingest.extract_media_payload(text_data)
+            if payload is not None:
+                await self.inbound_audio.add(binascii.a2b_base64(payload))
+                return
+
             data = json.loads(text_data)
             event = data.get('event')
             if event == 'start':
-                self.deepgram_ws = await self.aiohttp_session.ws_connect(
-                    f"{config('DEEPGRAM_WS_URL')}?model={config('DEEPGRAM_STT_MODEL')}"
-                    f"&smart_format=true&interim_results=false&endpointing={config('DEEPGRAM_STT_ENDPOINTING')}&encoding=mulaw&sample_rate=8000",
-                    headers={"Authorization": f"Token {config('DEEPGRAM_API_KEY')}"}
-                )
                 self.streamSid = data['start']['streamSid']
-                greet_prompt = "Greet with humor and tell your name. Ask what's me on my mind?"
-                greet_user = await conversation_response.get_response(self.aiohttp_session, greet_prompt, user_session=self.scope["session"]["session_id"], no_context=True)
-                await self.text_to_speech(greet_user)
+                self.recorder.record("stream_start", stream_sid=self.streamSid)
+                # The call is registered now: give back the slot the voice webhook reserved for it.
+                reservation = data['start'].get('customParameters', {}).get('reservation')
+                if reservation:
+                    self.tasks.spawn(call_registry.release_reservation(reservation), "reservation")
+                self.audio_out = twilio_audio.TwilioAudioWriter(
+                    self.send, self.streamSid,
+                    frame_ms=config('TWILIO_OUTBOUND_FRAME_MS', default=100, cast=int),
+                    lead_ms=config('TWILIO_OUTBOUND_LEAD_MS', default=500, cast=int),
+                    mark_interval_ms=config('TWILIO_MARK_INTERVAL_MS', default=1000, cast=int)
+                )
+
+                # Greet straight from the pre-generated pool, falling back to a live LLM+TTS greeting when it is empty.
+                greeting = greeting_pool.pool.take()
+                self.recorder.record("greeting", pooled=greeting is not None)
+                if greeting:
+                    await self.start_turn(self.play_audio(greeting.audio))
+                else:
+                    greet_user = conversation_response.get_response_segments(self.aiohttp_session, greeting_pool.GREET_PROMPT, user_session=self.scope["session"]["session_id"], no_context=True)
+                    await self.start_turn(self.text_to_speech(greet_user))
+                greeting_pool.pool.start(self.aiohttp_session)
+                self.tasks.spawn(call_registry.update_call_state(self.scope["session"]["session_id"], "streaming"), "call_state")
 
-                asyncio.create_task(self.speech_to_text())
+                # Transcribe in parallel with the greeting; media frames are buffered until the STT socket is up.
+                self.tasks.spawn(self.speech_to_text(), "stt")
+                self.tasks.spawn(self.stt.keepalive(), "stt_keepalive")
+                self.watchdog_task = self.tasks.spawn(self.inactivity_watchdog(), "watchdog")
                 
             elif event == 'media':
                 audio_chunk_b64 = data['media']['payload']
-                if self.deepgram_ws:
-                    await self.deepgram_ws.send_bytes(base64.b64decode(audio_chunk_b64))
+                await self.inbound_audio.add(base64.b64decode(audio_chunk_b64))
                 
+            elif event == 'mark':
+                # Twilio has played our audio up to this mark.
+                self.audio_out.acknowledge(data['mark']['name'])
+
             elif event == 'stop':
-                if self.deepgram_ws:
-                    await self.deepgram_ws.close()
-                    self.deepgram_ws = None
+                # Call is over: nothing left to clear on Twilio's side.
+                self.recorder.record("stream_stop")
+                self.stop_watchdog()
+                await super().cancel_turn()
+                await self.inbound_audio.flush()
+                await self.stt.close()
        
-    async def speech_to_text(self):
-        speech_session_start = time.time()
+    async def forward_audio(self, audio):
+        metrics.AUDIO_BYTES.inc("twilio", "inbound", amount=len(audio))
+        await self.stt.send(audio)
+
+    def on_local_speech_start(self):
+        self.caller_speaking = True
+        self.last_activity = time.time()
+
+    def on_local_speech_end(self):
+        self.caller_speaking = False
+        self.last_activity = time.time()
+
+    async def inactivity_watchdog(self):
+        """
+        Prompts the caller after SPEECH_INACTIVITY_THRESHOLD seconds in which neither side has spoken.
+        Runs locally off VAD and transcript events, so it does not depend on Deepgram sending empty finals.
+        """
         inactivity_threshold = config('SPEECH_INACTIVITY_THRESHOLD', cast=int)
+        while True:
+            await asyncio.sleep(1)
+            idle = (not self.caller_speaking and not self.audio_out.playing
+                    and (self.turn_task is None or self.turn_task.done()))
+            if idle and time.time() - max(self.last_activity, self.audio_out.finished_at) >= inactivity_threshold:
+                self.last_activity = time.time()
+                self.recorder.record("inactivity_prompt")
+                await self.start_turn(self.text_to_speech(speech_synthesis.INACTIVITY_PROMPT))
+
+    def stop_watchdog(self):
+        if self.watchdog_task:
+            self.watchdog_task.cancel()
+            self.watchdog_task = None
+
+    async def speech_to_text(self):
+        barge_in_on_speech = config('BARGE_IN_ON_SPEECH_START', default=True, cast=bool)
 
         try:
-            async for message in self.deepgram_ws:
-                if message.type == aiohttp.WSMsgType.TEXT:
-                    response = json.loads(message.data)
-                    transcript = response.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "").strip()
-                    
-                    if transcript:
-                        
-                        gpt_response = await conversation_response.get_response(self.aiohttp_session, transcript, self.scope["session"]["session_id"])
-                        # Convert OpenAI response to speech via Deepgram TTS and stream audio.
-                        asyncio.create_task(self.text_to_speech(gpt_response))
-                        speech_session_start = time.time()
-
-                    elif time.time() - speech_session_start >= inactivity_threshold:
-                        # Final transcript is empty - indicating speech inactivity
-                        gpt_response = "Hello? Are we playing the world’s quietest game of charades? Speak up dear!"
-                        # 30 seconds of empty transcripts detected: prompt the user to talk lol.
-                        asyncio.create_task(self.text_to_speech(gpt_response))
-                        speech_session_start = time.time()
+            async for response in self.stt.messages():
+                if response.get("type") == "SpeechStarted":
+                    self.recorder.record("speech_started")
+                    self.last_activity = time.time()
+                    self.turn_timer.speech_started()
+                    # Caller started talking over Iris: stop the reply in flight.
+                    if barge_in_on_speech:
+                        await self.cancel_turn()
+                    continue
+                elif response.get("type", "Results") != "Results":
+                    continue
 
-        except Exception as e:
-            print("Deepgram WS error:", e)
+                transcript = speech_recognition.transcript_of(response)
 
-        finally:
-            if self.deepgram_ws:
-                await self.deepgram_ws.close()
-            self.deepgram_ws = None
+                if not response.get("is_final", True):
+                    self.on_interim_transcript(transcript)
+                    continue
+                
+                if transcript:
+                    self.recorder.record("transcript", text=transcript)
+                    turn_timer, self.turn_timer = self.turn_timer, metrics.TurnTimer("twilio")
+                    turn_timer.final_transcript()
+
+                    gpt_response = self.reply_for(transcript)
+                    # Convert OpenAI response to speech via Deepgram TTS sentence by sentence as it streams in.
+                    await self.start_turn(self.text_to_speech(gpt_response, turn_timer, filler=True))
+                    self.last_activity = time.time()
+
+        except Exception as e:
+            self.log.warning("Deepgram STT error: %s", e)
+            self.recorder.dump("Deepgram STT error", error=repr(e))
+            metrics.UPSTREAM_ERRORS.inc("deepgram_stt")
      
 
-    async def text_to_speech(self, text):
-        TTS_URL = f"{config('DEEPGRAM_TTS_API_ENDPOINT')}?model={config('DEEPGRAM_TTS_MODEL')}&encoding=mulaw&sample_rate=8000&container=none"
-        headers = {
-            "Authorization": f"Token {config('DEEPGRAM_API_KEY')}",
-            "Content-Type": "application/json"
-        }
-        payload = { "text": text }
-        
+    async def text_to_speech(self, text, turn_timer=None, filler=False):
+        """
+        Streams Deepgram TTS audio (8 kHz mulaw) to Twilio.
+        `text` is a string or an async iterator of reply segments; segments are synthesized in order and played back to back.
+        """
+        try:
+            await self.speak(text, turn_timer, filler)
+
+        except Exception as e:
+            self.log.warning("Deepgram TTS error: %s", e)
+            self.recorder.dump("Deepgram TTS error", error=repr(e))
+            metrics.UPSTREAM_ERRORS.inc("deepgram_tts")
+
+    async def cancel_turn(self):
+        """
+        Cancels the in-flight turn and, if Iris is still audible, flushes Twilio's buffered audio with a `clear` event.
+        """
+        interrupted = await super().cancel_turn()
+        if self.audio_out and (interrupted or self.audio_out.playing):
+            await self.audio_out.clear()
+        return interrupted
+
+    async def play_audio(self, audio):
+        """
+        Streams already synthesized mulaw audio (e.g. a pooled greeting) to Twilio.
+        """
         try:
-           await self.send(text_data=json.dumps({"event": "start", })) 
-
-           async with self.aiohttp_session.post(TTS_URL, json=payload, headers=headers) as response:
-                async for chunk in response.content.iter_chunked(1024):
-                    if chunk:
-                        encoded_chunk = base64.b64encode(chunk).decode("utf-8")
-                        await self.send(text_data=json.dumps({
-                            "event": "media",
-                            "streamSid": self.streamSid,
-                            "media": {
-                                "payload": encoded_chunk
-                                }
-                        }))
-
-           await self.send(text_data=json.dumps({"event": "stop"}))
+            await self.audio_out.write(audio)
+            await self.audio_out.finish()
 
         except Exception as e:
-            print('Twilio Deepgram TTS error: ', e)
+            self.log.warning("Audio playback error: %s", e)
+            self.recorder.dump("Audio playback error", error=repr(e))
 
 
     async def disconnect(self, close_code):
-        print("Twilio WS disconnected: ", self.scope["session"]["session_id"])
-        if self.deepgram_ws:
-            await self.deepgram_ws.close()
-        if self.aiohttp_session:
-            await self.aiohttp_session.close()
+        self.log.info("Twilio call disconnected: %s", close_code)
+        await self.leave_call()
+        self.inbound_audio.close()
+        if self.inbound_gate:
+            self.inbound_gate.close()
+        await self.stt.close()
 
         await conversation_context.remove_conversation_context(key=self.scope["session"]["session_id"])
-        self.deepgram_ws, self.aiohttp_session = None, None
+        self.aiohttp_session = None
 
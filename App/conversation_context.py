@@ -1,10 +1,160 @@
-import json
+import asyncio, json, logging
 import redis.asyncio as aredis
 from typing import List
 from decouple import config
+from . import metrics
+
+logger = logging.getLogger(__name__)
 
 redis_client = None
 
+CONTEXT_TTL = 7200
+CONTEXT_KEY_PREFIX = "conversation:"
+SUMMARY_KEY_PREFIX = "conversation_summary:"
+
+# Moves a pre-list context (one JSON string under the bare session key) into the list key, atomically.
+MIGRATE_LEGACY_CONTEXT = """
+local legacy = redis.call('GET', KEYS[1])
+if not legacy then return 0 end
+local messages = cjson.decode(legacy)
+for i = #messages, 1, -1 do
+    redis.call('LPUSH', KEYS[2], cjson.encode(messages[i]))
+end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+redis.call('DEL', KEYS[1])
+return #messages
+"""
+
+live_contexts = {}      # session key -> CallContext, for calls owned by this worker
+
+
+class CallContext:
+    """
+    In-memory conversation of a call owned by this worker. Prompts are built straight from it, and new
+    messages are written behind to Redis (the durable copy other workers fail over to): appends made within
+    CONTEXT_FLUSH_MS of each other go out together in one pipelined round trip, off the turn's critical path.
+    Once the messages pass CONTEXT_SUMMARIZE_TOKENS, `summarize_later` folds all but the most recent
+    CONTEXT_VERBATIM_TOKENS of them into the rolling `summary`, in the background.
+    Both background jobs run under the call's `TaskSupervisor`, `tasks`.
+    """
+    def __init__(self, key, tasks, messages=None, summary=""):
+        self.key = key
+        self.tasks = tasks
+        self.messages = messages or []
+        self.summary = summary
+        self.unflushed = []
+        self.flush_timer = None
+        self.summary_task = None
+        self.lock = asyncio.Lock()
+
+    def window(self):
+        return fit_window(self.summary, self.messages)
+
+    def extend(self, messages):
+        self.messages.extend(messages)
+        self.unflushed.extend(messages)
+        if self.flush_timer is None:
+            self.flush_timer = self.tasks.spawn(self.flush_later(), "context_flush")
+
+    async def flush_later(self):
+        await asyncio.sleep(config('CONTEXT_FLUSH_MS', default=200, cast=int) / 1000)
+        self.flush_timer = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Writes everything not yet in Redis. Failed writes stay queued for the next flush.
+        """
+        async with self.lock:
+            await self.write_unflushed()
+
+    async def write_unflushed(self):
+        messages, self.unflushed = self.unflushed, []
+        if not messages:
+            return
+        try:
+            await write_conversation_messages(self.key, messages)
+        except Exception as e:
+            logger.warning("Conversation context flush error: %s", e, extra={"session": self.key})
+            metrics.UPSTREAM_ERRORS.inc("redis")
+            self.unflushed[:0] = messages
+
+    def summarize_later(self, summarize):
+        """
+        Starts folding older messages into the summary if they are over CONTEXT_SUMMARIZE_TOKENS and no fold is
+        running. `summarize(summary, messages)` returns the new summary, or None if it could not make one.
+        """
+        if self.summary_task is not None and not self.summary_task.done():
+            return
+        if count_tokens(self.messages) > config('CONTEXT_SUMMARIZE_TOKENS', default=1000, cast=int):
+            self.summary_task = self.tasks.spawn(self.fold(summarize), "context_summary")
+
+    async def fold(self, summarize):
+        verbatim = recent_messages(self.messages, config('CONTEXT_VERBATIM_TOKENS', default=500, cast=int))
+        folded = self.messages[:len(self.messages) - len(verbatim)]
+        if not folded:
+            return
+        summary = await summarize(self.summary, folded)
+        if not summary:
+            return
+
+        async with self.lock:
+            # Everything must be in Redis before its list is trimmed down to what comes after the folded messages.
+            await self.write_unflushed()
+            if self.unflushed:
+                return
+            try:
+                await save_summary(self.key, summary, len(self.messages) - len(folded))
+            except Exception as e:
+                logger.warning("Conversation summary write error: %s", e, extra={"session": self.key})
+                metrics.UPSTREAM_ERRORS.inc("redis")
+                return
+            # Messages appended while summarizing went on the end; the folded ones are still the first.
+            self.messages = self.messages[len(folded):]
+            self.summary = summary
+        metrics.CONTEXT_SUMMARIES.inc()
+
+    def discard(self):
+        """
+        Drops pending writes, for a conversation that is about to be deleted anyway.
+        """
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+        if self.summary_task is not None:
+            self.summary_task.cancel()
+            self.summary_task = None
+        self.unflushed = []
+
+
+async def open_call_context(key: str, tasks, resume: bool = False) -> CallContext:
+    """
+    Takes ownership of a call's conversation on this worker. With `resume` (a known call moving over from
+    another worker) it picks up whatever Redis already holds for it; a new call starts empty, without a
+    round trip. Its background writes run under `tasks`.
+    """
+    summary, messages = "", []
+    if resume:
+        try:
+            summary, messages = await read_conversation(key)
+        except Exception as e:
+            logger.warning("Conversation context load error: %s", e, extra={"session": key})
+            metrics.UPSTREAM_ERRORS.inc("redis")
+    context = CallContext(key, tasks, messages, summary)
+    live_contexts[key] = context
+    return context
+
+async def flush_call_contexts() -> None:
+    await asyncio.gather(*(context.flush() for context in list(live_contexts.values())))
+
+def summarize_later(key: str, summarize) -> None:
+    """
+    See `CallContext.summarize_later`; conversations of calls owned by other workers are left alone.
+    """
+    context = live_contexts.get(key)
+    if context is not None:
+        context.summarize_later(summarize)
+
 async def get_redis_client():
     """
     Lazily initialize and return a Redis client connection pool.
@@ -14,26 +164,167 @@ async def get_redis_client():
         redis_client = await aredis.from_url(config('REDIS_URL'), decode_responses=True)
     return redis_client
 
-async def update_conversation_context(key: str, role: str, msg: str) -> None:
+def context_key(key: str) -> str:
+    return f"{CONTEXT_KEY_PREFIX}{key}"
+
+def summary_key(key: str) -> str:
+    return f"{SUMMARY_KEY_PREFIX}{key}"
+
+def context_window() -> int:
+    """
+    Number of most recent messages read back for the prompt (0 reads the whole conversation).
+    """
+    return config('CONVERSATION_CONTEXT_WINDOW', default=40, cast=int)
+
+def count_tokens(messages: List[dict]) -> int:
+    # ~4 characters per token for English, plus a few tokens of per-message overhead.
+    return sum(len(message["content"]) // 4 + 4 for message in messages)
+
+def recent_messages(messages: List[dict], budget: int) -> List[dict]:
+    """
+    The longest run of most recent messages that fits in `budget` tokens (always at least the last one).
+    """
+    used, start = 0, len(messages)
+    while start > 0:
+        used += count_tokens(messages[start - 1:start])
+        if used > budget and start < len(messages):
+            break
+        start -= 1
+    return messages[start:]
+
+def summary_message(summary: str) -> dict:
+    return {"role": "developer", "content": f"Summary of the conversation so far: {summary}"}
+
+def fit_window(summary: str, messages: List[dict]) -> List[dict]:
+    """
+    Prompt context: the rolling summary, then the most recent messages verbatim, together within
+    CONTEXT_TOKEN_BUDGET tokens (and at most CONVERSATION_CONTEXT_WINDOW messages).
+    """
+    window = context_window()
+    messages = messages[-window:] if window > 0 else messages
+    prefix = [summary_message(summary)] if summary else []
+    budget = config('CONTEXT_TOKEN_BUDGET', default=1500, cast=int) - count_tokens(prefix)
+    return prefix + recent_messages(messages, budget)
+
+def encode_messages(messages: List[dict]) -> List[str]:
+    return [json.dumps(message) for message in messages]
+
+def decode_messages(data: List[str]) -> List[dict]:
+    return [json.loads(item) for item in data]
+
+def window_range(window: int):
+    return (-window, -1) if window > 0 else (0, -1)
+
+async def migrate_conversation_context(key: str) -> int:
+    """
+    Migration path for contexts written before the list layout (JSON blob under the bare session key).
+    Returns the number of migrated messages.
+    """
     client = await get_redis_client()
+    with metrics.Timer(metrics.REDIS_SECONDS, "migrate"):
+        return await client.eval(MIGRATE_LEGACY_CONTEXT, 2, key, context_key(key), CONTEXT_TTL)
+
+async def append_conversation_context(key: str, role: str, msg: str) -> int:
+    """
+    Appends one message (see `append_conversation_messages`). Returns the conversation length.
+    """
+    return await append_conversation_messages(key, [{"role": role, "content": msg}])
 
-    data = await client.get(key)
-    data = json.loads(data) if data else []
-    
-    data.append({"role": role, "content": msg})
+async def append_conversation_messages(key: str, messages: List[dict]) -> int:
+    """
+    Appends several messages (e.g. a committed user/assistant exchange). Calls owned by this worker
+    append in memory and write behind; otherwise this is one pipelined round trip.
+    """
+    context = live_contexts.get(key)
+    if context is not None:
+        context.extend(messages)
+        return len(context.messages)
+    return await write_conversation_messages(key, messages)
 
-    await client.set(key, json.dumps(data), ex=7200)
-    return data
+async def write_conversation_messages(key: str, messages: List[dict]) -> int:
+    client = await get_redis_client()
+    list_key = context_key(key)
 
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.rpush(list_key, *encode_messages(messages))
+        pipe.expire(list_key, CONTEXT_TTL)
+        pipe.expire(summary_key(key), CONTEXT_TTL)
+        with metrics.Timer(metrics.REDIS_SECONDS, "append"):
+            length, _, _ = await pipe.execute()
+    return length
 
-async def get_conversation_context(key: str) -> List[dict]:
+async def save_summary(key: str, summary: str, keep: int) -> None:
+    """
+    Stores the rolling summary and trims the list to the `keep` most recent messages it does not cover,
+    atomically, so a worker taking the call over never sees a message both summarized and verbatim.
+    """
     client = await get_redis_client()
-    data = await client.get(key)
-    if not data:
-        return []
-    
-    return json.loads(data)
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.set(summary_key(key), summary, ex=CONTEXT_TTL)
+        if keep:
+            pipe.ltrim(context_key(key), -keep, -1)
+        else:
+            pipe.delete(context_key(key))
+        with metrics.Timer(metrics.REDIS_SECONDS, "summarize"):
+            await pipe.execute()
+
+async def update_conversation_context(key: str, role: str, msg: str) -> List[dict]:
+    """
+    Appends a message, refreshes the TTL and reads back the prompt window in a single pipelined round trip
+    (or, for a call owned by this worker, appends in memory and returns the window without touching Redis).
+    """
+    context = live_contexts.get(key)
+    if context is not None:
+        context.extend([{"role": role, "content": msg}])
+        return context.window()
+
+    client = await get_redis_client()
+    list_key = context_key(key)
+
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.rpush(list_key, *encode_messages([{"role": role, "content": msg}]))
+        pipe.expire(list_key, CONTEXT_TTL)
+        pipe.lrange(list_key, *window_range(context_window()))
+        pipe.get(summary_key(key))
+        with metrics.Timer(metrics.REDIS_SECONDS, "append_read"):
+            length, _, data, summary = await pipe.execute()
+
+    if length == 1 and await migrate_conversation_context(key):
+        return await get_conversation_context(key)
+
+    return fit_window(summary or "", decode_messages(data))
+
+
+async def read_conversation(key: str):
+    """
+    The stored rolling summary ("" if none) and the messages after it, read in one round trip.
+    """
+    client = await get_redis_client()
+    list_key = context_key(key)
+
+    async with client.pipeline(transaction=False) as pipe:
+        pipe.lrange(list_key, *window_range(context_window()))
+        pipe.get(summary_key(key))
+        with metrics.Timer(metrics.REDIS_SECONDS, "read"):
+            data, summary = await pipe.execute()
+    if not data and await migrate_conversation_context(key):
+        data = await client.lrange(list_key, *window_range(context_window()))
+
+    return summary or "", decode_messages(data)
+
+async def get_conversation_context(key: str) -> List[dict]:
+    context = live_contexts.get(key)
+    if context is not None:
+        return context.window()
+
+    summary, messages = await read_conversation(key)
+    return fit_window(summary, messages)
 
 async def remove_conversation_context(key: str) -> None:
+    context = live_contexts.pop(key, None)
+    if context is not None:
+        context.discard()
+
     client = await get_redis_client()
-    await client.delete(key)
+    with metrics.Timer(metrics.REDIS_SECONDS, "delete"):
+        await client.delete(context_key(key), summary_key(key), key)
@@ -1,5 +1,8 @@
-from . import conversation_context
+from . import conversation_context, http_client, logs, metrics, rate_limit, backend_router, upstream
 from decouple import config
+import json, re, time, logging
+
+logger = logging.getLogger(__name__)
 
 developer_prompt = """
                     Your task is to waste the time of the user you are talking to by engaging them in real-life conversations like Daisy O2 bot. 
@@ -10,15 +13,48 @@ developer_prompt = """
                     to sound natural like human. Your responses cannot exceed 50 words, should not contain emojis, and avoid abbreviations. Remember to be funny, engaging, and entertaining!
                    """.strip()
 
-async def get_response(aiohttp_session, user_query, user_session, no_context=False):
-    headers = {
-        "Authorization": f"Bearer {config('OPENAI_API_KEY')}",
+summary_prompt = """
+                    Summarize this phone conversation between Iris and her friend so Iris can carry on with it later.
+                    Keep names, facts and plans the friend mentioned, running jokes and the current topic.
+                    Write at most 100 words of plain prose, building on the earlier summary if there is one.
+                 """.strip()
+
+ERROR_REPLY = "There appears to be an error. Please try again later."
+FALLBACK_REPLY = "I'm having trouble responding right now."
+RATE_LIMITED_REPLY = "Hold on... give me a second to catch my breath. What were you saying?"
+
+# Boundaries at which a partial reply can be handed to TTS while the rest is still being generated.
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+(?=[^\s.!?])')
+CLAUSE_BOUNDARY = re.compile(r'[,;:]\s+')
+
+
+def openai_headers(backend):
+    return {
+        "Authorization": f"Bearer {backend.api_key}",
         "Content-Type": "application/json"
     }
-    
+
+def completion_request(payload):
+    """
+    Builds the chat completion request for whichever LLM backend the router picks: its endpoint, model and key.
+    """
+    def request(backend):
+        return backend.url, {"json": {**payload, "model": backend.model}, "headers": openai_headers(backend)}
+    return request
+
+async def build_prompt(user_query, user_session, no_context=False, persist=True):
+    """
+    Developer prompt plus the conversation so far and the new user message.
+    With `persist=False` the user message is only added to the prompt, not written to the stored context.
+    """
     current_context = None
-    if not no_context:
+    if not no_context and persist:
         current_context = await conversation_context.update_conversation_context(key=user_session, role="user", msg=user_query)
+        # Older turns are folded into the rolling summary in the background, off this turn's critical path.
+        conversation_context.summarize_later(user_session, summarize)
+    elif not no_context:
+        current_context = await conversation_context.get_conversation_context(key=user_session)
+        current_context.append({"role": "user", "content": user_query})
     else:
         current_context = [{
           "role": "user",
@@ -32,20 +68,205 @@ async def get_response(aiohttp_session, user_query, user_session, no_context=Fal
         }
     ]
     prompt.extend(current_context)
-    
+    return prompt
+
+def build_payload(prompt, stream=False):
     payload = {
-        "model": config('OPENAI_MODEL'),
         "messages": prompt,
         "max_tokens": 60,
         "temperature": 0.7
     }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+async def summarize(summary, messages):
+    """
+    Folds `messages` into the rolling conversation `summary` with a background completion.
+    Returns the new summary, or None if it could not be made.
+    """
+    transcript = "\n".join(f"{'Iris' if message['role'] == 'assistant' else 'Friend'}: {message['content']}" for message in messages)
+    if summary:
+        transcript = f"Earlier summary: {summary}\n\n{transcript}"
+    prompt = [{"role": "developer", "content": summary_prompt}, {"role": "user", "content": transcript}]
+    payload = {**build_payload(prompt), "max_tokens": config('CONTEXT_SUMMARY_MAX_TOKENS', default=200, cast=int), "temperature": 0.3}
+    if not await rate_limit.acquire_llm(prompt, payload["max_tokens"], priority="background"):
+        return None
+
+    try:
+        session = await http_client.get_http_session()
+        async with backend_router.llm().post(session, completion_request(payload), hedge=False) as response:
+            if response.status != 200:
+                raise upstream.UpstreamError(f"openai HTTP {response.status}")
+            response_json = await response.json()
+            return (response_json.get("choices", [{}])[0].get("message", {}).get("content") or "").strip() or None
+    except Exception as e:
+        logger.warning("Conversation summary error: %s", e)
+        metrics.UPSTREAM_ERRORS.inc("openai")
+        return None
+
+def split_segments(buffer, min_chars=None, clause_chars=None):
+    """
+    Splits speakable segments off the front of a partially generated reply.
+    - A sentence is released once it is at least `min_chars` long.
+    - A clause (comma, colon, semicolon) is released once it is at least `clause_chars` long.
+    Returns the released segments and the remaining, still incomplete, text.
+    """
+    min_chars = min_chars if min_chars is not None else config('TTS_SEGMENT_MIN_CHARS', default=12, cast=int)
+    clause_chars = clause_chars if clause_chars is not None else config('TTS_CLAUSE_MIN_CHARS', default=60, cast=int)
+
+    boundaries = sorted(
+        [(m.end(), min_chars) for m in SENTENCE_BOUNDARY.finditer(buffer)] +
+        [(m.end(), clause_chars) for m in CLAUSE_BOUNDARY.finditer(buffer)]
+    )
+
+    segments, start = [], 0
+    for end, threshold in boundaries:
+        if end <= start:
+            continue
+        segment = buffer[start:end].strip()
+        if len(segment) >= threshold:
+            segments.append(segment)
+            start = end
+
+    return segments, buffer[start:]
+
+async def get_response(aiohttp_session, user_query, user_session, no_context=False, priority="live"):
+    prompt = await build_prompt(user_query, user_session, no_context)
+    payload = build_payload(prompt)
+    if not await rate_limit.acquire_llm(prompt, payload["max_tokens"], priority):
+        return RATE_LIMITED_REPLY
+
     try:
-        async with aiohttp_session.post(config('OPENAI_API_ENDPOINT'), json=payload, headers=headers) as response:
+        started = time.perf_counter()
+        async with backend_router.llm().post(aiohttp_session, completion_request(payload)) as response:
+            if response.status != 200:
+                raise upstream.UpstreamError(f"openai HTTP {response.status}")
+            metrics.UPSTREAM_SECONDS.observe("openai", "first_byte", value=time.perf_counter() - started)
             response_json = await response.json()
-            reply = response_json.get("choices", [{}])[0].get("message", {}).get("content", "There appears to be an error. Please try again later.")
+            metrics.UPSTREAM_SECONDS.observe("openai", "total", value=time.perf_counter() - started)
+            reply = response_json.get("choices", [{}])[0].get("message", {}).get("content", ERROR_REPLY)
             if not no_context:
-                await conversation_context.update_conversation_context(key=user_session, role="assistant", msg=reply)
+                await conversation_context.append_conversation_context(key=user_session, role="assistant", msg=reply)
             return reply
     except Exception as e:
-        print("OpenAI API error:", e)
-        return "I'm having trouble responding right now."
\ No newline at end of file
+        logger.warning("OpenAI API error: %s", e, extra={"session": user_session})
+        logs.dump("OpenAI API error", error=repr(e))
+        metrics.UPSTREAM_ERRORS.inc("openai")
+        return FALLBACK_REPLY
+
+async def speculate(aiohttp_session, user_query, user_session):
+    """
+    Speculative completion for an interim transcript. Nothing is written to the context; the caller commits
+    the exchange once the final transcript confirms it. Returns the reply, or None if the request failed.
+    """
+    prompt = await build_prompt(user_query, user_session, persist=False)
+    payload = build_payload(prompt)
+    if not await rate_limit.acquire_llm(prompt, payload["max_tokens"], priority="background"):
+        return None
+
+    try:
+        started = time.perf_counter()
+        async with backend_router.llm().post(aiohttp_session, completion_request(payload), retries=0, hedge=False) as response:
+            if response.status != 200:
+                raise upstream.UpstreamError(f"openai HTTP {response.status}")
+            metrics.UPSTREAM_SECONDS.observe("openai", "first_byte", value=time.perf_counter() - started)
+            response_json = await response.json()
+            metrics.UPSTREAM_SECONDS.observe("openai", "total", value=time.perf_counter() - started)
+            return response_json.get("choices", [{}])[0].get("message", {}).get("content")
+    except Exception as e:
+        logger.warning("OpenAI API error: %s", e, extra={"session": user_session})
+        logs.dump("OpenAI API error", error=repr(e))
+        metrics.UPSTREAM_ERRORS.inc("openai")
+        return None
+
+async def stream_response(aiohttp_session, user_query, user_session, no_context=False):
+    """
+    Streams the OpenAI chat completion (SSE) and yields the reply in speakable segments
+    (sentences, or long clauses) as soon as each one is complete, so TTS can start before
+    the model has finished generating. The full reply is stored in the context once the stream ends.
+    """
+    prompt = await build_prompt(user_query, user_session, no_context)
+    payload = build_payload(prompt, stream=True)
+
+    reply, buffer = "", ""
+    try:
+        if not await rate_limit.acquire_llm(prompt, payload["max_tokens"]):
+            raise rate_limit.RateLimited("openai")
+        started = time.perf_counter()
+        async with backend_router.llm().post(aiohttp_session, completion_request(payload)) as response:
+            if response.status != 200:
+                raise upstream.UpstreamError(f"openai HTTP {response.status}")
+            async for line in response.content:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                choices = json.loads(data).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+
+                if not reply:
+                    metrics.UPSTREAM_SECONDS.observe("openai", "first_byte", value=time.perf_counter() - started)
+                reply += delta
+                segments, buffer = split_segments(buffer + delta)
+                for segment in segments:
+                    yield segment
+
+        metrics.UPSTREAM_SECONDS.observe("openai", "total", value=time.perf_counter() - started)
+
+    except rate_limit.RateLimited:
+        # Over the shared OpenAI budget: stall politely rather than collect a 429 mid-conversation.
+        reply = buffer = RATE_LIMITED_REPLY
+    except Exception as e:
+        logger.warning("OpenAI API error: %s", e, extra={"session": user_session})
+        logs.dump("OpenAI API error", error=repr(e))
+        metrics.UPSTREAM_ERRORS.inc("openai")
+        if not reply:
+            reply = buffer = FALLBACK_REPLY
+
+    if not reply:
+        reply = buffer = ERROR_REPLY
+    if buffer.strip():
+        yield buffer.strip()
+
+    if not no_context:
+        await conversation_context.append_conversation_context(key=user_session, role="assistant", msg=reply.strip())
+
+async def get_response_segments(aiohttp_session, user_query, user_session, no_context=False):
+    """
+    Yields the reply in speakable segments. Streams from OpenAI when OPENAI_STREAMING is enabled,
+    otherwise yields the complete reply as a single segment.
+    """
+    if config('OPENAI_STREAMING', default=True, cast=bool):
+        async for segment in stream_response(aiohttp_session, user_query, user_session, no_context):
+            yield segment
+    else:
+        yield await get_response(aiohttp_session, user_query, user_session, no_context)
+
+async def iter_segments(text):
+    """
+    Normalizes TTS input: a plain string becomes a single segment, an async iterator is passed through.
+    """
+    if isinstance(text, str):
+        yield text
+    else:
+        async for segment in text:
+            yield segment
+
+async def reply_segments(reply):
+    """
+    Splits an already generated reply into speakable segments, so TTS can start on the first sentence.
+    """
+    segments, remainder = split_segments(reply + " ")
+    for segment in segments:
+        yield segment
+    if remainder.strip():
+        yield remainder.strip()
+
+def normalize_transcript(transcript):
+    return " ".join(re.sub(r"[^\w\s']", " ", transcript.lower()).split())
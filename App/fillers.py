@@ -0,0 +1,70 @@
+import asyncio, logging, random
+import numpy as np
+from decouple import config
+from . import audio, speech_synthesis
+
+logger = logging.getLogger(__name__)
+
+# Short acknowledgements Iris says while the reply is still being generated.
+FILLER_PHRASES = ["Hmm...", "Oh, okay...", "Mm-hmm...", "Uh, right...", "Oh, hmm..."]
+
+
+def enabled():
+    return config('FILLERS_ENABLED', default=True, cast=bool)
+
+def trim_trailing_silence(clip, threshold=300, tail_ms=40):
+    """
+    Cuts the silence TTS leaves at the end of a mulaw clip, so the reply follows the filler without a pause.
+    """
+    pcm = audio.mulaw_to_pcm(clip).astype(np.int32)
+    loud = np.flatnonzero(np.abs(pcm) > threshold)
+    if not len(loud):
+        return clip
+    return clip[:loud[-1] + 1 + tail_ms * 8]
+
+
+class FillerLibrary:
+    """
+    Pre-synthesized filler clips for each outbound audio format (mp3 for the browser, mulaw for Twilio), held in
+    memory for the life of the worker rather than in the evictable TTS cache. A turn starts one playing as soon
+    as the caller's final transcript is in, and the reply audio is queued straight behind it.
+    """
+    def __init__(self, phrases):
+        self.phrases = phrases
+        self.clips = {}         # encoding -> clips
+        self.last = {}          # encoding -> clip played last
+
+    async def load(self, aiohttp_session, formats=(speech_synthesis.WEB_AUDIO, speech_synthesis.TWILIO_AUDIO)):
+        if not enabled():
+            return
+        speech_synthesis.shared_phrases.update(self.phrases)
+        for audio_format in formats:
+            clips = await asyncio.gather(*(self.synthesize(aiohttp_session, phrase, audio_format) for phrase in self.phrases))
+            self.clips[audio_format["encoding"]] = [clip for clip in clips if clip]
+
+    async def synthesize(self, aiohttp_session, phrase, audio_format):
+        try:
+            chunks = [chunk async for chunk in speech_synthesis.synthesize(aiohttp_session, phrase, audio_format, priority="background")]
+        except Exception as e:
+            logger.warning("Filler synthesis error: %s", e)
+            return None
+        clip = b"".join(chunks)
+        if not speech_synthesis.is_audio(clip):
+            logger.warning("Filler synthesis error: TTS returned no audio for %r", phrase)
+            return None
+        return trim_trailing_silence(clip) if audio_format["encoding"] == "mulaw" else clip
+
+    def pick(self, audio_format):
+        """
+        Returns a filler clip in `audio_format`, not the one played last, or None if there is none.
+        """
+        encoding = audio_format["encoding"]
+        clips = self.clips.get(encoding)
+        if not clips or not enabled():
+            return None
+        clip = random.choice([clip for clip in clips if clip is not self.last.get(encoding)] or clips)
+        self.last[encoding] = clip
+        return clip
+
+
+library = FillerLibrary(FILLER_PHRASES)
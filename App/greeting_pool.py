@@ -0,0 +1,63 @@
+import asyncio, logging
+from collections import namedtuple
+from decouple import config
+from . import conversation_response, logs, speech_synthesis
+
+logger = logging.getLogger(__name__)
+
+GREET_PROMPT = "Greet with humor and tell your name. Ask what's me on my mind?"
+
+Greeting = namedtuple("Greeting", ["text", "audio"])
+
+
+class GreetingPool:
+    """
+    Background-refilled pool of ready-to-play call greetings (text plus pre-synthesized Twilio mulaw audio),
+    so a call can start speaking without waiting on an LLM and TTS round trip.
+    """
+    def __init__(self, size):
+        self.greetings = asyncio.Queue(maxsize=size)
+        self.refill_task = None
+
+    def start(self, aiohttp_session):
+        if self.greetings.maxsize > 0 and (self.refill_task is None or self.refill_task.done()):
+            self.refill_task = asyncio.create_task(self.refill(aiohttp_session), context=logs.worker_context())
+
+    def take(self):
+        """
+        Returns a ready greeting, or None if the pool is empty.
+        """
+        try:
+            return self.greetings.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+    async def refill(self, aiohttp_session):
+        while True:
+            greeting = await self.generate(aiohttp_session)
+            if greeting is None:
+                # Upstream trouble: back off instead of hammering OpenAI/Deepgram.
+                await asyncio.sleep(config('GREETING_POOL_RETRY_DELAY', default=5, cast=int))
+                continue
+            await self.greetings.put(greeting)
+
+    async def generate(self, aiohttp_session):
+        try:
+            # Background work: gives way to live calls when the shared upstream budgets run low.
+            text = await conversation_response.get_response(aiohttp_session, GREET_PROMPT, user_session=None, no_context=True, priority="background")
+            if text in (conversation_response.FALLBACK_REPLY, conversation_response.ERROR_REPLY, conversation_response.RATE_LIMITED_REPLY):
+                return None
+
+            chunks = [chunk async for chunk in speech_synthesis.synthesize(aiohttp_session, text, speech_synthesis.TWILIO_AUDIO, priority="background")]
+            audio = b"".join(chunks)
+            if not speech_synthesis.is_audio(audio):
+                logger.warning("Greeting pool error: TTS returned no audio for %r", text)
+                return None
+            return Greeting(text, audio)
+
+        except Exception as e:
+            logger.warning("Greeting pool error: %s", e)
+            return None
+
+
+pool = GreetingPool(config('GREETING_POOL_SIZE', default=8, cast=int))
@@ -0,0 +1,51 @@
+import asyncio, aiohttp, logging
+from decouple import config
+from . import backend_router
+
+logger = logging.getLogger(__name__)
+
+http_session = None
+
+async def get_http_session():
+    """
+    Lazily initialize and return the aiohttp session shared by every call on this worker.
+    One keep-alive connection pool (with DNS cache and per-host limits) serves OpenAI and Deepgram
+    for all consumers, so calls reuse warm TCP/TLS connections instead of opening their own.
+    """
+    global http_session
+    if http_session is None or http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=config('HTTP_POOL_LIMIT', default=512, cast=int),
+            limit_per_host=config('HTTP_POOL_LIMIT_PER_HOST', default=256, cast=int),
+            ttl_dns_cache=config('HTTP_DNS_CACHE_TTL', default=300, cast=int),
+            keepalive_timeout=config('HTTP_KEEPALIVE_TIMEOUT', default=60, cast=int),
+            enable_cleanup_closed=True
+        )
+        http_session = aiohttp.ClientSession(connector=connector)
+    return http_session
+
+async def warm_endpoint(session, url):
+    try:
+        async with session.head(url) as response:
+            await response.read()
+    except Exception as e:
+        logger.warning("Upstream warmup error: %s %s", url, e)
+
+async def warmup():
+    """
+    Opens keep-alive connections to every LLM and TTS backend ahead of the first call,
+    so the first turn (or the first failover) does not pay for DNS, TCP and TLS handshakes.
+    """
+    session = await get_http_session()
+    connections = config('HTTP_WARMUP_CONNECTIONS', default=2, cast=int)
+    endpoints = [backend.url for router in (backend_router.llm(), backend_router.tts()) for backend in router.backends]
+
+    await asyncio.gather(*(
+        warm_endpoint(session, url) for url in endpoints for _ in range(connections)
+    ))
+
+async def close_http_session():
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+    http_session = None
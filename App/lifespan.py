@@ -0,0 +1,68 @@
+import asyncio
+from . import http_client, speech_synthesis, speech_recognition, greeting_pool, metrics, call_registry, conversation_context, fillers
+
+monitor_task = None
+startup_task = None
+
+
+async def startup():
+    """
+    Per-worker startup work: join the call registry, warm upstream connections, pre-seed the TTS cache
+    and start filling the STT socket and greeting pools before calls arrive.
+    """
+    global monitor_task
+    if monitor_task is None:
+        monitor_task = asyncio.create_task(metrics.monitor_process())
+    call_registry.start()
+
+    aiohttp_session = await http_client.get_http_session()
+    await http_client.warmup()
+    speech_recognition.pool.start(aiohttp_session)
+    greeting_pool.pool.start(aiohttp_session)
+    await speech_synthesis.preseed(aiohttp_session)
+    await fillers.library.load(aiohttp_session)
+
+def start():
+    """
+    Runs `startup` once per worker, however many times it is asked for; returns its task.
+    """
+    global startup_task
+    if startup_task is None:
+        startup_task = asyncio.create_task(startup())
+    return startup_task
+
+async def shutdown():
+    await conversation_context.flush_call_contexts()
+    await call_registry.stop()
+    await speech_recognition.pool.close()
+    await http_client.close_http_session()
+
+
+class LifespanMiddleware:
+    """
+    ASGI middleware running the worker's startup and shutdown hooks.
+    - Servers implementing the ASGI lifespan protocol get the hooks on lifespan startup/shutdown.
+    - Daphne does not send lifespan events. Workers started by `runworkers` (`manage.py daphneworker`)
+      finish startup before they accept connections; a plain `daphne` only kicks it off in the background
+      on the first scope it sees, so its first calls may find cold connections and empty pools.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        start()
+        return await self.app(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
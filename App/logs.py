@@ -0,0 +1,125 @@
+import atexit, collections, contextvars, datetime, json, logging, logging.handlers, queue, sys, time
+from decouple import config
+
+logger = logging.getLogger(__name__)
+listener = None
+
+# Attributes every LogRecord has; anything else on a record came in through `extra` and is logged as a field.
+RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger and message, plus the record's `extra` fields
+    (session id, channel, ...).
+    """
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure():
+    """
+    Sends the App loggers through a queue: the event loop only enqueues records, and a listener thread
+    formats and writes them (JSON lines on stderr), so a slow log sink never stalls calls.
+    """
+    global listener
+    if listener is not None:
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(JsonFormatter())
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    app_logger = logging.getLogger("App")
+    app_logger.addHandler(logging.handlers.QueueHandler(records))
+    app_logger.setLevel(config('LOG_LEVEL', default='INFO'))
+    app_logger.propagate = False
+    listener.start()
+    atexit.register(stop)
+
+
+def stop():
+    """
+    Writes out whatever is still queued and stops the listener thread.
+    """
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def call_logger(name, session_id, channel):
+    """
+    Logger for one call: every record carries its session id and channel.
+    """
+    return logging.LoggerAdapter(logging.getLogger(name), {"session": session_id, "channel": channel})
+
+
+current_recorder = contextvars.ContextVar("flight_recorder", default=None)
+
+
+class FlightRecorder:
+    """
+    Bounded ring buffer (FLIGHT_RECORDER_SIZE events) of one call's recent events: commands, transcripts,
+    upstream statuses and turn timings. Recording is an append with no formatting or I/O; the buffer is
+    only logged by `dump`, when the call hits an error or a slow turn.
+    """
+    def __init__(self, session_id, channel):
+        self.session_id = session_id
+        self.channel = channel
+        self.events = collections.deque(maxlen=config('FLIGHT_RECORDER_SIZE', default=200, cast=int))
+        self.started = time.monotonic()
+
+    def record(self, event, **fields):
+        self.events.append((time.monotonic(), event, fields))
+
+    def dump(self, reason, **fields):
+        """
+        Logs the buffered events as one record and starts over, so the next dump only has what came after.
+        """
+        events = [{"t": round(at - self.started, 3), "event": event, **details} for at, event, details in self.events]
+        self.events.clear()
+        logger.warning("Flight recorder: %s", reason, extra={
+            "session": self.session_id, "channel": self.channel, "reason": reason, "events": events, **fields
+        })
+
+
+def start_recorder(session_id, channel):
+    """
+    Creates the call's flight recorder and makes it current for the consumer and every task it starts,
+    so shared code (upstream requests, STT, turn timers) can `record` without being handed it.
+    """
+    recorder = FlightRecorder(session_id, channel)
+    current_recorder.set(recorder)
+    return recorder
+
+def worker_context():
+    """
+    Context for worker-level tasks (pool refills and the like) that may be started from inside a call:
+    without it they would keep recording into that call's flight recorder for as long as they run.
+    """
+    context = contextvars.copy_context()
+    context.run(current_recorder.set, None)
+    return context
+
+def record(event, **fields):
+    recorder = current_recorder.get()
+    if recorder is not None:
+        recorder.record(event, **fields)
+
+def dump(reason, **fields):
+    recorder = current_recorder.get()
+    if recorder is not None:
+        recorder.dump(reason, **fields)
+
+def slow_turn_seconds():
+    return config('SLOW_TURN_SECONDS', default=2.0, cast=float)
@@ -0,0 +1,72 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from App import audio, voice_activity
+
+
+def throughput(fn, data, seconds):
+    """
+    Runs `fn(data)` repeatedly for about `seconds` on this one core; returns input MB/s.
+    """
+    fn(data)
+    runs, started = 0, time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        fn(data)
+        runs += 1
+    return runs * len(data) / (time.perf_counter() - started) / 1e6
+
+
+class Command(BaseCommand):
+    help = "Single-core throughput (MB/s of input) of the audio transcoding, resampling and VAD paths."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clip-seconds", type=float, default=10, help="Length of the audio processed per call.")
+        parser.add_argument("--chunk-ms", type=int, default=100, help="Chunk size for the streaming benchmarks.")
+        parser.add_argument("--seconds", type=float, default=1, help="Time spent on each benchmark.")
+
+    def handle(self, *args, **options):
+        clip, seconds = options["clip_seconds"], options["seconds"]
+        rng = np.random.default_rng(0)
+
+        def speech_like(rate):
+            t = np.arange(int(clip * rate)) / rate
+            tone = 6000 * np.sin(2 * np.pi * 220 * t) * (0.5 + 0.5 * np.sin(2 * np.pi * 3 * t))
+            return (tone + rng.normal(0, 300, len(t))).astype(np.int16)
+
+        pcm8k, pcm24k, pcm48k = (speech_like(rate).tobytes() for rate in (8000, 24000, 48000))
+        mulaw = audio.pcm_to_mulaw(pcm8k).tobytes()
+        alaw = audio.pcm_to_alaw(pcm8k).tobytes()
+        chunk = 8 * options["chunk_ms"]       # bytes of 8 kHz mulaw per chunk
+
+        def streamed(from_rate, to_rate, data):
+            size = from_rate * 2 * options["chunk_ms"] // 1000
+            def run(data):
+                resampler = audio.Resampler(from_rate, to_rate)
+                for start in range(0, len(data), size):
+                    resampler.process(data[start:start + size])
+            return run
+
+        def vad(data):
+            pcm = audio.mulaw_to_pcm(data)
+            for start in range(0, len(pcm), chunk):
+                voice_activity.frame_features(pcm[start:start + chunk], 160)
+
+        benchmarks = [
+            ("mulaw -> pcm16", audio.mulaw_to_pcm, mulaw),
+            ("alaw -> pcm16", audio.alaw_to_pcm, alaw),
+            ("pcm16 -> mulaw", audio.pcm_to_mulaw, memoryview(pcm8k)),
+            ("pcm16 -> alaw", audio.pcm_to_alaw, memoryview(pcm8k)),
+            ("normalize gain", audio.normalize_gain, pcm8k),
+            ("resample 8k -> 16k", lambda data: audio.resample(data, 8000, 16000), pcm8k),
+            ("resample 24k -> 8k", lambda data: audio.resample(data, 24000, 8000), pcm24k),
+            ("resample 48k -> 8k", lambda data: audio.resample(data, 48000, 8000), pcm48k),
+            (f"resample 24k -> 8k, {options['chunk_ms']} ms chunks", streamed(24000, 8000, pcm24k), pcm24k),
+            ("24k linear16 -> 8k mulaw", lambda data: audio.transcode(data, "linear16", 24000, "mulaw", 8000), pcm24k),
+            (f"VAD features, {options['chunk_ms']} ms chunks", vad, mulaw),
+        ]
+
+        self.stdout.write(f"{'benchmark':<40}{'MB/s':>10}{'x real time':>14}")
+        for name, fn, data in benchmarks:
+            rate = throughput(fn, data, seconds)
+            realtime = rate * 1e6 / (len(data) / clip)
+            self.stdout.write(f"{name:<40}{rate:>10.1f}{realtime:>14.0f}")
@@ -0,0 +1,366 @@
+import asyncio, base64, inspect, json, logging, multiprocessing, os, time, tracemalloc
+import aiohttp
+import fakeredis
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from channels.exceptions import StopConsumer
+from channels.layers import get_channel_layer
+from App import consumers, conversation_context, conversation_response, greeting_pool, http_client, pipeline, speech_recognition, speech_synthesis, twilio_audio, upstream_stubs
+from App.management.commands.bench_ingest import free_port, run_sink
+from App.management.commands.loadtest import FRAME_SECONDS, SILENCE, TWILIO_FRAME_BYTES, synthetic_speech
+
+STREAM_SID = "MZ00000000000000000000000000000000"
+
+# Outbound audio is not paced to real time and nothing prompts the caller during the replay.
+BENCH_ENVIRONMENT = {"TWILIO_OUTBOUND_LEAD_MS": "3600000", "SPEECH_INACTIVITY_THRESHOLD": "3600"}
+
+# Calls join groups on an in-process channel layer, so the measurements do not depend on a Redis server.
+BENCH_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def synthetic_session(utterances=3, speech_seconds=1.5, silence_seconds=1.0):
+    """
+    Deterministic Twilio media-stream session, one message per line as Twilio sends them:
+    `start`, alternating speech and silence media frames, `stop`.
+    """
+    messages = [json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"})]
+    messages.append(json.dumps({"event": "start", "sequenceNumber": "1", "streamSid": STREAM_SID,
+                                "start": {"streamSid": STREAM_SID, "tracks": ["inbound"],
+                                          "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}}}))
+    audio = (synthetic_speech(speech_seconds) + bytes([SILENCE]) * int(silence_seconds * 8000)) * utterances
+    for chunk, start in enumerate(range(0, len(audio) - TWILIO_FRAME_BYTES + 1, TWILIO_FRAME_BYTES)):
+        messages.append(json.dumps({
+            "event": "media", "sequenceNumber": str(chunk + 2), "streamSid": STREAM_SID,
+            "media": {"track": "inbound", "chunk": str(chunk + 1), "timestamp": str(int(chunk * FRAME_SECONDS * 1000)),
+                      "payload": base64.b64encode(audio[start:start + TWILIO_FRAME_BYTES]).decode()}
+        }, separators=(",", ":")))
+    messages.append(json.dumps({"event": "stop", "sequenceNumber": str(len(messages)), "streamSid": STREAM_SID}))
+    return messages
+
+def synthetic_deepgram_messages(transcript=upstream_stubs.STUB_TRANSCRIPT):
+    """
+    Deepgram live transcription messages of one utterance: speech start, growing interim results, the final
+    result and the empty final that follows in silence.
+    """
+    words = transcript.split()
+    messages = [json.dumps({"type": "SpeechStarted", "timestamp": 0.0})]
+    messages += [upstream_stubs.results_message(" ".join(words[:count]), is_final=False) for count in range(1, len(words) + 1)]
+    messages += [upstream_stubs.results_message(transcript), upstream_stubs.results_message("")]
+    return messages
+
+def recorded_transcripts(deepgram):
+    # The final, non-empty transcripts of the replayed Deepgram messages, in order.
+    messages = [json.loads(message) for message in deepgram]
+    transcripts = [speech_recognition.transcript_of(message) for message in messages
+                   if message.get("type", "Results") == "Results" and message.get("is_final")]
+    return [transcript for transcript in transcripts if transcript] or [upstream_stubs.STUB_TRANSCRIPT]
+
+def recorded_replies(completions):
+    # The assistant replies of recorded OpenAI chat completion responses (one JSON body per line).
+    return [json.loads(completion)["choices"][0]["message"]["content"] for completion in completions]
+
+def conversation(turns, transcripts, replies):
+    return [{"role": "user", "content": transcripts[turn // 2 % len(transcripts)]} if turn % 2 == 0 else
+            {"role": "assistant", "content": replies[turn // 2 % len(replies)]}
+            for turn in range(turns)]
+
+def read_lines(path):
+    with open(path) as lines:
+        return [line.rstrip("\n") for line in lines if line.strip()]
+
+
+class FakeTransport:
+    """
+    Stands in for the server side of the websocket (what daphne passes a consumer as `send`): counts the
+    messages the consumer sends and remembers when the last one went out.
+    """
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.last_sent = time.perf_counter()
+
+    async def __call__(self, message):
+        self.messages += 1
+        self.bytes += len(message.get("text") or message.get("bytes") or b"")
+        self.last_sent = time.perf_counter()
+
+async def open_twilio_call():
+    """
+    A real TwilioVoiceConsumer, connected through a `FakeTransport` and the configured channel layer.
+    """
+    transport = FakeTransport()
+    consumer = consumers.TwilioVoiceConsumer()
+    consumer.scope = {"type": "websocket", "path": "/ws/twilio/", "headers": [], "session": {}}
+    consumer.channel_layer = get_channel_layer()
+    consumer.channel_name = await consumer.channel_layer.new_channel()
+    consumer.base_send = transport
+    await consumer.websocket_connect({"type": "websocket.connect"})
+    return consumer, transport
+
+async def close_call(consumer):
+    try:
+        await consumer.websocket_disconnect({"type": "websocket.disconnect", "code": 1000})
+    except StopConsumer:
+        pass
+
+async def settle(consumer, transport, quiet=0.5, timeout=30):
+    # Waits for the replayed call to go quiet: no turn running and nothing sent for `quiet` seconds.
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+        busy = consumer.turn_task is not None and not consumer.turn_task.done()
+        if not busy and time.perf_counter() - transport.last_sent >= quiet:
+            return
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the per-frame and per-turn hot paths (CPU time and memory per operation) by replaying a "
+            "Twilio media-stream session and Deepgram/OpenAI messages through the real consumer code, and fails "
+            "when an operation regresses past --threshold against a --baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--session", help="Twilio media-stream session to replay: one websocket message per line.")
+        parser.add_argument("--deepgram", help="Deepgram live transcription messages to replay: one per line. "
+                                                "The stub STT serves their final transcripts, in order.")
+        parser.add_argument("--completions", help="OpenAI chat completion responses the stub LLM serves, in order: one JSON body per line.")
+        parser.add_argument("--write-session", help="Write the built-in synthetic session to this file and exit.")
+        parser.add_argument("--iterations", type=int, default=2000, help="Operations per timed batch.")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed batches per operation; the fastest counts.")
+        parser.add_argument("--replays", type=int, default=3, help="Whole-call replays (timed once, as a single batch).")
+        parser.add_argument("--context-messages", type=int, default=40, help="Conversation length for the context and prompt benchmarks.")
+        parser.add_argument("--only", action="append", help="Run only operations whose name starts with this (repeatable).")
+        parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against.")
+        parser.add_argument("--save", help="Write the results JSON here (e.g. to become the next baseline).")
+        parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown / memory growth over the baseline (0.25 = 25%%).")
+
+    def handle(self, *args, **options):
+        if options["write_session"]:
+            with open(options["write_session"], "w") as session:
+                session.write("\n".join(synthetic_session()) + "\n")
+            return
+
+        session = read_lines(options["session"]) if options["session"] else synthetic_session()
+        deepgram = read_lines(options["deepgram"]) if options["deepgram"] else synthetic_deepgram_messages()
+        replies = recorded_replies(read_lines(options["completions"])) if options["completions"] else [upstream_stubs.STUB_REPLY]
+        transcripts = recorded_transcripts(deepgram)
+        if not any(is_media(message) for message in session):
+            raise CommandError("The session has no media frames to replay")
+        if not replies:
+            raise CommandError("There are no completions to serve")
+
+        # Keep per-call logging and background greeting generation out of the measurements.
+        logging.getLogger("App").setLevel(logging.WARNING)
+        greeting_pool.pool = greeting_pool.GreetingPool(0)
+        os.environ.update(BENCH_ENVIRONMENT)
+
+        stub_port, sink_port = free_port(), free_port()
+        servers = [
+            multiprocessing.Process(target=upstream_stubs.run_stub_server, args=("127.0.0.1", stub_port, upstream_stubs.StubLatency(stt=0, llm_ttft=0, llm_tps=10_000, tts_ttfb=0, tts_speed=1000), transcripts, replies), daemon=True),
+            multiprocessing.Process(target=run_sink, args=(sink_port,), daemon=True),
+        ]
+        for server in servers:
+            server.start()
+        stubs = upstream_stubs.stub_environment("127.0.0.1", stub_port)
+        os.environ.update(stubs)
+        try:
+            with override_settings(CHANNEL_LAYERS=BENCH_CHANNEL_LAYERS):
+                results = asyncio.run(self.run(session, deepgram, transcripts, replies, options, stubs["DEEPGRAM_WS_URL"], f"ws://127.0.0.1:{sink_port}/"))
+        finally:
+            for server in servers:
+                server.terminate()
+
+        self.report(results)
+        if options["save"]:
+            with open(options["save"], "w") as saved:
+                json.dump(results, saved, indent=2, sort_keys=True)
+        if options["baseline"]:
+            with open(options["baseline"]) as baseline:
+                regressions = self.compare(results, json.load(baseline), options["threshold"])
+            if regressions:
+                raise CommandError("Hot path regressions:\n  " + "\n  ".join(regressions))
+            self.stdout.write(f"No regressions past {options['threshold']:.0%} of the baseline.")
+
+    async def run(self, session, deepgram, transcripts, replies, options, stt_url, sink_url):
+        await wait_for_servers(sink_url)
+        # Conversations, the call registry and the audio cache live in an in-process Redis for the run.
+        redis = fakeredis.FakeServer()
+        conversation_context.redis_client = fakeredis.FakeAsyncRedis(server=redis, decode_responses=True)
+        speech_synthesis.audio_redis_client = fakeredis.FakeAsyncRedis(server=redis)
+        history = conversation(options["context_messages"], transcripts, replies)
+        benchmarks = {
+            "twilio.receive": lambda: self.bench_receive(session, sink_url),
+            "stt.transcript": lambda: self.bench_transcripts(deepgram),
+            "context.serialize": lambda: self.bench_context(history),
+            "prompt.build": lambda: self.bench_prompt(history, transcripts[0]),
+            "twilio.outbound": lambda: self.bench_outbound(),
+            "replay.twilio_call": lambda: self.bench_replay(session, stt_url, options["replays"]),
+        }
+        results = {}
+        for name, prepare in benchmarks.items():
+            if options["only"] and not any(name.startswith(prefix) for prefix in options["only"]):
+                continue
+            operation, iterations, cleanup = await prepare()
+            # Operations that bring their own (small) iteration count are long enough to time in one batch.
+            repeat = options["repeat"] if iterations is None else 1
+            try:
+                results[name] = await self.measure(operation, iterations or options["iterations"], repeat)
+            finally:
+                await cleanup()
+        await http_client.close_http_session()
+        return results
+
+    async def measure(self, operation, iterations, repeat):
+        """
+        Fastest of `repeat` timed batches (CPU time of this process, so the stub servers are not counted),
+        then one batch under tracemalloc for the memory figures.
+        """
+        is_async = inspect.iscoroutinefunction(operation)
+
+        async def batch():
+            for index in range(iterations):
+                if is_async:
+                    await operation(index)
+                else:
+                    operation(index)
+
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.process_time_ns()
+            await batch()
+            best = min(best, time.process_time_ns() - started)
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        await batch()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            "iterations": iterations,
+            "ns_per_op": best / iterations,
+            "peak_bytes": peak - before,
+            "retained_bytes_per_op": max(0, current - before) / iterations,
+        }
+
+    async def bench_receive(self, session, sink_url):
+        # Per media frame: JSON/base64 handling, local VAD, coalescing and the STT socket write (to a discarding sink).
+        os.environ["DEEPGRAM_WS_URL"] = sink_url
+        consumer, _ = await open_twilio_call()
+        frames = [message for message in session if is_media(message)]
+        start = next(message for message in session if event_of(message) == "start")
+        await consumer.websocket_receive({"type": "websocket.receive", "text": start})
+        await settle(consumer, consumer.base_send, quiet=0.2)
+
+        async def receive(index):
+            await consumer.websocket_receive({"type": "websocket.receive", "text": frames[index % len(frames)]})
+        return receive, None, lambda: close_call(consumer)
+
+    async def bench_transcripts(self, deepgram):
+        # Per Deepgram message: JSON decoding and transcript extraction, as in the consumers' `speech_to_text`.
+        def extract(index):
+            response = json.loads(deepgram[index % len(deepgram)])
+            if response.get("type", "Results") == "Results":
+                speech_recognition.transcript_of(response)
+        return extract, None, nothing
+
+    async def bench_context(self, history):
+        # Per turn: encoding a conversation for Redis and decoding the prompt window read back.
+        def round_trip(index):
+            conversation_context.decode_messages(conversation_context.encode_messages(history))
+        return round_trip, None, nothing
+
+    async def bench_prompt(self, history, transcript):
+        # Per turn: prompt assembly from a live in-memory context, plus the request body aiohttp serializes.
+        key = "bench-prompt"
+        tasks = pipeline.TaskSupervisor("bench")
+        conversation_context.live_contexts[key] = conversation_context.CallContext(key, tasks, list(history))
+
+        async def build(index):
+            prompt = await conversation_response.build_prompt(transcript, key, persist=False)
+            json.dumps(conversation_response.build_payload(prompt, stream=True))
+
+        async def cleanup():
+            conversation_context.live_contexts.pop(key, None)
+            await tasks.cancel_all()
+        return build, None, cleanup
+
+    async def bench_outbound(self):
+        # Per synthesized chunk: re-framing, base64 and the media envelope of Twilio outbound audio.
+        transport = FakeTransport()
+        writer = twilio_audio.TwilioAudioWriter(
+            lambda text_data: transport({"text": text_data}), STREAM_SID, lead_ms=int(BENCH_ENVIRONMENT["TWILIO_OUTBOUND_LEAD_MS"])
+        )
+        chunk = b"\x55" * 1024
+
+        async def write(index):
+            await writer.write(chunk)
+        return write, None, nothing
+
+    async def bench_replay(self, session, stt_url, replays):
+        # Per call: the whole session through a fresh consumer against the stub upstreams, turns included.
+        os.environ["DEEPGRAM_WS_URL"] = stt_url
+
+        events = [event_of(message) for message in session]
+
+        async def replay(index):
+            # Frames go in as fast as the consumer takes them, but each reply (and the greeting) is allowed to
+            # finish before the caller goes on, as it would at real-time pacing.
+            consumer, transport = await open_twilio_call()
+            for message, event in zip(session, events):
+                if event == "stop":
+                    await settle(consumer, transport)
+                turn = consumer.turn_task
+                await consumer.websocket_receive({"type": "websocket.receive", "text": message})
+                await asyncio.sleep(0)      # lets STT results in between frames
+                if event == "start" or consumer.turn_task is not turn:
+                    await settle(consumer, transport, quiet=0.1)
+            await close_call(consumer)
+        return replay, replays, nothing
+
+    def report(self, results):
+        self.stdout.write(f"{'operation':<20} {'time/op':>12} {'peak mem':>12} {'retained/op':>12}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<20} {format_ns(result['ns_per_op']):>12} {result['peak_bytes'] / 1024:>9.1f} KiB "
+                f"{result['retained_bytes_per_op']:>10.1f} B"
+            )
+
+    def compare(self, results, baseline, threshold):
+        """
+        Lists operations that got slower, or use more memory, than `threshold` over the baseline.
+        Memory gets 1 KiB of slack so near-zero figures do not trip on allocator noise.
+        """
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            for metric, slack in (("ns_per_op", 0), ("peak_bytes", 1024), ("retained_bytes_per_op", 1024)):
+                limit = before[metric] * (1 + threshold) + slack
+                if result[metric] > limit:
+                    regressions.append(f"{name} {metric}: {result[metric]:,.0f} (baseline {before[metric]:,.0f})")
+        return regressions
+
+
+def is_media(message):
+    return '"event":"media"' in message or '"event": "media"' in message
+
+def event_of(message):
+    return None if is_media(message) else json.loads(message).get("event")
+
+async def wait_for_servers(sink_url):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(50):
+            try:
+                async with session.head(os.environ["OPENAI_API_ENDPOINT"]):
+                    pass
+                async with session.ws_connect(sink_url):
+                    return
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+    raise CommandError("Benchmark stub servers did not start")
+
+def format_ns(ns):
+    return f"{ns / 1000:.2f} us" if ns < 1_000_000 else f"{ns / 1_000_000:.2f} ms"
+
+async def nothing():
+    pass
@@ -0,0 +1,121 @@
+import asyncio, base64, binascii, json, multiprocessing, socket, time
+import aiohttp
+from aiohttp import web
+from django.core.management.base import BaseCommand
+from App import audio_ingest
+
+
+def twilio_media_frames(count, frame_bytes=160):
+    """
+    Synthetic Twilio media-stream frames, formatted the way Twilio sends them (compact JSON, 20 ms mulaw payloads).
+    """
+    payload = base64.b64encode(bytes(i % 256 for i in range(frame_bytes))).decode()
+    return [
+        json.dumps({
+            "event": "media",
+            "sequenceNumber": str(i + 2),
+            "media": {"track": "inbound", "chunk": str(i + 1), "timestamp": str(i * 20), "payload": payload},
+            "streamSid": "MZ00000000000000000000000000000000"
+        }, separators=(",", ":"))
+        for i in range(count)
+    ]
+
+def run_sink(port):
+    """
+    Websocket server that discards everything it receives (stands in for Deepgram STT), run in its own process
+    so its CPU time is not charged to the ingest path.
+    """
+    async def discard(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for _ in ws:
+            pass
+        return ws
+
+    app = web.Application()
+    app.router.add_get("/", discard)
+    web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def ingest_per_frame(frames, send):
+    # Pre-coalescing path: full JSON parse, base64 decode and one upstream write per frame.
+    for text_data in frames:
+        data = json.loads(text_data)
+        if data.get('event') == 'media':
+            await send(base64.b64decode(data['media']['payload']))
+
+async def ingest_coalesced(frames, send, flush_bytes, flush_interval):
+    coalescer = audio_ingest.AudioCoalescer(send, flush_bytes=flush_bytes, flush_interval=flush_interval)
+    for text_data in frames:
+        payload = audio_ingest.extract_media_payload(text_data)
+        await coalescer.add(binascii.a2b_base64(payload))
+    await coalescer.flush()
+
+
+class Command(BaseCommand):
+    help = "Benchmarks Twilio inbound media ingest (frames processed per second per core), per-frame vs coalesced."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--frames", type=int, default=100_000)
+        parser.add_argument("--flush-bytes", type=int, default=800)
+        parser.add_argument("--flush-ms", type=int, default=100)
+        parser.add_argument("--sink", choices=["websocket", "null"], default="websocket",
+                            help="Forward batches to a local websocket sink, or drop them (parse/decode cost only).")
+
+    def handle(self, *args, **options):
+        frames = twilio_media_frames(options["frames"])
+
+        sink = None
+        if options["sink"] == "websocket":
+            port = free_port()
+            sink = multiprocessing.Process(target=run_sink, args=(port,), daemon=True)
+            sink.start()
+        try:
+            results = asyncio.run(self.run(frames, options, port if sink else None))
+        finally:
+            if sink:
+                sink.terminate()
+
+        for name, cpu_seconds, writes in results:
+            self.stdout.write(
+                f"{name:<12} {len(frames) / cpu_seconds:>12,.0f} frames/s/core  "
+                f"{writes:>8} upstream writes  {cpu_seconds:.3f}s cpu"
+            )
+
+    async def run(self, frames, options, port):
+        async with aiohttp.ClientSession() as session:
+            ws = await self.connect_sink(session, port) if port else None
+            writes = 0
+
+            async def send(data):
+                nonlocal writes
+                writes += 1
+                if ws is not None:
+                    await ws.send_bytes(data)
+
+            results = []
+            for name, ingest in (
+                ("per-frame", ingest_per_frame(frames, send)),
+                ("coalesced", ingest_coalesced(frames, send, options["flush_bytes"], options["flush_ms"] / 1000)),
+            ):
+                writes = 0
+                started = time.process_time()
+                await ingest
+                results.append((name, time.process_time() - started, writes))
+
+            if ws is not None:
+                await ws.close()
+            return results
+
+    async def connect_sink(self, session, port):
+        for _ in range(50):
+            try:
+                return await session.ws_connect(f"http://127.0.0.1:{port}/")
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+        raise RuntimeError("Benchmark websocket sink did not start")
@@ -0,0 +1,39 @@
+import asyncio, json, time
+from django.core.management.base import BaseCommand, CommandError
+from App import call_registry, conversation_context
+
+
+class Command(BaseCommand):
+    help = ("Inspect and control live calls across all workers "
+            "(list / hangup <session_id> / flush <session_id> / drain <worker or host>).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["list", "hangup", "flush", "drain", "undrain"])
+        parser.add_argument("target", nargs="?", help="Session id (hangup, flush) or worker id / host name (drain).")
+
+    def handle(self, *args, **options):
+        if options["action"] != "list" and not options["target"]:
+            raise CommandError(f"{options['action']} needs a target")
+        asyncio.run(self.run(options["action"], options["target"]))
+
+    async def run(self, action, target):
+        client = await conversation_context.get_redis_client()
+        if action == "list":
+            now = time.time()
+            workers = await client.hgetall(call_registry.WORKERS_KEY)
+            for worker, data in sorted(workers.items()):
+                data = json.loads(data)
+                state = "draining" if data["draining"] else "serving"
+                self.stdout.write(f"worker {worker}  {state}  calls={data['calls']}  heartbeat={now - data['heartbeat']:.0f}s ago")
+            for session_id, call in sorted((await call_registry.list_calls()).items(), key=lambda item: item[1]["started"]):
+                self.stdout.write(f"call {session_id}  {call['channel']}  {call['state']}  "
+                                  f"worker={call['worker']}  up={now - call['started']:.0f}s")
+        elif action in ("hangup", "flush"):
+            # flush: the owning worker writes its in-memory conversation to Redis before the call moves.
+            await call_registry.send_command(target, action)
+            self.stdout.write(f"Sent {action} to {target}")
+        elif action == "drain":
+            await client.sadd(call_registry.DRAIN_KEY, target)
+            self.stdout.write(f"{target} will drain within {call_registry.heartbeat_interval()}s")
+        else:
+            await client.srem(call_registry.DRAIN_KEY, target)
@@ -0,0 +1,25 @@
+import daphne.server
+from daphne.cli import CommandLineInterface
+from django.core.management.base import BaseCommand
+from App import call_registry, lifespan
+
+
+class Command(BaseCommand):
+    help = ("Run one Daphne worker on a listening socket inherited from `runworkers`. Daphne sends no ASGI "
+            "lifespan events, so the worker's startup (registry, warm upstream connections, pools, TTS cache "
+            "preseed) is run to completion first, and the worker only accepts connections once it is warm.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fd", type=int, required=True, help="File descriptor of the shared listening socket.")
+        parser.add_argument("--application", default="IrisVoiceAI.asgi:application")
+
+    def handle(self, *args, **options):
+        # Daphne's Twisted reactor runs on this loop; tasks startup leaves running carry on once it serves.
+        daphne.server.twisted_loop.run_until_complete(warm())
+        # The reactor takes over the loop's signal wakeups when it starts, so the drain signal goes back on after.
+        daphne.server.twisted_loop.call_soon(call_registry.install_drain_signal)
+        CommandLineInterface().run(["--fd", str(options["fd"]), options["application"]])
+
+
+async def warm():
+    await lifespan.start()
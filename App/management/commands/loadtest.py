@@ -0,0 +1,350 @@
+import asyncio, base64, json, multiprocessing, re, uuid
+import aiohttp
+from django.core.management.base import BaseCommand, CommandError
+from App import upstream_stubs
+
+FRAME_SECONDS = 0.02              # Twilio media frame cadence
+TWILIO_FRAME_BYTES = 160
+WEB_CHUNK_SECONDS = 0.25          # MediaRecorder timeslice used by client.js
+WEB_BYTES_PER_SECOND = 4000
+MP3_BYTES_PER_SECOND = 6000
+SILENCE = 0xFF
+
+
+def synthetic_speech(seconds, rate=8000):
+    """
+    Loud, non-silent mulaw-style bytes the stub STT recognizes as speech.
+    """
+    return bytes(0x10 + (i * 7) % 32 for i in range(int(seconds * rate)))
+
+def percentile(values, pct):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def parse_metrics(text):
+    """
+    Parses the Prometheus text exposition into {(name, frozenset(labels)): value}.
+    """
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = re.match(r'([a-zA-Z_:][\w:]*)(\{(.*)\})?\s+(\S+)$', line)
+        if not match:
+            continue
+        labels = frozenset(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', match.group(3) or ""))
+        samples[(match.group(1), labels)] = float(match.group(4))
+    return samples
+
+def metric_sum(samples, name):
+    return sum(value for (metric, _), value in samples.items() if metric == name)
+
+def histogram_percentile(before, after, name, pct):
+    """
+    Percentile upper bound from the cumulative bucket counts observed between two scrapes.
+    """
+    buckets = []
+    for (metric, labels), value in after.items():
+        if metric == f"{name}_bucket":
+            le = dict(labels)["le"]
+            buckets.append((float(le), value - before.get((metric, labels), 0)))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return float("nan")
+    target = buckets[-1][1] * pct / 100
+    return next(bound for bound, count in buckets if count >= target)
+
+
+class LoadStats:
+    def __init__(self):
+        self.started = 0
+        self.connected = 0
+        self.sustained = 0
+        self.failed = 0
+        self.turn_latencies = []
+        self.errors = []
+        self.loop_lag = []
+
+
+class Command(BaseCommand):
+    help = ("Simulates concurrent Twilio media streams and web clients against ws/twilio/ and ws/voice/, "
+            "with local stub Deepgram/OpenAI upstreams, and reports sustained calls, turn latency, "
+            "event-loop lag and memory per call.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", default="http://127.0.0.1:8000", help="Base URL of the server under test.")
+        parser.add_argument("--twilio-calls", type=int, default=50)
+        parser.add_argument("--web-calls", type=int, default=0)
+        parser.add_argument("--duration", type=float, default=60, help="Seconds each call stays up.")
+        parser.add_argument("--ramp", type=float, default=10, help="Seconds over which calls are started.")
+        parser.add_argument("--speech-seconds", type=float, default=1.5, help="Length of each simulated utterance.")
+        parser.add_argument("--audio", help="Raw 8 kHz mulaw recording to stream as the caller's utterance.")
+        parser.add_argument("--stub-host", default="127.0.0.1")
+        parser.add_argument("--stub-port", type=int, default=9100)
+        parser.add_argument("--stubs-only", action="store_true", help="Only run the stub upstreams (foreground).")
+        parser.add_argument("--external-stubs", action="store_true", help="Stubs are already running elsewhere.")
+        parser.add_argument("--stt-latency", type=float, default=0.05)
+        parser.add_argument("--llm-ttft", type=float, default=0.3)
+        parser.add_argument("--llm-tps", type=float, default=60)
+        parser.add_argument("--tts-ttfb", type=float, default=0.15)
+        parser.add_argument("--tts-speed", type=float, default=4.0)
+        parser.add_argument("--stall-rate", type=float, default=0.0, help="Fraction of LLM/TTS requests that stall.")
+        parser.add_argument("--stall-seconds", type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        latency = upstream_stubs.StubLatency(
+            stt=options["stt_latency"], llm_ttft=options["llm_ttft"], llm_tps=options["llm_tps"],
+            tts_ttfb=options["tts_ttfb"], tts_speed=options["tts_speed"],
+            stall_rate=options["stall_rate"], stall_seconds=options["stall_seconds"]
+        )
+        environment = upstream_stubs.stub_environment(options["stub_host"], options["stub_port"])
+        self.stdout.write("Run the server under test with:")
+        for name, value in environment.items():
+            self.stdout.write(f"  {name}={value}")
+
+        if options["stubs_only"]:
+            upstream_stubs.run_stub_server(options["stub_host"], options["stub_port"], latency)
+            return
+
+        stubs = None
+        if not options["external_stubs"]:
+            stubs = multiprocessing.Process(
+                target=upstream_stubs.run_stub_server,
+                args=(options["stub_host"], options["stub_port"], latency),
+                daemon=True
+            )
+            stubs.start()
+
+        speech = synthetic_speech(options["speech_seconds"])
+        if options["audio"]:
+            with open(options["audio"], "rb") as recording:
+                speech = recording.read()
+            if not speech:
+                raise CommandError("The --audio recording is empty")
+
+        try:
+            asyncio.run(self.run(options, speech))
+        finally:
+            if stubs:
+                stubs.terminate()
+
+    async def run(self, options, speech):
+        stats = LoadStats()
+        target = options["target"].rstrip("/")
+        calls = [("twilio", i) for i in range(options["twilio_calls"])] + [("web", i) for i in range(options["web_calls"])]
+        if not calls:
+            raise CommandError("Nothing to do: set --twilio-calls and/or --web-calls")
+
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            before = await self.scrape(session, target)
+            monitor = asyncio.create_task(self.monitor_loop(stats))
+
+            async def start_call(kind, delay):
+                await asyncio.sleep(delay)
+                call = self.twilio_call if kind == "twilio" else self.web_call
+                await call(session, target, stats, speech, options["duration"])
+
+            spacing = options["ramp"] / len(calls)
+            tasks = [asyncio.create_task(start_call(kind, i * spacing)) for i, (kind, _) in enumerate(calls)]
+
+            # Scrape the server while every call is up, just before the first ones hang up.
+            await asyncio.sleep(options["ramp"] + max(0.0, options["duration"] - options["ramp"]) * 0.9)
+            peak = await self.scrape(session, target)
+
+            await asyncio.gather(*tasks)
+            monitor.cancel()
+            after = await self.scrape(session, target)
+
+        self.report(stats, before, peak, after)
+
+    async def twilio_call(self, session, target, stats, speech, duration):
+        """
+        One simulated Twilio media stream: real-time 20 ms frames, speaking, then silence until the reply
+        has been received and "played", echoing marks back the way Twilio does.
+        """
+        stats.started += 1
+        stream_sid = "MZ" + uuid.uuid4().hex
+        loop = asyncio.get_running_loop()
+        state = {"speech_ended": None, "replied": False, "playback_until": 0.0}
+
+        try:
+            async with session.ws_connect(f"{target.replace('http', 'ws', 1)}/ws/twilio/") as ws:
+                stats.connected += 1
+                await ws.send_str(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+                await ws.send_str(json.dumps({
+                    "event": "start", "sequenceNumber": "1", "streamSid": stream_sid,
+                    "start": {"streamSid": stream_sid, "callSid": "CA" + uuid.uuid4().hex, "tracks": ["inbound"],
+                              "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}}
+                }))
+
+                async def echo_mark(name, delay):
+                    await asyncio.sleep(delay)
+                    if not ws.closed:
+                        await ws.send_str(json.dumps({"event": "mark", "streamSid": stream_sid, "mark": {"name": name}}))
+
+                async def read():
+                    async for message in ws:
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            continue
+                        data = json.loads(message.data)
+                        now = loop.time()
+                        if data.get("event") == "media":
+                            if state["speech_ended"] is not None and not state["replied"]:
+                                state["replied"] = True
+                                stats.turn_latencies.append(now - state["speech_ended"])
+                            played = len(base64.b64decode(data["media"]["payload"])) / 8000
+                            state["playback_until"] = max(state["playback_until"], now) + played
+                        elif data.get("event") == "mark":
+                            loop.create_task(echo_mark(data["mark"]["name"], max(0.0, state["playback_until"] - now)))
+                        elif data.get("event") == "clear":
+                            state["playback_until"] = now
+
+                reader = asyncio.create_task(read())
+                deadline = loop.time() + duration
+                sequence, next_send = 1, loop.time()
+                silence = bytes([SILENCE]) * TWILIO_FRAME_BYTES
+
+                while loop.time() < deadline and not ws.closed:
+                    # Speak one utterance, then stay silent until the reply was heard and played out.
+                    utterance = [speech[i:i + TWILIO_FRAME_BYTES] for i in range(0, len(speech), TWILIO_FRAME_BYTES)]
+                    state.update(speech_ended=None, replied=False)
+                    silent_since = None
+
+                    while loop.time() < deadline and not ws.closed:
+                        frame = utterance.pop(0) if utterance else silence
+                        sequence += 1
+                        await ws.send_str(json.dumps({
+                            "event": "media", "sequenceNumber": str(sequence), "streamSid": stream_sid,
+                            "media": {"track": "inbound", "chunk": str(sequence), "timestamp": str(sequence * 20),
+                                      "payload": base64.b64encode(frame).decode()}
+                        }, separators=(",", ":")))
+
+                        now = loop.time()
+                        if not utterance and state["speech_ended"] is None:
+                            state["speech_ended"] = now
+                        if state["replied"] and now >= state["playback_until"]:
+                            silent_since = silent_since or now
+                            if now - silent_since >= 0.5:
+                                break
+                        elif state["speech_ended"] is not None and now - state["speech_ended"] > 15:
+                            stats.errors.append("twilio: no reply within 15 s")
+                            break
+
+                        next_send += FRAME_SECONDS
+                        await asyncio.sleep(max(0.0, next_send - loop.time()))
+
+                if not ws.closed:
+                    await ws.send_str(json.dumps({"event": "stop", "streamSid": stream_sid}))
+                    stats.sustained += 1
+                await ws.close()
+                reader.cancel()
+
+        except Exception as e:
+            stats.failed += 1
+            stats.errors.append(f"twilio: {e!r}")
+
+    async def web_call(self, session, target, stats, speech, duration):
+        """
+        One simulated browser client: start, 250 ms audio chunks until the transcript comes back,
+        then wait for the reply audio and its playback before recording again.
+        """
+        stats.started += 1
+        loop = asyncio.get_running_loop()
+        chunk_bytes = int(WEB_BYTES_PER_SECOND * WEB_CHUNK_SECONDS)
+        utterance_seconds = len(speech) / 8000
+
+        try:
+            async with session.ws_connect(f"{target.replace('http', 'ws', 1)}/ws/voice/") as ws:
+                stats.connected += 1
+                deadline = loop.time() + duration
+
+                while loop.time() < deadline and not ws.closed:
+                    await ws.send_str(json.dumps({"command": "start"}))
+                    speech_ended, heard, reply_bytes = None, False, 0
+                    started = loop.time()
+
+                    async def send_audio():
+                        next_send = loop.time()
+                        while True:
+                            speaking = loop.time() - started < utterance_seconds
+                            await ws.send_bytes(synthetic_speech(WEB_CHUNK_SECONDS, WEB_BYTES_PER_SECOND) if speaking else bytes([SILENCE]) * chunk_bytes)
+                            next_send += WEB_CHUNK_SECONDS
+                            await asyncio.sleep(max(0.0, next_send - loop.time()))
+
+                    sender = asyncio.create_task(send_audio())
+                    try:
+                        async for message in ws:
+                            now = loop.time()
+                            if speech_ended is None and now - started >= utterance_seconds:
+                                speech_ended = started + utterance_seconds
+                            if message.type == aiohttp.WSMsgType.BINARY:
+                                if not heard and speech_ended is not None:
+                                    heard = True
+                                    stats.turn_latencies.append(now - speech_ended)
+                                reply_bytes += len(message.data)
+                            elif message.type == aiohttp.WSMsgType.TEXT:
+                                command = json.loads(message.data).get("command")
+                                if command == "user_speech_end":
+                                    sender.cancel()
+                                elif command in ("final", "auto_stop"):
+                                    break
+                    finally:
+                        sender.cancel()
+
+                    # Let the reply "play" before talking again.
+                    await asyncio.sleep(reply_bytes / MP3_BYTES_PER_SECOND + 0.5)
+
+                if not ws.closed:
+                    stats.sustained += 1
+                await ws.close()
+
+        except Exception as e:
+            stats.failed += 1
+            stats.errors.append(f"web: {e!r}")
+
+    async def monitor_loop(self, stats, interval=0.1):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            stats.loop_lag.append(max(0.0, loop.time() - started - interval))
+
+    async def scrape(self, session, target):
+        try:
+            async with session.get(f"{target}/metrics/") as response:
+                if response.status != 200:
+                    self.stderr.write(f"Could not scrape {target}/metrics/: HTTP {response.status}")
+                    return {}
+                return parse_metrics(await response.text())
+        except aiohttp.ClientError as e:
+            self.stderr.write(f"Could not scrape {target}/metrics/: {e}")
+            return {}
+
+    def report(self, stats, before, peak, after):
+        latencies = stats.turn_latencies
+        self.stdout.write("")
+        self.stdout.write(f"Calls: {stats.started} started, {stats.connected} connected, "
+                          f"{stats.sustained} sustained, {stats.failed} failed")
+        self.stdout.write(f"Turns: {len(latencies)} (speech end -> first reply audio)")
+        self.stdout.write("  p50 {:.3f}s  p90 {:.3f}s  p99 {:.3f}s  max {:.3f}s".format(
+            percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+            max(latencies) if latencies else float("nan")))
+        self.stdout.write("Load generator loop lag: p99 {:.3f}s  max {:.3f}s".format(
+            percentile(stats.loop_lag, 99), max(stats.loop_lag) if stats.loop_lag else float("nan")))
+
+        if after:
+            active = metric_sum(peak, "iris_active_calls")
+            rss_before = metric_sum(before, "iris_process_resident_memory_bytes")
+            rss_peak = metric_sum(peak, "iris_process_resident_memory_bytes")
+            self.stdout.write(f"Server: {active:.0f} active calls at peak, event-loop lag p99 <= "
+                              f"{histogram_percentile(before, after, 'iris_event_loop_lag_seconds', 99)}s")
+            if active and rss_before:
+                self.stdout.write(f"Server memory: {rss_peak / 2**20:.1f} MiB at peak, "
+                                  f"{(rss_peak - rss_before) / active / 1024:.1f} KiB per call")
+            self.stdout.write(f"Server upstream errors: {metric_sum(after, 'iris_upstream_errors_total') - metric_sum(before, 'iris_upstream_errors_total'):.0f}")
+
+        for error in sorted(set(stats.errors))[:10]:
+            self.stderr.write(f"  {error} (x{stats.errors.count(error)})")
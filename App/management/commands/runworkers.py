@@ -0,0 +1,73 @@
+import os, signal, socket, subprocess, sys, time
+from decouple import config
+from django.core.management.base import BaseCommand
+from App.call_registry import EXIT_DRAINED
+
+
+class Command(BaseCommand):
+    help = ("Run several Daphne worker processes sharing one listening socket, restarting crashed workers "
+            "and draining live calls on shutdown. Workers that drained on request (`calls drain`) are not "
+            "restarted; once all have, this command exits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="0.0.0.0")
+        parser.add_argument("--port", type=int, default=config('PORT', default=8000, cast=int))
+        parser.add_argument("--workers", type=int, default=config('WEB_CONCURRENCY', default=os.cpu_count() or 1, cast=int))
+        parser.add_argument("--drain-timeout", type=float, default=config('DRAIN_TIMEOUT', default=300, cast=float),
+                            help="Seconds to wait for live calls to end before workers are terminated.")
+        parser.add_argument("--application", default="IrisVoiceAI.asgi:application")
+
+    def handle(self, *args, **options):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((options["host"], options["port"]))
+        listener.listen(1024)
+        listener.set_inheritable(True)
+        fd = listener.fileno()
+        # Each worker warms up (see `daphneworker`) before it takes connections off the shared socket.
+        command = [sys.executable, sys.argv[0], "daphneworker", "--fd", str(fd), "--application", options["application"]]
+
+        def spawn():
+            return subprocess.Popen(command, pass_fds=(fd,))
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+
+        workers = [spawn() for _ in range(options["workers"])]
+        self.stdout.write(f"Serving on {options['host']}:{options['port']} with {len(workers)} workers")
+        while not stopping and workers:
+            for index, worker in enumerate(workers):
+                if worker.poll() is None:
+                    continue
+                if worker.returncode == EXIT_DRAINED:
+                    # Drained through the registry (this worker or the whole host): restarting it would only
+                    # have the new worker read the same drain request and exit again.
+                    self.stdout.write(f"Worker {worker.pid} drained")
+                    workers[index] = None
+                else:
+                    self.stderr.write(f"Worker {worker.pid} exited with {worker.returncode}, restarting")
+                    workers[index] = spawn()
+            workers = [worker for worker in workers if worker is not None]
+            time.sleep(1)
+        if not workers:
+            self.stdout.write("All workers drained")
+        else:
+            # Workers stop accepting calls on SIGUSR1 and exit by themselves once their calls have ended.
+            self.stdout.write(f"Draining {len(workers)} workers")
+        for worker in workers:
+            if worker.poll() is None:
+                worker.send_signal(signal.SIGUSR1)
+        deadline = time.monotonic() + options["drain_timeout"]
+        while time.monotonic() < deadline and any(worker.poll() is None for worker in workers):
+            time.sleep(0.5)
+
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(10)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        listener.close()
@@ -0,0 +1,193 @@
+import asyncio, bisect, os, resource, time
+from . import logs
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0, 10.0)
+
+registry = []
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """
+    Minimal per-process Prometheus metric: a name, help text and one value per label combination.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in list(self.values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total, count) in list(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+def render():
+    """
+    Renders every registered metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Timer:
+    """
+    Measures elapsed time for a histogram: `with metrics.Timer(histogram, labels...):`
+    """
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.started)
+        return False
+
+
+class TurnTimer:
+    """
+    Timing spans of one conversational turn.
+    - `transcript`: caller's audio start -> Deepgram final transcript (only when the audio start is known)
+    - `first_audio`: final transcript -> first reply audio byte sent to the caller
+    - `last_audio`: final transcript -> last reply audio byte sent to the caller
+    Spans also go to the call's flight recorder, which is dumped when `first_audio` reaches SLOW_TURN_SECONDS.
+    """
+    def __init__(self, channel):
+        self.channel = channel
+        self.audio_started = None
+        self.transcribed = None
+        self.first_audio_sent = False
+
+    def speech_started(self):
+        self.audio_started = time.perf_counter()
+
+    def observe(self, span, seconds):
+        TURN_SECONDS.observe(self.channel, span, value=seconds)
+        logs.record("turn", span=span, seconds=round(seconds, 3))
+
+    def final_transcript(self):
+        self.transcribed = time.perf_counter()
+        if self.audio_started is not None:
+            self.observe("transcript", self.transcribed - self.audio_started)
+
+    def audio_sent(self):
+        if not self.first_audio_sent and self.transcribed is not None:
+            self.first_audio_sent = True
+            seconds = time.perf_counter() - self.transcribed
+            self.observe("first_audio", seconds)
+            if seconds >= logs.slow_turn_seconds():
+                logs.dump("slow turn", first_audio_seconds=round(seconds, 3))
+
+    def finished(self):
+        if self.transcribed is not None and self.first_audio_sent:
+            self.observe("last_audio", time.perf_counter() - self.transcribed)
+
+
+def resident_memory_bytes():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Not Linux: fall back to the peak RSS (kilobytes on Linux/BSD, bytes on macOS).
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+async def monitor_process(interval=0.5):
+    """
+    Samples this worker's event-loop lag (how late a timer fires) and resident memory.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(value=max(0.0, loop.time() - started - interval))
+        PROCESS_RSS.set(value=resident_memory_bytes())
+
+
+ACTIVE_CALLS = Gauge("iris_active_calls", "Calls currently connected to this worker.", ["channel"])
+CALLS = Counter("iris_calls_total", "Calls accepted by this worker.", ["channel"])
+TURN_SECONDS = Histogram("iris_turn_seconds", "Per-turn latency spans.", ["channel", "span"])
+UPSTREAM_SECONDS = Histogram("iris_upstream_seconds", "Upstream request latency (first byte and total).", ["upstream", "phase"])
+REDIS_SECONDS = Histogram("iris_redis_seconds", "Conversation context Redis round trips.", ["op"])
+UPSTREAM_ATTEMPTS = Counter("iris_upstream_attempts_total", "Upstream retries, hedged requests and exhausted budgets.", ["upstream", "outcome"])
+ROUTED_REQUESTS = Counter("iris_routed_requests_total", "Requests the backend routers sent, by backend and outcome.", ["stage", "backend", "outcome"])
+BACKEND_FIRST_BYTE = Gauge("iris_backend_first_byte_seconds", "EWMA time to first byte per routed backend.", ["stage", "backend"])
+BACKEND_CIRCUIT_OPEN = Gauge("iris_backend_circuit_open", "1 while a routed backend's circuit breaker is open.", ["stage", "backend"])
+UPSTREAM_ERRORS = Counter("iris_upstream_errors_total", "Failed upstream calls.", ["upstream"])
+AUDIO_BYTES = Counter("iris_audio_bytes_total", "Audio bytes streamed.", ["channel", "direction"])
+ADMISSION = Counter("iris_admission_total", "Call admission decisions.", ["channel", "result"])
+RATE_LIMITED = Counter("iris_rate_limited_total", "Upstream requests held back by the shared rate limits.", ["bucket", "result"])
+TASK_FAILURES = Counter("iris_task_failures_total", "Per-call background tasks that ended with an error.", ["channel", "task"])
+STT_CONNECTIONS = Counter("iris_stt_connections_total", "Deepgram STT websockets a call started using, by source.", ["channel", "source"])
+STT_BUFFERED_BYTES = Counter("iris_stt_buffered_bytes_total", "Inbound audio held back while the STT socket (re)connected.", ["channel", "result"])
+VAD_SUPPRESSED_BYTES = Counter("iris_vad_suppressed_bytes_total", "Inbound silence the local VAD kept from STT.", ["channel"])
+SPECULATION = Counter("iris_speculation_total", "Speculative completions on interim transcripts by outcome.", ["result"])
+CONTEXT_SUMMARIES = Counter("iris_context_summaries_total", "Older conversation turns folded into a rolling summary.")
+TTS_CACHE = Counter("iris_tts_cache_total", "TTS cache lookups by result.", ["result"])
+EVENT_LOOP_LAG = Histogram("iris_event_loop_lag_seconds", "How late event-loop timers fire on this worker.",
+                           buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+PROCESS_RSS = Gauge("iris_process_resident_memory_bytes", "Resident memory of this worker process.")
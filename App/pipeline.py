@@ -0,0 +1,107 @@
+import asyncio, logging
+from decouple import config
+from . import logs, metrics, speech_synthesis
+
+logger = logging.getLogger(__name__)
+
+END = object()      # end-of-stream marker passed down the queues
+
+
+class TaskSupervisor:
+    """
+    Owns every background task of one call. Failures are logged to `log` (and counted, and the call's
+    flight recorder dumped) instead of vanishing with the task, and `cancel_all` on disconnect cancels
+    and awaits whatever is still running.
+    """
+    def __init__(self, channel, log=logger):
+        self.channel = channel
+        self.log = log
+        self.tasks = set()
+
+    def spawn(self, coro, name):
+        task = asyncio.create_task(coro, name=name)
+        self.tasks.add(task)
+        task.add_done_callback(self.reap)
+        return task
+
+    def reap(self, task):
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.log.error("%s task error: %r", task.get_name(), error, exc_info=error)
+            logs.dump(f"{task.get_name()} task error", error=repr(error))
+            metrics.TASK_FAILURES.inc(self.channel, task.get_name())
+
+    async def cancel_all(self):
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.wait(tasks)
+
+
+def queue_size():
+    return config('PIPELINE_QUEUE_SIZE', default=8, cast=int)
+
+def stall_timeout():
+    return config('PIPELINE_STALL_TIMEOUT', default=30, cast=float)
+
+async def put(queue, item, timeout):
+    # A put only blocks while the next stage is behind; blocking this long means it is stuck.
+    async with asyncio.timeout(timeout):
+        await queue.put(item)
+
+async def run_stages(source, stages, sink, maxsize=None, timeout=None):
+    """
+    Runs `source` (an async iterable) through `stages` into `sink`, each step in its own task, linked by
+    bounded queues: a slow step makes the ones before it wait instead of buffering without limit.
+
+    Each stage is an async generator function taking one item and yielding any number of outputs;
+    `sink` is an async function called with every final output in order. If any step fails or stalls for
+    `timeout` seconds the others are cancelled and the error is raised; cancelling the caller cancels them all.
+    """
+    maxsize = maxsize or queue_size()
+    timeout = timeout or stall_timeout()
+    queues = [asyncio.Queue(maxsize) for _ in range(len(stages) + 1)]
+
+    async def feed():
+        async for item in source:
+            await put(queues[0], item, timeout)
+        await put(queues[0], END, timeout)
+
+    async def transform(stage, inbox, outbox):
+        while (item := await inbox.get()) is not END:
+            async for output in stage(item):
+                await put(outbox, output, timeout)
+        await put(outbox, END, timeout)
+
+    async def drain():
+        while (item := await queues[-1].get()) is not END:
+            await sink(item)
+
+    try:
+        async with asyncio.TaskGroup() as group:
+            group.create_task(feed())
+            for stage, inbox, outbox in zip(stages, queues, queues[1:]):
+                group.create_task(transform(stage, inbox, outbox))
+            group.create_task(drain())
+    except ExceptionGroup as errors:
+        raise errors.exceptions[0]
+
+
+class WebAudioTransport:
+    """
+    Outbound audio adapter for the browser: mp3 chunks go out as binary websocket frames.
+    """
+    audio_format = speech_synthesis.WEB_AUDIO
+
+    def __init__(self, send):
+        self.send = send
+
+    async def write(self, audio):
+        await self.send(bytes_data=audio)
+
+    async def finish(self):
+        pass
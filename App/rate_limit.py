@@ -0,0 +1,101 @@
+import asyncio, logging, math
+from decouple import config
+from . import conversation_context, metrics
+
+logger = logging.getLogger(__name__)
+
+BUCKET_KEY_PREFIX = "ratelimit:"
+
+# Token bucket shared by all workers, refilled continuously from Redis server time.
+# Takes `requested` tokens if the caller would have to wait at most `max_wait_ms` for them (the bucket may go
+# into debt, which later callers wait out); returns that wait in ms, or -1 without taking anything.
+TAKE_TOKENS = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local max_wait_ms = tonumber(ARGV[4])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+
+local wait = 0
+if tokens < requested then
+    wait = math.ceil((requested - tokens) * 1000 / rate)
+    if wait > max_wait_ms then return -1 end
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - requested), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 60000)
+return wait
+"""
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Cluster-wide rate limit on one upstream resource, configured as `<name>_PER_MINUTE` (0 disables it).
+    Up to RATE_LIMIT_BURST_SECONDS worth of tokens can be spent at once.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.key = BUCKET_KEY_PREFIX + name.lower()
+
+    def per_minute(self):
+        return config(f'{self.name}_PER_MINUTE', default=0, cast=float)
+
+    async def acquire(self, amount, max_wait):
+        """
+        Takes `amount` tokens, sleeping until they are available if that is at most `max_wait` seconds.
+        Returns False (taking nothing) if the bucket is further behind than that. Fails open if Redis is down.
+        """
+        per_minute = self.per_minute()
+        if per_minute <= 0:
+            return True
+        rate = per_minute / 60
+        capacity = max(amount, rate * config('RATE_LIMIT_BURST_SECONDS', default=10, cast=float))
+
+        try:
+            client = await conversation_context.get_redis_client()
+            with metrics.Timer(metrics.REDIS_SECONDS, "rate_limit"):
+                wait_ms = await client.eval(TAKE_TOKENS, 1, self.key, capacity, rate, amount, math.floor(max_wait * 1000))
+        except Exception as e:
+            logger.warning("Rate limit error: %s", e)
+            metrics.UPSTREAM_ERRORS.inc("redis")
+            return True
+
+        if wait_ms < 0:
+            metrics.RATE_LIMITED.inc(self.name.lower(), "rejected")
+            return False
+        if wait_ms > 0:
+            metrics.RATE_LIMITED.inc(self.name.lower(), "delayed")
+            await asyncio.sleep(wait_ms / 1000)
+        return True
+
+
+LLM_REQUESTS = TokenBucket("LLM_REQUESTS")
+LLM_TOKENS = TokenBucket("LLM_TOKENS")
+TTS_CHARACTERS = TokenBucket("TTS_CHARACTERS")
+
+def max_wait(priority):
+    """
+    How long a request may queue for rate limit tokens: live turns wait a little, background work
+    (speculation, greeting pool, cache pre-seeding) never waits and is simply skipped.
+    """
+    return config('RATE_LIMIT_MAX_WAIT', default=2, cast=float) if priority == "live" else 0
+
+def estimate_tokens(prompt, max_tokens):
+    # ~4 characters per token for English; close enough for budgeting ahead of the request.
+    return sum(len(message["content"]) for message in prompt) // 4 + max_tokens
+
+async def acquire_llm(prompt, max_tokens, priority="live"):
+    wait = max_wait(priority)
+    return await LLM_REQUESTS.acquire(1, wait) and await LLM_TOKENS.acquire(estimate_tokens(prompt, max_tokens), wait)
+
+async def acquire_tts(text, priority="live"):
+    return await TTS_CHARACTERS.acquire(len(text), max_wait(priority))
@@ -0,0 +1,258 @@
+import asyncio, collections, json, logging, time
+import aiohttp
+from decouple import config
+from . import logs, metrics
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE = json.dumps({"type": "KeepAlive"})
+
+
+def interim_results():
+    return "true" if config('SPECULATIVE_LLM', default=False, cast=bool) else "false"
+
+def stream_url(channel):
+    """
+    Deepgram live transcription URL for a call channel: browser audio (webm/opus) is detected by Deepgram,
+    Twilio audio is declared as 8 kHz mulaw and gets VAD events for barge-in.
+    """
+    url = (f"{config('DEEPGRAM_WS_URL')}?model={config('DEEPGRAM_STT_MODEL')}"
+           f"&smart_format=true&interim_results={interim_results()}&endpointing={config('DEEPGRAM_STT_ENDPOINTING')}")
+    if channel == "twilio":
+        url += "&encoding=mulaw&sample_rate=8000&vad_events=true"
+    return url
+
+def transcript_of(response):
+    """
+    Best transcript of a Deepgram `Results` message, stripped ("" when there is none).
+    """
+    return response.get("channel", {}).get("alternatives", [{}])[0].get("transcript", "").strip()
+
+async def connect(session, url):
+    with metrics.Timer(metrics.UPSTREAM_SECONDS, "deepgram_stt", "connect"):
+        return await session.ws_connect(url, headers={"Authorization": f"Token {config('DEEPGRAM_API_KEY')}"})
+
+def is_open(ws):
+    # `closed` only flips once a close frame is read; an idle socket whose connection dropped has no transport left.
+    return not ws.closed and ws.get_extra_info("socket") is not None
+
+def keepalive_interval():
+    # Deepgram closes a stream that goes ~10 s without audio or a KeepAlive.
+    return config('DEEPGRAM_KEEPALIVE_INTERVAL', default=5, cast=float)
+
+
+class TranscriptionStream:
+    """
+    One Deepgram live transcription websocket, held open for the whole call instead of one per turn.
+    - audio sent while the socket is (re)connecting is buffered (up to DEEPGRAM_STT_BUFFER_SECONDS) and sent
+      in order once it is up, instead of being dropped
+    - `keepalive` sends a KeepAlive whenever no audio went out for DEEPGRAM_KEEPALIVE_INTERVAL seconds,
+      e.g. while Iris is speaking and the caller's microphone is paused
+    - if Deepgram drops the socket mid-call it is reopened (up to DEEPGRAM_STT_RECONNECTS times in a row);
+      with `replay_header` the first chunk (the browser's webm header) is sent again first
+    `messages` yields Deepgram's JSON messages across reconnects until the stream is closed.
+    """
+    def __init__(self, session, channel, bytes_per_second, replay_header=False):
+        self.session = session
+        self.channel = channel
+        self.replay_header = replay_header
+        self.header = None
+        self.ws = None
+        self.buffer = collections.deque()
+        self.buffered = 0
+        self.max_buffered = int(bytes_per_second * config('DEEPGRAM_STT_BUFFER_SECONDS', default=10, cast=float))
+        self.last_sent = time.monotonic()
+        self.closed = False
+
+    async def send(self, audio):
+        if self.closed:
+            return
+        if self.replay_header and self.header is None:
+            self.header = bytes(audio)
+        if self.ws is not None:
+            try:
+                await self.ws.send_bytes(audio)
+                self.last_sent = time.monotonic()
+                return
+            except (ConnectionError, aiohttp.ClientError):
+                # The socket went away under us; the reader reconnects and this chunk goes out then.
+                self.ws = None
+        self.hold(audio)
+
+    def hold(self, audio):
+        self.buffer.append(audio)
+        self.buffered += len(audio)
+        while self.buffered > self.max_buffered and len(self.buffer) > 1:
+            dropped = self.buffer.popleft()
+            self.buffered -= len(dropped)
+            metrics.STT_BUFFERED_BYTES.inc(self.channel, "dropped", amount=len(dropped))
+
+    async def keep_alive(self):
+        if self.ws is None:
+            return
+        try:
+            await self.ws.send_str(KEEPALIVE)
+            self.last_sent = time.monotonic()
+        except (ConnectionError, aiohttp.ClientError):
+            self.ws = None
+
+    async def keepalive(self):
+        interval = keepalive_interval()
+        while not self.closed:
+            await asyncio.sleep(max(0.1, self.last_sent + interval - time.monotonic()))
+            if time.monotonic() - self.last_sent >= interval:
+                await self.keep_alive()
+
+    async def open(self, source):
+        ws = pool.take(self.channel, stream_url(self.channel)) if source == "new" else None
+        if ws is None:
+            ws = await connect(self.session, stream_url(self.channel))
+        else:
+            source = "pooled"
+        metrics.STT_CONNECTIONS.inc(self.channel, source)
+        logs.record("stt_connected", source=source, buffered=self.buffered)
+
+        # A reconnect starts a new decoder upstream: it needs the container header again, unless still buffered.
+        if self.header is not None and not (self.buffer and self.buffer[0] is self.header):
+            await ws.send_bytes(self.header)
+        # Sends arriving meanwhile keep landing in the buffer; `ws` takes over only once it is empty.
+        while self.buffer:
+            audio = self.buffer.popleft()
+            self.buffered -= len(audio)
+            await ws.send_bytes(audio)
+            metrics.STT_BUFFERED_BYTES.inc(self.channel, "flushed", amount=len(audio))
+        self.last_sent = time.monotonic()
+        self.ws = ws
+        return ws
+
+    async def messages(self):
+        failures, source = 0, "new"
+        while not self.closed:
+            try:
+                ws = await self.open(source)
+            except (aiohttp.ClientError, ConnectionError, TimeoutError) as e:
+                failures += 1
+                if failures > config('DEEPGRAM_STT_RECONNECTS', default=3, cast=int):
+                    raise
+                logger.warning("Deepgram STT connect error, retrying: %s", e, extra={"channel": self.channel})
+                logs.record("stt_connect_error", error=repr(e))
+                metrics.UPSTREAM_ERRORS.inc("deepgram_stt")
+                await asyncio.sleep(min(2.0, 0.1 * 2 ** failures))
+                continue
+
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    failures = 0
+                    yield json.loads(message.data)
+
+            if self.ws is ws:
+                self.ws = None
+            if not self.closed:
+                failures += 1
+                if failures > config('DEEPGRAM_STT_RECONNECTS', default=3, cast=int):
+                    raise ConnectionError(f"Deepgram STT closed the stream ({ws.close_code})")
+                logger.warning("Deepgram STT stream dropped, reconnecting: %s", ws.close_code, extra={"channel": self.channel})
+                logs.record("stt_dropped", code=ws.close_code)
+                source = "reconnect"
+
+    async def close(self):
+        self.closed = True
+        ws, self.ws = self.ws, None
+        self.buffer.clear()
+        self.buffered = 0
+        if ws is not None:
+            await ws.close()
+
+
+class ConnectionPool:
+    """
+    Per-worker pool of pre-opened Deepgram STT sockets, DEEPGRAM_STT_POOL_SIZE per call channel (0 disables it).
+    Idle sockets are kept alive with KeepAlive messages and recycled after DEEPGRAM_STT_POOL_MAX_AGE seconds,
+    so a new call starts transcribing without waiting on the TLS and websocket handshake.
+    """
+    def __init__(self, size, channels=("web", "twilio")):
+        self.size = size
+        self.idle = {channel: collections.deque() for channel in channels}     # (url, opened at, ws)
+        self.refill_tasks = {}
+        self.close_tasks = set()       # closes of discarded sockets, held until done so they are not garbage-collected
+        self.keepalive_task = None
+        self.session = None
+
+    def start(self, aiohttp_session):
+        if self.size <= 0:
+            return
+        self.session = aiohttp_session
+        for channel in self.idle:
+            self.refill(channel)
+        if self.keepalive_task is None or self.keepalive_task.done():
+            self.keepalive_task = asyncio.create_task(self.keepalive(), context=logs.worker_context())
+
+    def refill(self, channel):
+        task = self.refill_tasks.get(channel)
+        if self.session is not None and (task is None or task.done()):
+            self.refill_tasks[channel] = asyncio.create_task(self.fill(channel), context=logs.worker_context())
+
+    async def fill(self, channel):
+        while len(self.idle[channel]) < self.size:
+            url = stream_url(channel)
+            try:
+                ws = await connect(self.session, url)
+            except Exception as e:
+                logger.warning("Deepgram STT pool error: %s", e)
+                metrics.UPSTREAM_ERRORS.inc("deepgram_stt")
+                await asyncio.sleep(config('DEEPGRAM_STT_POOL_RETRY_DELAY', default=5, cast=int))
+                continue
+            self.idle[channel].append((url, time.monotonic(), ws))
+
+    def take(self, channel, url):
+        """
+        Returns an open pooled socket for `url`, or None if there is none.
+        """
+        idle = self.idle.get(channel)
+        if not idle:
+            return None
+        taken = None
+        while idle and taken is None:
+            pooled_url, _, ws = idle.popleft()
+            if pooled_url == url and is_open(ws):
+                taken = ws
+            else:
+                task = asyncio.create_task(ws.close(), context=logs.worker_context())
+                self.close_tasks.add(task)
+                task.add_done_callback(self.closed)
+        self.refill(channel)
+        return taken
+
+    def closed(self, task):
+        self.close_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Deepgram STT pool close error: %s", task.exception())
+
+    async def keepalive(self):
+        max_age = config('DEEPGRAM_STT_POOL_MAX_AGE', default=60, cast=float)
+        while True:
+            await asyncio.sleep(keepalive_interval())
+            for channel, idle in self.idle.items():
+                for entry in list(idle):
+                    _, opened, ws = entry
+                    try:
+                        if is_open(ws) and time.monotonic() - opened < max_age:
+                            await ws.send_str(KEEPALIVE)
+                            continue
+                    except (ConnectionError, aiohttp.ClientError):
+                        pass
+                    if entry in idle:
+                        idle.remove(entry)
+                    await ws.close()
+                self.refill(channel)
+
+    async def close(self):
+        for task in [self.keepalive_task, *self.refill_tasks.values()]:
+            if task is not None:
+                task.cancel()
+        for idle in self.idle.values():
+            while idle:
+                await idle.popleft()[2].close()
+
+
+pool = ConnectionPool(config('DEEPGRAM_STT_POOL_SIZE', default=0, cast=int))
@@ -0,0 +1,232 @@
+import asyncio, hashlib, json, logging, time
+import redis.asyncio as aredis
+from collections import OrderedDict
+from decouple import config
+from . import conversation_response, metrics, rate_limit, backend_router, upstream
+
+logger = logging.getLogger(__name__)
+
+# Deepgram TTS output formats requested by each consumer.
+WEB_AUDIO = {"encoding": "mp3"}
+TWILIO_AUDIO = {"encoding": "mulaw", "sample_rate": 8000, "container": "none"}
+
+INACTIVITY_PROMPT = "Hello? Are we playing the world’s quietest game of charades? Speak up dear!"
+
+# Fixed lines Iris speaks, synthesized into the cache at startup.
+PRESEED_PHRASES = [
+    INACTIVITY_PROMPT,
+    conversation_response.FALLBACK_REPLY,
+    conversation_response.ERROR_REPLY,
+]
+
+CACHE_KEY_PREFIX = "tts:"
+
+# Phrases also kept in the shared Redis tier: fixed lines every worker speaks. One-off LLM sentences only
+# go in the in-process LRU, so they never wait on a Redis round trip before TTS starts, nor pile up in Redis.
+shared_phrases = set(PRESEED_PHRASES)
+
+# Cache writes still in flight; held here so they are not garbage-collected (`store_cached_audio` logs failures).
+pending_stores = set()
+
+# Starts of upstream error bodies (JSON, HTML, XML) that must never be played or cached as audio.
+ERROR_BODY_PREFIXES = (b"{", b"[", b"<!doctype", b"<html", b"<?xml")
+audio_redis_client = None
+
+
+class AudioLRU:
+    """
+    In-process LRU of synthesized audio, bounded by total bytes.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        audio = self.entries.get(key)
+        if audio is not None:
+            self.entries.move_to_end(key)
+        return audio
+
+    def put(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = audio
+        self.size += len(audio)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+
+memory_cache = AudioLRU(config('TTS_CACHE_MAX_BYTES', default=32 * 1024 * 1024, cast=int))
+
+async def get_audio_redis_client():
+    """
+    Lazily initialize and return a Redis client for binary audio values (no response decoding).
+    """
+    global audio_redis_client
+    if audio_redis_client is None:
+        audio_redis_client = await aredis.from_url(config('REDIS_URL'))
+    return audio_redis_client
+
+def tts_url(backend, audio_format):
+    params = "&".join(f"{name}={value}" for name, value in audio_format.items())
+    return f"{backend.url}?model={backend.model}&{params}"
+
+def tts_headers(backend):
+    return {
+        "Authorization": f"Token {backend.api_key}",
+        "Content-Type": "application/json"
+    }
+
+def tts_request(text, audio_format, attempted):
+    """
+    Router request for `text`; each backend tried is appended to `attempted`, so the last one served it.
+    """
+    def request(backend):
+        attempted.append(backend)
+        return tts_url(backend, audio_format), {"json": {"text": text}, "headers": tts_headers(backend)}
+    return request
+
+def cache_key(text, audio_format, model):
+    """
+    Content address of a synthesized clip: (text, TTS model, encoding, sample rate, container).
+    """
+    identity = json.dumps([
+        text,
+        model,
+        audio_format.get("encoding"),
+        audio_format.get("sample_rate"),
+        audio_format.get("container"),
+    ])
+    return CACHE_KEY_PREFIX + hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+def is_audio(clip):
+    """
+    Whether a whole synthesized clip can be kept for playback: not empty, and not an error body.
+    """
+    if not clip:
+        return False
+    head = clip[:16].lstrip().lower()
+    if not head.startswith(ERROR_BODY_PREFIXES):
+        return True
+    if head[:1] in (b"{", b"["):
+        # Raw mulaw can start with these bytes too; only a body that parses is an error document.
+        try:
+            json.loads(clip)
+        except ValueError:
+            return True
+    return False
+
+def is_cacheable(text):
+    return config('TTS_CACHE_ENABLED', default=True, cast=bool) and \
+        len(text) <= config('TTS_CACHE_MAX_TEXT_CHARS', default=80, cast=int)
+
+async def get_cached_audio(key, shared=True):
+    audio = memory_cache.get(key)
+    if audio is not None:
+        metrics.TTS_CACHE.inc("memory")
+        return audio
+    if not shared:
+        metrics.TTS_CACHE.inc("miss")
+        return None
+
+    try:
+        client = await get_audio_redis_client()
+        audio = await client.get(key)
+    except Exception as e:
+        logger.warning("TTS cache read error: %s", e)
+        metrics.UPSTREAM_ERRORS.inc("redis")
+        return None
+
+    if audio is not None:
+        memory_cache.put(key, audio)
+    metrics.TTS_CACHE.inc("miss" if audio is None else "redis")
+    return audio
+
+async def store_cached_audio(key, audio, shared=True):
+    memory_cache.put(key, audio)
+    if not shared:
+        return
+    try:
+        client = await get_audio_redis_client()
+        await client.set(key, audio, ex=config('TTS_CACHE_TTL', default=7 * 24 * 3600, cast=int))
+    except Exception as e:
+        logger.warning("TTS cache write error: %s", e)
+        metrics.UPSTREAM_ERRORS.inc("redis")
+
+async def cached_phrase(text, audio_format):
+    """
+    Cached audio of `text` in the primary backend's voice, or None. Never calls Deepgram, so it also works
+    with the TTS budget exhausted.
+    """
+    model = backend_router.tts().backends[0].model
+    return await get_cached_audio(cache_key(text, audio_format, model), text in shared_phrases)
+
+async def synthesize(aiohttp_session, text, audio_format, chunk_size=1024, priority="live"):
+    """
+    Yields synthesized audio chunks for `text`.
+    - Short texts are served from the in-process LRU without calling Deepgram; `shared_phrases` also
+      from the Redis tier other workers fill.
+    - On a miss the Deepgram stream is passed through as it arrives and, if cacheable, stored in both tiers.
+    - Misses draw on the shared TTS character budget; raises `RateLimited` if it is exhausted.
+    """
+    cacheable = is_cacheable(text)
+    # Only the first configured backend's voice is cached; a failover clip in another voice is played, not kept.
+    model = backend_router.tts().backends[0].model
+    key = cache_key(text, audio_format, model) if cacheable else None
+
+    shared = text in shared_phrases
+    if cacheable:
+        audio = await get_cached_audio(key, shared)
+        if audio is not None:
+            for start in range(0, len(audio), chunk_size):
+                yield audio[start:start + chunk_size]
+            return
+
+    if not await rate_limit.acquire_tts(text, priority):
+        raise rate_limit.RateLimited("deepgram_tts")
+
+    chunks, first_chunk, attempted = [], True, []
+    started = time.perf_counter()
+    async with backend_router.tts().post(aiohttp_session, tts_request(text, audio_format, attempted)) as response:
+        # An error body must not reach the caller (or a cache) as audio.
+        if response.status != 200:
+            raise upstream.UpstreamError(f"deepgram_tts HTTP {response.status}")
+        if response.content_type == "application/json" or response.content_type.startswith("text/"):
+            raise upstream.UpstreamError(f"deepgram_tts returned {response.content_type}, not audio")
+
+        async for chunk in response.content.iter_chunked(chunk_size):
+            if chunk:
+                if first_chunk:
+                    first_chunk = False
+                    metrics.UPSTREAM_SECONDS.observe("deepgram_tts", "first_byte", value=time.perf_counter() - started)
+                if cacheable:
+                    chunks.append(chunk)
+                yield chunk
+
+        metrics.UPSTREAM_SECONDS.observe("deepgram_tts", "total", value=time.perf_counter() - started)
+        if cacheable and chunks and attempted[-1].model == model:
+            store = asyncio.create_task(store_cached_audio(key, b"".join(chunks), shared))
+            pending_stores.add(store)
+            store.add_done_callback(pending_stores.discard)
+
+async def preseed(aiohttp_session, phrases=None, formats=(WEB_AUDIO, TWILIO_AUDIO)):
+    """
+    Synthesizes fixed phrases into the cache (both tiers) so canned prompts play instantly.
+    """
+    phrases = phrases or PRESEED_PHRASES
+    shared_phrases.update(phrases)
+
+    async def seed(text, audio_format):
+        try:
+            async for _ in synthesize(aiohttp_session, text, audio_format, priority="background"):
+                pass
+        except Exception as e:
+            logger.warning("TTS cache preseed error: %s", e)
+
+    await asyncio.gather(*(
+        seed(text, audio_format) for text in phrases for audio_format in formats
+    ))
@@ -110,6 +110,10 @@ document.addEventListener("DOMContentLoaded", function () {
                 console.log("Auto-stop triggered due to inactivity.");
                 stopRecording(false);
                 resetVoiceButton();
+            } else if (data.command === "busy") {
+                // Server is at capacity: it closes the connection after this message.
+                addMessage(data.message, true);
+                voiceButton.disabled = true;
             } 
         } else {
             // For binary data (audio chunks), enqueue and attempt to append
@@ -153,14 +157,20 @@ document.addEventListener("DOMContentLoaded", function () {
         socket.send(JSON.stringify({ command: "start" }));
 
         try {
-            const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
-            mediaRecorder = new MediaRecorder(stream);
-            mediaRecorder.ondataavailable = (event) => {
-                if (event.data.size > 0 && socket.readyState === WebSocket.OPEN) {
-                    socket.send(event.data);
-                }
-            };
-            mediaRecorder.start(250); // Send small audio chunks
+            if (!mediaRecorder) {
+                // One recorder for the whole conversation: the server keeps one Deepgram stream open for it,
+                // so the audio must stay a single webm stream that is only paused between turns.
+                const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+                mediaRecorder = new MediaRecorder(stream);
+                mediaRecorder.ondataavailable = (event) => {
+                    if (event.data.size > 0 && socket.readyState === WebSocket.OPEN) {
+                        socket.send(event.data);
+                    }
+                };
+                mediaRecorder.start(250); // Send small audio chunks
+            } else if (mediaRecorder.state === "paused") {
+                mediaRecorder.resume();
+            }
             voiceButton.querySelector("span").textContent = "I'm Listening...";
             voiceButton.classList.remove("btn-success");
             voiceButton.classList.add("btn-danger")
@@ -177,8 +187,10 @@ document.addEventListener("DOMContentLoaded", function () {
             socket.send(JSON.stringify({ command: "stop" }));
             resetVoiceButton();
         }
-        if (mediaRecorder) {
-            mediaRecorder.stop();
+        if (mediaRecorder && mediaRecorder.state === "recording") {
+            // Send what was captured so far now, rather than at the start of the next turn.
+            mediaRecorder.requestData();
+            mediaRecorder.pause();
             console.log("Paused Listening...");
         }
     }
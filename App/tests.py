@@ -1,3 +1,1444 @@
-from django.test import TestCase
+import asyncio, base64, json, logging, os, time
+from unittest import IsolatedAsyncioTestCase, mock
+import numpy as np
+import fakeredis
+from aiohttp import web, test_utils, ClientSession
+from django.test import SimpleTestCase, RequestFactory
+from . import admission, audio, audio_ingest, backend_router, call_registry, consumers, conversation_context, conversation_response, fillers, greeting_pool, http_client, lifespan, logs, metrics, pipeline, rate_limit, speech_recognition, speech_synthesis, twilio_audio, upstream, views, voice_activity
+from .management.commands import bench_hotpaths, loadtest
 
-# Create your tests here.
+
+async def start_server(handler, path):
+    """
+    Local aiohttp server answering POSTs to `path` with `handler`; returns (server, url).
+    """
+    app = web.Application()
+    app.router.add_post(path, handler)
+    server = test_utils.TestServer(app)
+    await server.start_server()
+    return server, str(server.make_url(path))
+
+
+class SplitSegmentsTests(SimpleTestCase):
+    def test_short_sentences_wait_for_more_text(self):
+        segments, rest = conversation_response.split_segments("Hi. Okay then, I think so. And", 12, 60)
+        self.assertEqual(segments, ["Hi. Okay then, I think so."])
+        self.assertEqual(rest, "And")
+
+    def test_long_clauses_are_released(self):
+        segments, rest = conversation_response.split_segments(
+            "Well, since you asked about the weather this weekend, it looks like rain", 12, 20)
+        self.assertEqual(segments, ["Well, since you asked about the weather this weekend,"])
+        self.assertEqual(rest, "it looks like rain")
+
+    def test_abbreviations_and_decimals_do_not_split(self):
+        self.assertEqual(conversation_response.split_segments("Dr. Smith is 3.5 miles away.", 12, 60),
+                         ([], "Dr. Smith is 3.5 miles away."))
+
+
+def sse(*deltas):
+    """
+    An OpenAI chat completion stream of `deltas`.
+    """
+    events = [{"choices": [{"delta": {"content": delta}}]} for delta in deltas]
+    return "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+
+
+class StreamResponseTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.session = ClientSession()
+        self.servers = []
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        for server in self.servers:
+            await server.close()
+
+    async def serve(self, body, status=200):
+        async def completion(request):
+            return web.Response(status=status, body=body, content_type="text/event-stream")
+        server, url = await start_server(completion, "/v1/chat/completions")
+        self.servers.append(server)
+        return url
+
+    async def segments(self, url):
+        with mock.patch.dict(os.environ, {"OPENAI_API_ENDPOINT": url}):
+            backend_router.routers.pop("llm", None)
+            self.addCleanup(backend_router.routers.pop, "llm", None)
+            return [segment async for segment in
+                    conversation_response.stream_response(self.session, "Hello", "session", no_context=True)]
+
+    async def test_segments_are_released_as_they_complete(self):
+        url = await self.serve(sse("Oh, hi there", "! How are", " you doing today? I was", " just thinking"))
+        self.assertEqual(await self.segments(url), ["Oh, hi there!", "How are you doing today?", "I was just thinking"])
+
+    async def test_empty_stream_speaks_the_error_reply(self):
+        url = await self.serve("data: [DONE]\n\n")
+        self.assertEqual(await self.segments(url), [conversation_response.ERROR_REPLY])
+
+    async def test_rejected_requests_are_not_read_as_replies(self):
+        # A 400 is not a backend fault, so it reaches the caller; its body is an error, not a completion.
+        url = await self.serve(sse("Invalid request"), status=400)
+        self.assertEqual(await self.segments(url), [conversation_response.FALLBACK_REPLY])
+        url = await self.serve(json.dumps({"choices": [{"message": {"content": "Invalid request"}}]}), status=422)
+        with mock.patch.dict(os.environ, {"OPENAI_API_ENDPOINT": url}):
+            backend_router.routers.pop("llm", None)
+            reply = await conversation_response.get_response(self.session, "Hello", "session", no_context=True)
+        self.assertEqual(reply, conversation_response.FALLBACK_REPLY)
+
+
+class LifespanTests(IsolatedAsyncioTestCase):
+    async def test_startup_runs_once_per_worker(self):
+        app = lifespan.LifespanMiddleware(mock.AsyncMock())
+        self.addCleanup(setattr, lifespan, "startup_task", None)
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        send = mock.AsyncMock()
+        with mock.patch.object(lifespan, "startup", mock.AsyncMock()) as startup, \
+                mock.patch.object(lifespan, "shutdown", mock.AsyncMock()):
+            await app({"type": "lifespan"}, mock.AsyncMock(side_effect=messages), send)
+            await app({"type": "http"}, None, None)
+        startup.assert_awaited_once()
+        self.assertEqual([call.args[0]["type"] for call in send.await_args_list],
+                         ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+
+
+class HttpClientTests(IsolatedAsyncioTestCase):
+    async def asyncTearDown(self):
+        await http_client.close_http_session()
+
+    async def test_one_session_per_worker(self):
+        session = await http_client.get_http_session()
+        self.assertIs(await http_client.get_http_session(), session)
+        await http_client.close_http_session()
+        self.assertIsNot(await http_client.get_http_session(), session)
+
+    async def test_warmup_opens_connections_to_each_endpoint(self):
+        hits = []
+
+        async def head(request):
+            hits.append(request.path)
+            return web.Response()
+        app = web.Application()
+        app.router.add_route("HEAD", "/{endpoint}", head)
+        server = test_utils.TestServer(app)
+        await server.start_server()
+        self.addAsyncCleanup(server.close)
+        with mock.patch.dict(os.environ, {"OPENAI_API_ENDPOINT": str(server.make_url("/llm")),
+                                          "DEEPGRAM_TTS_API_ENDPOINT": str(server.make_url("/tts")),
+                                          "HTTP_WARMUP_CONNECTIONS": "2"}):
+            backend_router.routers.clear()
+            self.addCleanup(backend_router.routers.clear)
+            await http_client.warmup()
+        self.assertEqual(sorted(hits), ["/llm", "/llm", "/tts", "/tts"])
+
+
+class ConversationStoreTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        conversation_context.redis_client = self.redis
+        self.addCleanup(setattr, conversation_context, "redis_client", None)
+
+    async def test_messages_are_appended_to_a_list(self):
+        await conversation_context.update_conversation_context("s1", "user", "Hi")
+        messages = await conversation_context.update_conversation_context("s1", "assistant", "Hello!")
+        self.assertEqual(messages, [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}])
+        self.assertEqual(await self.redis.llen("conversation:s1"), 2)
+        self.assertGreater(await self.redis.ttl("conversation:s1"), 0)
+
+    async def test_the_prompt_window_is_the_most_recent_messages(self):
+        with mock.patch.dict(os.environ, {"CONVERSATION_CONTEXT_WINDOW": "2"}):
+            for text in ("one", "two", "three"):
+                messages = await conversation_context.update_conversation_context("s1", "user", text)
+        self.assertEqual([message["content"] for message in messages], ["two", "three"])
+
+    async def test_legacy_context_is_migrated(self):
+        await self.redis.set("s1", json.dumps([{"role": "user", "content": "Old"}]))
+        messages = await conversation_context.update_conversation_context("s1", "user", "New")
+        self.assertEqual([message["content"] for message in messages], ["Old", "New"])
+        self.assertFalse(await self.redis.exists("s1"))
+
+    async def test_remove_deletes_both_layouts(self):
+        await self.redis.set("s1", "[]")
+        await conversation_context.update_conversation_context("s1", "user", "Hi")
+        await conversation_context.remove_conversation_context("s1")
+        self.assertEqual(await self.redis.exists("s1", "conversation:s1"), 0)
+
+
+class AudioLRUTests(SimpleTestCase):
+    def test_evicts_least_recently_used_by_bytes(self):
+        cache = speech_synthesis.AudioLRU(max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.get("a")
+        cache.put("c", b"1234")
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertEqual(cache.size, 8)
+
+    def test_skips_clips_larger_than_the_cache(self):
+        cache = speech_synthesis.AudioLRU(max_bytes=10)
+        cache.put("a", b"x" * 11)
+        self.assertIsNone(cache.get("a"))
+
+    def test_key_covers_text_format_and_model(self):
+        key = speech_synthesis.cache_key("Hello", speech_synthesis.TWILIO_AUDIO, "aura")
+        self.assertEqual(key, speech_synthesis.cache_key("Hello", dict(speech_synthesis.TWILIO_AUDIO), "aura"))
+        self.assertNotEqual(key, speech_synthesis.cache_key("Hello", speech_synthesis.WEB_AUDIO, "aura"))
+        self.assertNotEqual(key, speech_synthesis.cache_key("Hello!", speech_synthesis.TWILIO_AUDIO, "aura"))
+        self.assertNotEqual(key, speech_synthesis.cache_key("Hello", speech_synthesis.TWILIO_AUDIO, "other-voice"))
+
+
+async def eventually(predicate, timeout=1.0):
+    """
+    Waits for background work (e.g. a cache write) until `predicate()` holds.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await predicate() and loop.time() < deadline:
+        await asyncio.sleep(0.005)
+
+
+class TTSCacheTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = 0
+
+        async def speak(request):
+            self.requests += 1
+            return web.Response(body=b"\xfe" * 3000, content_type="audio/basic")
+        self.server, url = await start_server(speak, "/v1/speak")
+        self.env = mock.patch.dict(os.environ, {"DEEPGRAM_TTS_API_ENDPOINT": url, "TTS_CACHE_ENABLED": "true"})
+        self.env.start()
+        backend_router.routers.pop("tts", None)
+        self.addCleanup(backend_router.routers.pop, "tts", None)
+        self.redis = fakeredis.FakeAsyncRedis()
+        self.patches = [mock.patch.object(speech_synthesis, "audio_redis_client", self.redis),
+                        mock.patch.object(speech_synthesis, "memory_cache", speech_synthesis.AudioLRU(1 << 20))]
+        for patch in self.patches:
+            patch.start()
+        self.session = ClientSession()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.close()
+        for patch in self.patches:
+            patch.stop()
+        self.env.stop()
+
+    async def collect(self, text):
+        return b"".join([chunk async for chunk in speech_synthesis.synthesize(self.session, text, speech_synthesis.TWILIO_AUDIO)])
+
+    async def test_repeated_phrases_are_served_from_memory(self):
+        self.assertEqual(await self.collect("Sure, I can help."), b"\xfe" * 3000)
+
+        async def cached():
+            return bool(speech_synthesis.memory_cache.entries)
+        await eventually(cached)
+        self.assertEqual(await self.collect("Sure, I can help."), b"\xfe" * 3000)
+        self.assertEqual(self.requests, 1)
+        self.assertEqual(await self.redis.dbsize(), 0)
+
+    async def test_other_workers_share_the_redis_tier(self):
+        with mock.patch.object(speech_synthesis, "shared_phrases", {"Hello? Are you there?"}):
+            await self.collect("Hello? Are you there?")
+            await eventually(self.redis.dbsize)
+            speech_synthesis.memory_cache.entries.clear()
+            self.assertEqual(await self.collect("Hello? Are you there?"), b"\xfe" * 3000)
+        self.assertEqual(self.requests, 1)
+
+    async def test_long_texts_are_not_cached(self):
+        text = "This reply is far too long to be worth caching, since it will almost certainly never be said again."
+        await self.collect(text)
+        await self.collect(text)
+        self.assertEqual(self.requests, 2)
+
+
+class GreetingPoolTests(IsolatedAsyncioTestCase):
+    async def test_refills_up_to_its_size(self):
+        pool = greeting_pool.GreetingPool(2)
+        greetings = iter(greeting_pool.Greeting(f"Hi {n}", b"\xff") for n in range(10))
+        with mock.patch.object(pool, "generate", mock.AsyncMock(side_effect=lambda session: next(greetings))):
+            pool.start(None)
+            await asyncio.sleep(0.01)
+            self.assertEqual([pool.take().text, pool.take().text], ["Hi 0", "Hi 1"])
+            await asyncio.sleep(0.01)
+            self.assertEqual(pool.greetings.qsize(), 2)
+            pool.refill_task.cancel()
+        self.assertIsNotNone(pool.take())
+
+    async def test_take_from_an_empty_pool(self):
+        self.assertIsNone(greeting_pool.GreetingPool(2).take())
+
+    async def test_failed_replies_are_not_pooled(self):
+        async def synthesize(session, text, audio_format, **kwargs):
+            yield b"\xff" * 100
+        pool = greeting_pool.GreetingPool(2)
+        with mock.patch.object(speech_synthesis, "synthesize", synthesize), \
+                mock.patch.object(conversation_response, "get_response", mock.AsyncMock(return_value=conversation_response.FALLBACK_REPLY)):
+            self.assertIsNone(await pool.generate(None))
+        with mock.patch.object(speech_synthesis, "synthesize", synthesize), \
+                mock.patch.object(conversation_response, "get_response", mock.AsyncMock(return_value="Hi, I'm Iris!")):
+            self.assertEqual(await pool.generate(None), greeting_pool.Greeting("Hi, I'm Iris!", b"\xff" * 100))
+
+
+class TurnTests(IsolatedAsyncioTestCase):
+    async def test_a_new_turn_cancels_the_one_in_flight(self):
+        consumer = consumers.VoiceConsumer()
+        consumer.scope = {"session": {"session_id": "s1"}}
+        consumer.open_call_log()
+        consumer.tasks = pipeline.TaskSupervisor("test")
+        first = asyncio.Event()
+        await consumer.start_turn(first.wait())
+        running = consumer.turn_task
+        await consumer.start_turn(asyncio.sleep(0))
+        self.assertTrue(running.cancelled())
+        await consumer.turn_task
+        self.assertFalse(await consumer.cancel_turn())
+
+    async def test_out_of_tts_budget_plays_the_fallback_reply(self):
+        consumer = consumers.VoiceConsumer()
+        consumer.scope = {"session": {"session_id": "s1"}}
+        consumer.open_call_log()
+        consumer.aiohttp_session = None
+        consumer.audio_out = mock.Mock(audio_format=speech_synthesis.TWILIO_AUDIO, write=mock.AsyncMock(), finish=mock.AsyncMock())
+
+        async def limited(*args, **kwargs):
+            raise rate_limit.RateLimited("deepgram_tts")
+            yield
+        with mock.patch.object(speech_synthesis, "synthesize", limited), \
+             mock.patch.object(speech_synthesis, "cached_phrase", mock.AsyncMock(return_value=b"fallback")) as cached:
+            await consumer.speak(conversation_response.reply_segments("Sure thing. It is sunny today, all day long."))
+        cached.assert_awaited_once_with(conversation_response.FALLBACK_REPLY, speech_synthesis.TWILIO_AUDIO)
+        consumer.audio_out.write.assert_awaited_once_with(b"fallback")
+
+    async def test_barge_in_clears_twilio_audio(self):
+        consumer = consumers.TwilioVoiceConsumer()
+        consumer.scope = {"session": {"session_id": "s1"}}
+        consumer.open_call_log()
+        consumer.tasks = pipeline.TaskSupervisor("test")
+        consumer.send = mock.AsyncMock()
+        consumer.audio_out = twilio_audio.TwilioAudioWriter(consumer.send, "MZ1")
+        await consumer.start_turn(asyncio.Event().wait())
+        self.assertTrue(await consumer.cancel_turn())
+        self.assertEqual(json.loads(consumer.send.call_args.kwargs["text_data"]), {"event": "clear", "streamSid": "MZ1"})
+
+
+class MediaPayloadTests(SimpleTestCase):
+    def test_media_payload_is_sliced_out(self):
+        frame = json.dumps({"event": "media", "streamSid": "MZ1", "media": {"track": "inbound", "payload": "//79/A=="}},
+                           separators=(",", ":"))
+        self.assertEqual(audio_ingest.extract_media_payload(frame), "//79/A==")
+
+    def test_other_events_take_the_slow_path(self):
+        self.assertIsNone(audio_ingest.extract_media_payload('{"event":"mark","mark":{"name":"1"}}'))
+        self.assertIsNone(audio_ingest.extract_media_payload('{"event": "media", "media": {"payload": "AA=="}}'))
+        self.assertIsNone(audio_ingest.extract_media_payload('{"event":"media","media":{"payload":"A\\u0041=="}}'))
+
+
+class AudioCoalescerTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sent = []
+
+        async def send(data):
+            self.sent.append(data)
+        self.coalescer = audio_ingest.AudioCoalescer(send, flush_bytes=480, flush_interval=0.02)
+
+    async def test_frames_are_batched_up_to_flush_bytes(self):
+        for n in range(3):
+            await self.coalescer.add(bytes([n]) * 160)
+        self.assertEqual(self.sent, [b"\x00" * 160 + b"\x01" * 160 + b"\x02" * 160])
+
+    async def test_a_partial_batch_is_flushed_after_the_interval(self):
+        await self.coalescer.add(b"\x00" * 160)
+        self.assertEqual(self.sent, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.sent, [b"\x00" * 160])
+
+    async def test_close_drops_pending_audio(self):
+        await self.coalescer.add(b"\x00" * 160)
+        self.coalescer.close()
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.sent, [])
+
+
+class TwilioAudioWriterTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.sent = []
+
+        async def send(text_data):
+            self.sent.append(text_data)
+        self.send = send
+        self.writer = twilio_audio.TwilioAudioWriter(send, "MZ1", frame_ms=100, lead_ms=10000, mark_interval_ms=1000)
+
+    def messages(self, event):
+        return [message for message in map(json.loads, self.sent) if message["event"] == event]
+
+    async def test_audio_is_sent_in_whole_frames(self):
+        await self.writer.write(b"\xff" * 2000)
+        self.assertEqual([len(base64.b64decode(m["media"]["payload"])) for m in self.messages("media")], [800, 800])
+        await self.writer.finish()
+        self.assertEqual(len(base64.b64decode(self.messages("media")[-1]["media"]["payload"])), 400)
+        self.assertEqual(self.messages("mark"), [{"event": "mark", "streamSid": "MZ1", "mark": {"name": "1"}}])
+        self.assertTrue(self.writer.playing)
+
+    async def test_marks_track_playback(self):
+        await self.writer.write(b"\xff" * 8000 * 2)
+        await self.writer.finish()
+        self.assertEqual([m["mark"]["name"] for m in self.messages("mark")], ["1", "2"])
+        self.writer.acknowledge("1")
+        self.assertEqual(self.writer.played_ms, 1000)
+        self.assertTrue(self.writer.playing)
+        self.writer.acknowledge("2")
+        self.writer.acknowledge("unknown")
+        self.assertEqual(self.writer.played_ms, 2000)
+        self.assertFalse(self.writer.playing)
+
+    async def test_clear_drops_pending_audio(self):
+        await self.writer.write(b"\xff" * 1000)
+        await self.writer.clear()
+        self.assertEqual(self.messages("clear"), [{"event": "clear", "streamSid": "MZ1"}])
+        self.assertFalse(self.writer.playing)
+
+    async def test_sends_are_paced_to_real_time(self):
+        writer = twilio_audio.TwilioAudioWriter(self.send, "MZ1", frame_ms=100, lead_ms=100)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await writer.write(b"\xff" * 8 * 400)
+        # 400 ms of audio with 100 ms allowed ahead of playback: the last frame waits ~200 ms.
+        self.assertGreater(loop.time() - started, 0.15)
+
+
+class MetricsTests(SimpleTestCase):
+    def metric(self, kind, *args, **kwargs):
+        metric = kind(*args, **kwargs)
+        self.addCleanup(metrics.registry.remove, metric)
+        return metric
+
+    def test_counter_renders_escaped_labels(self):
+        counter = self.metric(metrics.Counter, "test_total", "Test counter.", ["name"])
+        counter.inc('say "hi"')
+        counter.inc('say "hi"', amount=2)
+        self.assertEqual(counter.render(), ["# HELP test_total Test counter.", "# TYPE test_total counter",
+                                            'test_total{name="say \\"hi\\""} 3'])
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.metric(metrics.Histogram, "test_seconds", "Test histogram.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value=value)
+        self.assertEqual(histogram.render()[2:], ['test_seconds_bucket{le="0.1"} 1', 'test_seconds_bucket{le="1.0"} 3',
+                                                  'test_seconds_bucket{le="+Inf"} 4', "test_seconds_sum 6.25",
+                                                  "test_seconds_count 4"])
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', metrics.render())
+
+    def test_turn_timer_spans(self):
+        turn = metrics.TurnTimer("test")
+        turn.speech_started()
+        turn.final_transcript()
+        turn.audio_sent()
+        turn.audio_sent()
+        turn.finished()
+        counts = {span: metrics.TURN_SECONDS.values.pop(("test", span))[2] for span in ("transcript", "first_audio", "last_audio")}
+        self.assertEqual(counts, {"transcript": 1, "first_audio": 1, "last_audio": 1})
+
+
+class LoadTestReportTests(SimpleTestCase):
+    def test_parses_the_metrics_endpoint(self):
+        counter = metrics.Counter("test_total", "Test counter.", ["name"])
+        self.addCleanup(metrics.registry.remove, counter)
+        counter.inc('a "b"', amount=3)
+        samples = loadtest.parse_metrics(metrics.render())
+        self.assertEqual(samples[("test_total", frozenset({("name", 'a \\"b\\"')}))], 3)
+        self.assertEqual(loadtest.metric_sum(samples, "test_total"), 3)
+
+    def test_histogram_percentile_between_scrapes(self):
+        def scrape(*counts):
+            return {("turn_bucket", frozenset({("le", le)})): count for le, count in zip(("0.1", "1.0", "+Inf"), counts)}
+        before, after = scrape(5, 5, 5), scrape(6, 14, 15)
+        # Between the scrapes: 1 turn <= 0.1 s, 8 more <= 1 s, 1 slower.
+        self.assertEqual(loadtest.histogram_percentile(before, after, "turn", 50), 1.0)
+        self.assertEqual(loadtest.histogram_percentile(before, after, "turn", 10), 0.1)
+        self.assertEqual(loadtest.histogram_percentile(before, after, "turn", 99), float("inf"))
+
+
+class NormalizeTranscriptTests(SimpleTestCase):
+    def test_ignores_case_and_punctuation(self):
+        self.assertEqual(conversation_response.normalize_transcript("Well, I don't know!"),
+                         conversation_response.normalize_transcript("well I don't   know"))
+
+
+class SpeculationTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        conversation_context.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.addCleanup(setattr, conversation_context, "redis_client", None)
+        self.consumer = consumers.VoiceConsumer()
+        self.consumer.scope = {"session": {"session_id": "s1"}}
+        self.consumer.open_call_log()
+        self.consumer.aiohttp_session = None
+        self.consumer.tasks = pipeline.TaskSupervisor("test")
+        self.addAsyncCleanup(self.consumer.tasks.cancel_all)
+        self.addCleanup(conversation_context.live_contexts.clear)
+        self.speculate = mock.AsyncMock(return_value="Sounds great. Tell me more!")
+        patches = [mock.patch.object(conversation_response, "speculate", self.speculate),
+                   mock.patch.dict(os.environ, {"SPECULATIVE_STABLE_MS": "10"})]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    async def reply(self, transcript):
+        return [segment async for segment in self.consumer.reply_for(transcript)]
+
+    async def test_a_matching_final_commits_the_speculative_reply(self):
+        self.consumer.on_interim_transcript("I went hiking")
+        self.consumer.on_interim_transcript("I went hiking today")
+        await asyncio.sleep(0.05)
+        self.assertEqual(await self.reply("I went hiking today."), ["Sounds great.", "Tell me more!"])
+        self.speculate.assert_awaited_once_with(None, "I went hiking today", "s1")
+        self.assertEqual(await conversation_context.get_conversation_context("s1"), [
+            {"role": "user", "content": "I went hiking today."},
+            {"role": "assistant", "content": "Sounds great. Tell me more!"},
+        ])
+
+    async def test_a_different_final_generates_a_fresh_reply(self):
+        async def fresh(session, transcript, session_id):
+            yield "Oh, the beach!"
+        self.consumer.on_interim_transcript("I went hiking")
+        await asyncio.sleep(0.05)
+        with mock.patch.object(conversation_response, "get_response_segments", fresh):
+            self.assertEqual(await self.reply("I went to the beach."), ["Oh, the beach!"])
+        self.assertIsNone(self.consumer.speculation)
+
+    async def test_committed_replies_are_folded_past_the_budget(self):
+        context = await conversation_context.open_call_context("s1", self.consumer.tasks)
+        summarize = mock.AsyncMock(return_value="They went hiking.")
+        with mock.patch.object(conversation_response, "summarize", summarize), \
+                mock.patch.dict(os.environ, {"CONTEXT_SUMMARIZE_TOKENS": "20", "CONTEXT_VERBATIM_TOKENS": "10"}):
+            for transcript in ("I went hiking today.", "It was a long trail."):
+                self.consumer.on_interim_transcript(transcript)
+                await asyncio.sleep(0.05)
+                await self.reply(transcript)
+            await context.summary_task
+        self.assertEqual(summarize.await_args.args[0], "")
+        self.assertEqual(context.summary, "They went hiking.")
+        self.assertEqual(context.messages[-1], {"role": "assistant", "content": "Sounds great. Tell me more!"})
+
+
+class CallRegistryTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        conversation_context.redis_client = self.redis
+        self.addCleanup(setattr, conversation_context, "redis_client", None)
+        self.addCleanup(call_registry.local_calls.clear)
+        self.addCleanup(setattr, call_registry, "draining", False)
+
+    async def test_calls_are_listed_cluster_wide(self):
+        await call_registry.register_call("s1", "twilio", object())
+        await call_registry.update_call_state("s1", "speaking")
+        calls = await call_registry.list_calls()
+        self.assertEqual((calls["s1"]["worker"], calls["s1"]["state"]), (call_registry.WORKER_ID, "speaking"))
+        self.assertEqual(await call_registry.cluster_call_count(), 1)
+        await call_registry.unregister_call("s1")
+        self.assertEqual(await call_registry.list_calls(), {})
+
+    async def test_calls_of_dead_workers_are_swept(self):
+        now = time.time()
+        await self.redis.hset(call_registry.WORKERS_KEY, mapping={
+            "dead": json.dumps({"heartbeat": now - 60}), "live": json.dumps({"heartbeat": now})})
+        await self.redis.hset(call_registry.CALLS_KEY, mapping={
+            "a": json.dumps({"worker": "dead", "started": now - 100}),
+            "b": json.dumps({"worker": "live", "started": now - 100}),
+            "c": json.dumps({"worker": "new", "started": now})})
+        await call_registry.sweep_stale(self.redis, max_age=15)
+        self.assertEqual(sorted(await self.redis.hkeys(call_registry.CALLS_KEY)), ["b", "c"])
+        self.assertEqual(await self.redis.hkeys(call_registry.WORKERS_KEY), ["live"])
+
+    async def test_a_draining_worker_finishes_with_its_last_call(self):
+        with mock.patch.object(call_registry, "finish_drain") as finish_drain:
+            await call_registry.register_call("s1", "web", object())
+            call_registry.start_drain()
+            finish_drain.assert_not_called()
+            await call_registry.unregister_call("s1")
+            finish_drain.assert_called_once_with()
+
+    async def test_state_updates_leave_the_rest_of_the_call(self):
+        await call_registry.register_call("s1", "twilio", object())
+        await call_registry.update_call_state("s1", "streaming")
+        await call_registry.update_call_state("gone", "streaming")
+        calls = await call_registry.list_calls()
+        self.assertEqual(list(calls), ["s1"])
+        self.assertEqual((calls["s1"]["channel"], calls["s1"]["state"]), ("twilio", "streaming"))
+
+    async def test_a_registry_outage_does_not_block_calls(self):
+        consumer = consumers.VoiceConsumer()
+        consumer.scope = {"session": {"session_id": "s1"}}
+        consumer.channel = "web"
+        consumer.admit_on_connect = False
+        consumer.open_call_log()
+        consumer.channel_layer = mock.Mock(group_add=mock.AsyncMock(), group_discard=mock.AsyncMock())
+        consumer.channel_name = "specific.test"
+        self.addCleanup(conversation_context.live_contexts.clear)
+        errors = metrics.UPSTREAM_ERRORS.values.get(("redis",), 0)
+        with mock.patch.object(call_registry, "register_call", side_effect=ConnectionError("down")):
+            self.assertTrue(await consumer.join_call())
+        with mock.patch.object(call_registry, "finish_drain") as finish_drain, \
+                mock.patch.object(conversation_context, "get_redis_client", side_effect=ConnectionError("down")):
+            call_registry.draining = True
+            await consumer.leave_call()
+        finish_drain.assert_called_once_with()
+        self.assertEqual(metrics.UPSTREAM_ERRORS.values[("redis",)], errors + 2)
+
+
+def line_audio(seconds, noise_rms, tone_at=None, seed=1):
+    """
+    8 kHz mulaw of stationary Gaussian line noise, with an optional loud one-second tone starting at `tone_at`.
+    """
+    pcm = np.random.default_rng(seed).normal(0, noise_rms, 8000 * seconds)
+    if tone_at is not None:
+        pcm[tone_at * 8000:(tone_at + 1) * 8000] += 6000 * np.sin(2 * np.pi * 220 * np.arange(8000) / 8000)
+    return audio.pcm_to_mulaw(np.clip(pcm, -32768, 32767).astype(np.int16)).tobytes()
+
+
+class VoiceActivityGateTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.forwarded, self.events = [], []
+
+        async def forward(chunk):
+            self.forwarded.append(chunk)
+
+        async def keepalive():
+            self.events.append("keepalive")
+        self.gate = voice_activity.VoiceActivityGate(forward, keepalive=keepalive,
+                                                     on_speech_start=lambda: self.events.append("start"),
+                                                     on_speech_end=lambda: self.events.append("end"))
+
+    async def feed(self, data):
+        """
+        Feeds `data` in 20 ms chunks; returns the fraction of it that was forwarded.
+        """
+        self.forwarded.clear()
+        for start in range(0, len(data), 160):
+            await self.gate.add(data[start:start + 160])
+        return sum(map(len, self.forwarded)) / len(data)
+
+    async def test_stationary_noise_is_not_speech(self):
+        for noise_rms in (100, 400, 800):
+            with self.subTest(noise_rms=noise_rms):
+                self.setUp()
+                noise = line_audio(20, noise_rms)
+                # The floor rises to the line's level within a few seconds; after that nothing gets through.
+                await self.feed(noise[:8000 * 5])
+                self.assertEqual(await self.feed(noise[8000 * 5:]), 0)
+                self.assertFalse(self.gate.speaking)
+
+    async def test_speech_over_noise_is_forwarded(self):
+        await self.feed(line_audio(20, 400, tone_at=15))
+        self.assertEqual(self.events[-2:], ["start", "end"])
+        self.assertFalse(self.gate.speaking)
+
+    async def test_speech_over_a_quiet_line_is_forwarded(self):
+        forwarded = await self.feed(line_audio(6, 50, tone_at=3))
+        self.assertEqual([event for event in self.events if event != "keepalive"], ["start", "end"])
+        # The tone with its pre-roll and hangover, but not the quiet line around it.
+        self.assertGreater(forwarded, 1 / 6)
+        self.assertLess(forwarded, 2.5 / 6)
+        self.assertFalse(self.gate.speaking)
+
+    async def test_suppressed_silence_sends_keepalives(self):
+        await self.feed(bytes([0xFF]) * 8000 * 11)
+        self.assertEqual(self.forwarded, [])
+        self.assertEqual(self.events, ["keepalive", "keepalive"])
+
+    async def test_speech_from_the_first_frame_keeps_its_hangover(self):
+        tone = line_audio(1, 0, tone_at=0)
+        silence = bytes([0xFF]) * 8000 * 2
+        # The whole tone plus (nearly all of) the 800 ms hangover, so upstream endpointing sees the silence.
+        self.assertGreater(await self.feed(tone + silence), (8000 + 6000) / 24000)
+        self.assertEqual(self.events, ["start", "end"])
+
+    async def test_partial_frames_are_carried_over(self):
+        await self.feed(line_audio(1, 100)[:250])
+        self.assertEqual(len(self.gate.pending), 250 % self.gate.frame_samples)
+
+
+class G711Tests(SimpleTestCase):
+    codes = np.arange(256, dtype=np.uint8)
+
+    def test_reference_values(self):
+        self.assertEqual(audio.MULAW_TO_PCM[[0x00, 0x7F, 0x80, 0xFF]].tolist(), [-32124, 0, 32124, 0])
+        self.assertEqual(audio.ALAW_TO_PCM[[0x55, 0xD5, 0x2A, 0xAA]].tolist(), [-8, 8, -32256, 32256])
+
+    def test_codes_round_trip(self):
+        # Both mulaw zeros (0x7F, 0xFF) encode back to 0xFF.
+        mulaw = audio.pcm_to_mulaw(audio.mulaw_to_pcm(self.codes.tobytes()))
+        self.assertEqual(np.flatnonzero(mulaw != self.codes).tolist(), [0x7F])
+        self.assertEqual(mulaw[0x7F], 0xFF)
+        np.testing.assert_array_equal(audio.pcm_to_alaw(audio.alaw_to_pcm(self.codes.tobytes())), self.codes)
+
+    def test_encoding_is_monotonic(self):
+        pcm = np.arange(-32768, 32768, dtype=np.int32).astype(np.int16)
+        for decode, encode in ((audio.mulaw_to_pcm, audio.pcm_to_mulaw), (audio.alaw_to_pcm, audio.pcm_to_alaw)):
+            with self.subTest(encode=encode.__name__):
+                self.assertTrue(np.all(np.diff(decode(encode(pcm)).astype(np.int32)) >= 0))
+
+
+def tone(rate, seconds=0.5, frequency=440, amplitude=8000):
+    return (amplitude * np.sin(2 * np.pi * frequency * np.arange(int(rate * seconds)) / rate)).astype(np.int16)
+
+
+class ResamplerTests(SimpleTestCase):
+    def test_a_tone_survives_resampling(self):
+        for from_rate, to_rate in ((8000, 16000), (24000, 8000), (16000, 48000)):
+            with self.subTest(from_rate=from_rate, to_rate=to_rate):
+                out = audio.resample(tone(from_rate), from_rate, to_rate).astype(np.float64)
+                self.assertAlmostEqual(len(out), to_rate // 2, delta=2)
+                # Past the filter's start-up, the output is the same tone at the new rate (delayed by the filter).
+                steady = out[len(out) // 4:]
+                spectrum = np.abs(np.fft.rfft(steady))
+                self.assertAlmostEqual(np.argmax(spectrum) * to_rate / len(steady), 440, delta=to_rate / len(steady))
+                self.assertAlmostEqual(np.sqrt(np.mean(steady ** 2)), 8000 / np.sqrt(2), delta=200)
+
+    def test_streaming_matches_one_shot(self):
+        pcm = tone(8000)
+        resampler = audio.Resampler(8000, 24000)
+        chunks = [resampler.process(pcm[start:start + 160]) for start in range(0, len(pcm), 160)]
+        np.testing.assert_array_equal(np.concatenate(chunks), audio.resample(pcm, 8000, 24000))
+
+    def test_gain_saturates(self):
+        self.assertEqual(audio.apply_gain(np.array([20000, -20000, 100], dtype=np.int16), 2).tolist(), [32767, -32768, 200])
+
+    def test_transcode_linear16_to_twilio(self):
+        mulaw = audio.transcode(tone(24000).tobytes(), "linear16", 24000, "mulaw", 8000)
+        self.assertAlmostEqual(len(mulaw), 4000, delta=2)
+        pcm = audio.mulaw_to_pcm(mulaw)[1000:].astype(np.float64)
+        self.assertAlmostEqual(np.sqrt(np.mean(pcm ** 2)), 8000 / np.sqrt(2), delta=300)
+
+
+async def numbers(count, produced=None):
+    for n in range(count):
+        if produced is not None:
+            produced.append(n)
+        yield n
+
+
+class RunStagesTests(IsolatedAsyncioTestCase):
+    async def test_outputs_arrive_in_order(self):
+        async def twice(n):
+            yield n
+            yield n
+
+        out = []
+
+        async def sink(item):
+            out.append(item)
+        await pipeline.run_stages(numbers(4), [twice], sink, maxsize=1)
+        self.assertEqual(out, [0, 0, 1, 1, 2, 2, 3, 3])
+
+    async def test_a_slow_sink_holds_the_source_back(self):
+        produced, consumed = [], []
+
+        async def passthrough(n):
+            yield n
+
+        async def sink(item):
+            await asyncio.sleep(0.001)
+            consumed.append(item)
+            # Each queue holds at most one item, plus one in hand per step.
+            self.assertLessEqual(len(produced) - len(consumed), 5)
+        await pipeline.run_stages(numbers(50, produced), [passthrough], sink, maxsize=1)
+        self.assertEqual(len(consumed), 50)
+
+    async def test_a_failing_stage_stops_the_pipeline(self):
+        async def explode(n):
+            if n == 2:
+                raise ValueError("bad segment")
+            yield n
+
+        async def sink(item):
+            pass
+        with self.assertRaisesRegex(ValueError, "bad segment"):
+            await pipeline.run_stages(numbers(100), [explode], sink, maxsize=1)
+
+    async def test_a_stuck_step_times_out(self):
+        async def passthrough(n):
+            yield n
+
+        async def stuck(item):
+            await asyncio.Event().wait()
+        with self.assertRaises(TimeoutError):
+            await pipeline.run_stages(numbers(10), [passthrough], stuck, maxsize=1, timeout=0.05)
+
+
+class TaskSupervisorTests(IsolatedAsyncioTestCase):
+    async def test_failures_are_counted_and_the_rest_cancelled(self):
+        tasks = pipeline.TaskSupervisor("test")
+
+        async def fail():
+            raise RuntimeError("lost")
+        tasks.spawn(fail(), "failing")
+        waiting = tasks.spawn(asyncio.Event().wait(), "waiting")
+        await asyncio.sleep(0.01)
+        self.assertEqual(metrics.TASK_FAILURES.values.pop(("test", "failing")), 1)
+        await tasks.cancel_all()
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(tasks.tasks, set())
+
+
+class TokenBucketTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        conversation_context.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.addCleanup(setattr, conversation_context, "redis_client", None)
+        self.bucket = rate_limit.TokenBucket("TEST_CHARACTERS")
+
+    async def test_a_burst_is_allowed_then_callers_wait(self):
+        # 600 per minute: 10 per second, bursts of up to RATE_LIMIT_BURST_SECONDS (10 s) = 100.
+        with mock.patch.dict(os.environ, {"TEST_CHARACTERS_PER_MINUTE": "600"}):
+            self.assertTrue(await self.bucket.acquire(100, max_wait=0))
+            self.assertFalse(await self.bucket.acquire(1, max_wait=0))
+            started = asyncio.get_running_loop().time()
+            self.assertTrue(await self.bucket.acquire(1, max_wait=1))
+            self.assertGreater(asyncio.get_running_loop().time() - started, 0.05)
+
+    async def test_disabled_buckets_do_not_touch_redis(self):
+        conversation_context.redis_client = None
+        with mock.patch.object(conversation_context, "get_redis_client", side_effect=AssertionError("Redis used")):
+            self.assertTrue(await self.bucket.acquire(10 ** 6, max_wait=0))
+
+    async def test_fails_open_without_redis(self):
+        with mock.patch.dict(os.environ, {"TEST_CHARACTERS_PER_MINUTE": "60"}), \
+                mock.patch.object(conversation_context, "get_redis_client", side_effect=ConnectionError("down")):
+            self.assertTrue(await self.bucket.acquire(10 ** 6, max_wait=0))
+
+    def test_background_work_never_waits(self):
+        self.assertEqual(rate_limit.max_wait("background"), 0)
+        self.assertGreater(rate_limit.max_wait("live"), 0)
+
+
+class AdmissionTests(IsolatedAsyncioTestCase):
+    def setUp(self):
+        call_registry.local_reservations.clear()
+        self.addCleanup(call_registry.local_reservations.clear)
+        self.addCleanup(call_registry.local_calls.clear)
+
+    async def test_per_worker_limit(self):
+        with mock.patch.dict(os.environ, {"MAX_CALLS_PER_WORKER": "2", "MAX_CALLS_CLUSTER": "0"}):
+            self.assertIsNotNone(await admission.admit("web"))
+            call_registry.local_calls.update({"a": None, "b": None})
+            self.assertIsNone(await admission.admit("web"))
+
+    async def test_burst_cannot_overbook_a_worker(self):
+        with mock.patch.dict(os.environ, {"MAX_CALLS_PER_WORKER": "2", "MAX_CALLS_CLUSTER": "0"}):
+            tokens = await asyncio.gather(*(admission.admit("web") for _ in range(5)))
+        self.assertEqual(sum(token is not None for token in tokens), 2)
+
+    async def test_expired_reservations_free_their_slot(self):
+        self.assertTrue(call_registry.reserve_local("a", limit=1, ttl=0))
+        self.assertTrue(call_registry.reserve_local("b", limit=1, ttl=30))
+        self.assertFalse(call_registry.reserve_local("c", limit=1, ttl=30))
+
+    async def test_webhooks_are_capped_per_live_worker(self):
+        with mock.patch.dict(os.environ, {"MAX_CALLS_PER_WORKER": "4", "MAX_CALLS_CLUSTER": "0"}), \
+                mock.patch.object(call_registry, "live_worker_count", mock.AsyncMock(return_value=3)), \
+                mock.patch.object(call_registry, "reserve_slot", mock.AsyncMock(return_value=True)) as reserve_slot:
+            self.assertIsNotNone(await admission.admit("twilio", local=False))
+        self.assertEqual(reserve_slot.call_args.args[1], 12)
+        self.assertEqual(call_registry.local_reservations, {})
+
+    async def test_an_unreachable_registry_does_not_block_calls(self):
+        with mock.patch.dict(os.environ, {"MAX_CALLS_PER_WORKER": "0", "MAX_CALLS_CLUSTER": "5"}), \
+                mock.patch.object(call_registry, "reserve_slot", side_effect=ConnectionError("down")):
+            self.assertIsNotNone(await admission.admit("twilio"))
+
+
+class BusyResponseTests(SimpleTestCase):
+    def busy(self, query=""):
+        request = RequestFactory().post("/iris-inbound-via-twilio/" + query)
+        return views.busy_response(request).content.decode()
+
+    def test_callers_hold_and_retry(self):
+        with mock.patch.dict(os.environ, {"ADMISSION_BUSY_ACTION": "queue", "ADMISSION_QUEUE_ATTEMPTS": "3"}):
+            self.assertIn(admission.HOLD_MESSAGE, self.busy())
+            self.assertIn("?attempt=1</Redirect>", self.busy())
+            self.assertNotIn(admission.HOLD_MESSAGE, self.busy("?attempt=1"))
+            self.assertIn("<Hangup />", self.busy("?attempt=3"))
+
+    def test_a_malformed_attempt_starts_over(self):
+        with mock.patch.dict(os.environ, {"ADMISSION_BUSY_ACTION": "queue", "ADMISSION_QUEUE_ATTEMPTS": "3"}):
+            self.assertIn("?attempt=1</Redirect>", self.busy("?attempt=abc"))
+            self.assertIn("?attempt=1</Redirect>", self.busy("?attempt=-5"))
+
+    def test_reject(self):
+        with mock.patch.dict(os.environ, {"ADMISSION_BUSY_ACTION": "reject"}):
+            self.assertIn('<Reject reason="busy" />', self.busy())
+
+
+class UpstreamTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.replies = []
+        self.requests = 0
+        self.server, self.url = await start_server(self.handle, "/v1")
+        self.session = ClientSession()
+        self.upstream = upstream.Upstream("test", first_byte_timeout=0.2, stall_timeout=1, deadline=2, retries=1)
+        patcher = mock.patch.dict(os.environ, {"UPSTREAM_RETRY_BASE_MS": "1", "HEDGE_MIN_DELAY_MS": "10"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(metrics.UPSTREAM_ATTEMPTS.values.clear)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.close()
+
+    async def handle(self, request):
+        self.requests += 1
+        delay, status = self.replies.pop(0) if self.replies else (0, 200)
+        await asyncio.sleep(delay)
+        return web.Response(status=status, text=f"reply {self.requests}")
+
+    async def post(self, **kwargs):
+        async with self.upstream.post(self.session, self.url, **kwargs) as response:
+            return response.status, await response.text()
+
+    async def test_retries_a_retryable_status(self):
+        self.replies = [(0, 503)]
+        self.assertEqual(await self.post(), (200, "reply 2"))
+        self.assertEqual(metrics.UPSTREAM_ATTEMPTS.values[("test", "retry")], 1)
+
+    async def test_retries_a_slow_first_byte(self):
+        self.replies = [(1, 200)]
+        self.assertEqual(await self.post(), (200, "reply 2"))
+
+    async def test_gives_up_after_the_last_retry(self):
+        self.replies = [(0, 503), (0, 503)]
+        with self.assertRaises(upstream.RetryableStatus):
+            await self.post()
+        self.assertEqual(metrics.UPSTREAM_ATTEMPTS.values[("test", "gave_up")], 1)
+
+    async def test_hedges_a_slow_attempt(self):
+        self.upstream.first_byte_samples.extend([0.01] * 20)
+        self.replies = [(0.15, 200)]
+        with mock.patch.dict(os.environ, {"TEST_HEDGE": "true"}):
+            started = asyncio.get_running_loop().time()
+            self.assertEqual(await self.post(), (200, "reply 2"))
+        self.assertLess(asyncio.get_running_loop().time() - started, 0.1)
+        self.assertEqual(metrics.UPSTREAM_ATTEMPTS.values[("test", "hedge_won")], 1)
+
+
+class HedgeDelayTests(SimpleTestCase):
+    def test_percentile_interpolates(self):
+        self.assertEqual(upstream.percentile([1, 2, 3, 4, 5], 50), 3)
+        self.assertAlmostEqual(upstream.percentile(range(1, 21), 95), 19.05)
+        self.assertEqual(upstream.percentile([7], 99), 7)
+
+    def test_delay_is_capped_below_the_first_byte_timeout(self):
+        hedged = upstream.Upstream("test", first_byte_timeout=4, stall_timeout=5, deadline=8, retries=0)
+        hedged.first_byte_samples.extend([0.3] * 19 + [30.0])
+        with mock.patch.dict(os.environ, {"TEST_HEDGE": "true"}):
+            self.assertLess(hedged.hedge_delay(), 2.0)
+            hedged.first_byte_samples.extend([30.0] * 20)
+            self.assertEqual(hedged.hedge_delay(), 2.0)
+
+
+class CallContextTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        conversation_context.redis_client = self.redis
+        self.addCleanup(setattr, conversation_context, "redis_client", None)
+        self.addCleanup(conversation_context.live_contexts.clear)
+        patcher = mock.patch.dict(os.environ, {"CONTEXT_FLUSH_MS": "10"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def open(self, key, resume=False):
+        tasks = pipeline.TaskSupervisor("test")
+        self.addAsyncCleanup(tasks.cancel_all)
+        return await conversation_context.open_call_context(key, tasks, resume)
+
+    async def test_resumed_calls_start_from_redis(self):
+        await self.redis.rpush("conversation:s1", json.dumps({"role": "user", "content": "Hi"}))
+        context = await self.open("s1", resume=True)
+        self.assertEqual(context.messages, [{"role": "user", "content": "Hi"}])
+
+    async def test_new_calls_do_not_read_redis(self):
+        with mock.patch.object(conversation_context, "read_conversation") as read:
+            context = await self.open("s1")
+        read.assert_not_called()
+        self.assertEqual((context.summary, context.messages), ("", []))
+
+    async def test_appends_are_served_from_memory_and_written_together(self):
+        await self.open("s1")
+        write = mock.AsyncMock(wraps=conversation_context.write_conversation_messages)
+        with mock.patch.object(conversation_context, "write_conversation_messages", write):
+            await conversation_context.update_conversation_context("s1", "user", "Hi")
+            await conversation_context.append_conversation_context("s1", "assistant", "Hello!")
+            self.assertEqual(len(await conversation_context.get_conversation_context("s1")), 2)
+            self.assertEqual(await self.redis.llen("conversation:s1"), 0)
+            await asyncio.sleep(0.05)
+        write.assert_awaited_once()
+        self.assertEqual(await self.redis.llen("conversation:s1"), 2)
+
+    async def test_failed_writes_are_retried_on_the_next_flush(self):
+        context = await self.open("s1")
+        with mock.patch.object(conversation_context, "write_conversation_messages", side_effect=ConnectionError("down")):
+            await conversation_context.append_conversation_context("s1", "user", "Hi")
+            await context.flush()
+        self.assertEqual(len(context.unflushed), 1)
+        await context.flush()
+        self.assertEqual(context.unflushed, [])
+        self.assertEqual(await self.redis.llen("conversation:s1"), 1)
+
+    async def test_removed_calls_drop_pending_writes(self):
+        await self.open("s1")
+        await conversation_context.append_conversation_context("s1", "user", "Hi")
+        await conversation_context.remove_conversation_context("s1")
+        await asyncio.sleep(0.05)
+        self.assertFalse(await self.redis.exists("conversation:s1"))
+        self.assertNotIn("s1", conversation_context.live_contexts)
+
+
+class TranscriptionStreamTests(IsolatedAsyncioTestCase):
+    """
+    A local websocket server stands in for Deepgram: it records what it receives and answers each binary
+    frame with a transcript, and drops the connection on b"drop".
+    """
+    async def asyncSetUp(self):
+        self.received = []
+        self.connections = 0
+        app = web.Application()
+        app.router.add_get("/listen", self.handle)
+        self.server = test_utils.TestServer(app)
+        await self.server.start_server()
+        self.session = ClientSession()
+        url = str(self.server.make_url("/listen")).replace("http", "ws", 1)
+        patcher = mock.patch.dict(os.environ, {"DEEPGRAM_WS_URL": url, "DEEPGRAM_KEEPALIVE_INTERVAL": "0.05"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.server.close()
+
+    async def handle(self, request):
+        self.connections += 1
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            self.received.append(message.data)
+            if message.data == b"drop":
+                break
+            if message.type == web.WSMsgType.BINARY:
+                await ws.send_str(json.dumps({"type": "Results", "audio": message.data.decode()}))
+        await ws.close()
+        return ws
+
+    async def transcripts(self, stream, count):
+        seen = []
+        async for message in stream.messages():
+            seen.append(message["audio"])
+            if len(seen) == count:
+                return seen
+
+    async def test_audio_sent_while_connecting_is_buffered(self):
+        stream = speech_recognition.TranscriptionStream(self.session, "twilio", 8000)
+        await stream.send(b"one")
+        await stream.send(b"two")
+        reader = asyncio.create_task(self.transcripts(stream, 3))
+        while stream.ws is None:
+            await asyncio.sleep(0.01)
+        await stream.send(b"three")
+        self.assertEqual(await asyncio.wait_for(reader, 1), ["one", "two", "three"])
+        await stream.close()
+
+    async def test_reconnects_and_replays_the_header(self):
+        stream = speech_recognition.TranscriptionStream(self.session, "web", 8000, replay_header=True)
+        await stream.send(b"header")
+        reader = asyncio.create_task(self.transcripts(stream, 3))
+        while stream.ws is None:
+            await asyncio.sleep(0.01)
+        await stream.send(b"drop")
+        while self.connections < 2 or stream.ws is None:
+            await asyncio.sleep(0.01)
+        await stream.send(b"after")
+        self.assertEqual(await asyncio.wait_for(reader, 1), ["header", "header", "after"])
+        await stream.close()
+
+    async def test_idle_streams_send_keepalives(self):
+        stream = speech_recognition.TranscriptionStream(self.session, "twilio", 8000)
+        reader = asyncio.create_task(self.transcripts(stream, 1))
+        keepalive = asyncio.create_task(stream.keepalive())
+        await asyncio.sleep(0.2)
+        self.assertIn(speech_recognition.KEEPALIVE, self.received)
+        await stream.close()
+        keepalive.cancel()
+        reader.cancel()
+
+
+def pooled_socket(open=True):
+    return mock.Mock(closed=not open, get_extra_info=mock.Mock(return_value=object()), close=mock.AsyncMock())
+
+
+class ConnectionPoolTests(IsolatedAsyncioTestCase):
+    async def test_take_skips_closed_and_stale_sockets(self):
+        pool = speech_recognition.ConnectionPool(size=2)
+        closed, other, good = pooled_socket(open=False), pooled_socket(), pooled_socket()
+        pool.idle["twilio"].extend([("wss://a", 0, closed), ("wss://b", 0, other), ("wss://a", 0, good)])
+        self.assertIs(pool.take("twilio", "wss://a"), good)
+        await asyncio.wait(set(pool.close_tasks))
+        closed.close.assert_awaited_once()
+        other.close.assert_awaited_once()
+        self.assertIsNone(pool.take("twilio", "wss://a"))
+        self.assertEqual(pool.close_tasks, set())
+
+    async def test_failed_closes_are_logged(self):
+        pool = speech_recognition.ConnectionPool(size=1)
+        stale = pooled_socket(open=False)
+        stale.close.side_effect = ConnectionResetError("reset")
+        pool.idle["twilio"].append(("wss://a", 0, stale))
+        with self.assertLogs("App.speech_recognition", "WARNING") as logged:
+            self.assertIsNone(pool.take("twilio", "wss://a"))
+            await asyncio.wait(set(pool.close_tasks))
+        self.assertIn("close error: reset", logged.output[0])
+        self.assertEqual(pool.close_tasks, set())
+
+
+class JsonFormatterTests(SimpleTestCase):
+    def test_extra_fields_become_json_fields(self):
+        record = logging.makeLogRecord({"name": "App.test", "levelname": "WARNING", "msg": "STT error: %s",
+                                        "args": ("closed",), "session": "s1", "channel": "twilio"})
+        entry = json.loads(logs.JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "STT error: closed")
+        self.assertEqual((entry["level"], entry["logger"]), ("WARNING", "App.test"))
+        self.assertEqual((entry["session"], entry["channel"]), ("s1", "twilio"))
+
+
+class FlightRecorderTests(IsolatedAsyncioTestCase):
+    def test_keeps_only_the_latest_events(self):
+        with mock.patch.dict(os.environ, {"FLIGHT_RECORDER_SIZE": "3"}):
+            recorder = logs.FlightRecorder("s1", "web")
+        for n in range(5):
+            recorder.record("command", n=n)
+        self.assertEqual([fields["n"] for _, _, fields in recorder.events], [2, 3, 4])
+
+    def test_dump_logs_the_events_once(self):
+        recorder = logs.FlightRecorder("s1", "web")
+        recorder.record("transcript", text="Hi")
+        with self.assertLogs("App.logs", "WARNING") as captured:
+            recorder.dump("slow turn", seconds=2.5)
+        record = captured.records[0]
+        self.assertEqual((record.reason, record.seconds), ("slow turn", 2.5))
+        self.assertEqual([event["event"] for event in record.events], ["transcript"])
+        self.assertEqual(len(recorder.events), 0)
+
+    async def test_tasks_record_into_their_call(self):
+        recorder = logs.start_recorder("s1", "web")
+
+        async def work():
+            logs.record("spawned")
+        await asyncio.create_task(work())
+        await asyncio.create_task(work(), context=logs.worker_context())
+        self.assertEqual([event for _, event, _ in recorder.events], ["spawned"])
+
+
+class BenchHotpathsTests(SimpleTestCase):
+    def test_synthetic_session_is_a_twilio_stream(self):
+        session = bench_hotpaths.synthetic_session(utterances=1, speech_seconds=0.2, silence_seconds=0.2)
+        events = [bench_hotpaths.event_of(message) for message in session]
+        self.assertEqual(events[:2], ["connected", "start"])
+        self.assertEqual(events[-1], "stop")
+        self.assertEqual(events.count(None), 20)
+        self.assertTrue(all(bench_hotpaths.is_media(message) for message in session[2:-1]))
+
+    def test_deepgram_messages_end_in_the_final_transcript(self):
+        messages = [json.loads(message) for message in bench_hotpaths.synthetic_deepgram_messages("Hi there")]
+        self.assertEqual([speech_recognition.transcript_of(message) for message in messages[1:]],
+                         ["Hi", "Hi there", "Hi there", ""])
+
+    def test_stubs_serve_the_recorded_transcripts_and_replies(self):
+        deepgram = bench_hotpaths.synthetic_deepgram_messages("Hi there") + bench_hotpaths.synthetic_deepgram_messages("Bye")
+        completion = json.dumps({"choices": [{"message": {"role": "assistant", "content": "Hello!"}}]})
+        transcripts, replies = bench_hotpaths.recorded_transcripts(deepgram), bench_hotpaths.recorded_replies([completion])
+        self.assertEqual((transcripts, replies), (["Hi there", "Bye"], ["Hello!"]))
+        self.assertEqual([message["content"] for message in bench_hotpaths.conversation(4, transcripts, replies)],
+                         ["Hi there", "Hello!", "Bye", "Hello!"])
+
+    def test_regressions_past_the_threshold_are_reported(self):
+        baseline = {"prompt.build": {"ns_per_op": 1000, "peak_bytes": 0, "retained_bytes_per_op": 0}}
+        within = {"prompt.build": {"ns_per_op": 1200, "peak_bytes": 900, "retained_bytes_per_op": 0}}
+        slower = {"prompt.build": {"ns_per_op": 1300, "peak_bytes": 0, "retained_bytes_per_op": 0},
+                  "new.operation": {"ns_per_op": 1e9, "peak_bytes": 0, "retained_bytes_per_op": 0}}
+        command = bench_hotpaths.Command()
+        self.assertEqual(command.compare(within, baseline, 0.25), [])
+        self.assertEqual(len(command.compare(slower, baseline, 0.25)), 1)
+
+
+class FillerTests(SimpleTestCase):
+    def test_trailing_silence_is_trimmed(self):
+        tone = audio.pcm_to_mulaw((8000 * np.sin(np.arange(800) / 5)).astype(np.int16)).tobytes()
+        silence = audio.pcm_to_mulaw(np.zeros(4000, dtype=np.int16)).tobytes()
+        clip = fillers.trim_trailing_silence(tone + silence)
+        self.assertGreaterEqual(len(clip), len(tone))
+        self.assertLessEqual(len(clip), len(tone) + 40 * 8)
+        self.assertEqual(fillers.trim_trailing_silence(silence), silence)
+
+    def test_pick_avoids_the_clip_played_last(self):
+        library = fillers.FillerLibrary(["Hmm...", "Oh, okay..."])
+        library.clips["mulaw"] = [b"hmm", b"okay"]
+        picks = [library.pick(speech_synthesis.TWILIO_AUDIO) for _ in range(6)]
+        self.assertTrue(all(a != b for a, b in zip(picks, picks[1:])))
+        self.assertIsNone(library.pick(speech_synthesis.WEB_AUDIO))
+        with mock.patch.dict(os.environ, {"FILLERS_ENABLED": "false"}):
+            self.assertIsNone(library.pick(speech_synthesis.TWILIO_AUDIO))
+
+
+class FillerLoadTests(IsolatedAsyncioTestCase):
+    async def test_failed_phrases_are_left_out(self):
+        async def synthesize(session, text, audio_format, **kwargs):
+            if text == "Oh, okay...":
+                raise ConnectionError("down")
+            yield text.encode()
+
+        library = fillers.FillerLibrary(["Hmm...", "Oh, okay..."])
+        with mock.patch.object(speech_synthesis, "synthesize", synthesize):
+            await library.load(None, formats=(speech_synthesis.WEB_AUDIO,))
+        self.assertEqual(library.clips, {speech_synthesis.WEB_AUDIO["encoding"]: [b"Hmm..."]})
+
+
+class RouterTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.env = mock.patch.dict(os.environ, {"DEEPGRAM_TTS_RETRIES": "0", "ROUTER_PROBE_INTERVAL": "1e9",
+                                                "ROUTER_BREAKER_FAILURES": "3", "ROUTER_BREAKER_SECONDS": "10"})
+        self.env.start()
+        self.session = ClientSession()
+        self.hits = {"bad": 0, "good": 0}
+        self.bad_status, self.good_status = 500, 200
+        self.servers, backends = [], []
+        for name in ("bad", "good"):
+            server, url = await start_server(self.handler(name), "/v1/speak")
+            self.servers.append(server)
+            backends.append(backend_router.Backend("tts", upstream.DEEPGRAM_TTS, name, url, "aura", "key"))
+        self.bad, self.good = backends
+        self.router = backend_router.Router("tts", backends)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        for server in self.servers:
+            await server.close()
+        self.env.stop()
+
+    def handler(self, name):
+        async def handle(request):
+            self.hits[name] += 1
+            return web.Response(status=self.bad_status if name == "bad" else self.good_status, body=name.encode())
+        return handle
+
+    async def fetch(self):
+        request = lambda backend: (backend.url, {"json": {}})
+        async with self.router.post(self.session, request) as response:
+            return response.status, await response.read()
+
+    async def test_fails_over_then_opens_the_circuit(self):
+        # The bad backend is tried first until its circuit opens; every request is still answered.
+        self.bad.first_byte, self.good.first_byte = 0.001, 1.0
+        for _ in range(5):
+            self.assertEqual(await self.fetch(), (200, b"good"))
+        self.assertEqual(self.hits["bad"], 3)
+        self.assertIsNotNone(self.bad.open_until)
+        self.assertEqual(self.router.candidates()[0], self.good)
+
+    async def test_probe_closes_a_recovered_circuit(self):
+        # The caller is answered by the healthy backend; the recovered one is probed in the background.
+        self.bad.open_circuit(10)
+        self.bad.open_until = 0.0
+        self.bad_status = 200
+        self.assertEqual(await self.fetch(), (200, b"good"))
+        await asyncio.gather(*backend_router.probe_tasks)
+        self.assertEqual(self.hits, {"bad": 1, "good": 1})
+        self.assertIsNone(self.bad.open_until)
+
+    async def test_failed_probe_doubles_the_wait(self):
+        self.bad.open_circuit(10)
+        self.bad.open_until = 0.0
+        self.assertEqual(await self.fetch(), (200, b"good"))
+        await asyncio.gather(*backend_router.probe_tasks)
+        self.assertEqual(self.bad.open_seconds, 20)
+
+    async def test_open_circuits_are_not_failed_over_to(self):
+        self.bad.open_circuit(10)
+        self.good_status = 500
+        with self.assertRaises(upstream.UpstreamError):
+            await self.fetch()
+        self.assertEqual(self.hits, {"bad": 0, "good": 1})
+        self.assertEqual(backend_router.probe_tasks, set())
+
+    async def test_with_every_circuit_open_the_soonest_due_is_tried(self):
+        self.bad.open_circuit(10)
+        self.good.open_circuit(10)
+        self.bad.open_until = 0.0
+        self.bad_status = 200
+        self.assertEqual(await self.fetch(), (200, b"bad"))
+        self.assertIsNone(self.bad.open_until)
+
+    async def test_request_errors_do_not_fail_over(self):
+        self.bad_status = 400
+        self.bad.first_byte, self.good.first_byte = 0.001, 1.0
+        self.assertEqual(await self.fetch(), (400, b"bad"))
+        self.assertEqual(self.hits["good"], 0)
+
+
+def message(role, chars):
+    return {"role": role, "content": "x" * chars}
+
+
+class ContextWindowTests(SimpleTestCase):
+    def test_recent_messages_fit_the_budget(self):
+        messages = [message("user", 36), message("assistant", 36), message("user", 36)]      # 13 tokens each
+        self.assertEqual(conversation_context.recent_messages(messages, 26), messages[1:])
+        self.assertEqual(conversation_context.recent_messages(messages, 100), messages)
+        # The last message is kept even if it alone is over budget.
+        self.assertEqual(conversation_context.recent_messages(messages, 5), messages[2:])
+        self.assertEqual(conversation_context.recent_messages([], 5), [])
+
+    def test_fit_window_puts_the_summary_first(self):
+        messages = [message("user", 396), message("assistant", 396), message("user", 396)]    # 103 tokens each
+        with mock.patch.dict(os.environ, {"CONTEXT_TOKEN_BUDGET": "250", "CONVERSATION_CONTEXT_WINDOW": "10"}):
+            window = conversation_context.fit_window("They asked about rain.", messages)
+            self.assertEqual(window[0], conversation_context.summary_message("They asked about rain."))
+            self.assertEqual(window[1:], messages[1:])
+            self.assertEqual(conversation_context.fit_window("", messages), messages[1:])
+
+    def test_fit_window_caps_the_message_count(self):
+        messages = [message("user", 4) for _ in range(10)]
+        with mock.patch.dict(os.environ, {"CONTEXT_TOKEN_BUDGET": "1500", "CONVERSATION_CONTEXT_WINDOW": "4"}):
+            self.assertEqual(len(conversation_context.fit_window("", messages)), 4)
+
+
+class SummaryFoldTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        conversation_context.redis_client = self.redis
+        self.addCleanup(setattr, conversation_context, "redis_client", None)
+        self.addCleanup(conversation_context.live_contexts.clear)
+        patcher = mock.patch.dict(os.environ, {"CONTEXT_SUMMARIZE_TOKENS": "200", "CONTEXT_VERBATIM_TOKENS": "150"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.summarize = mock.AsyncMock(return_value="They asked about rain.")
+
+    async def open(self, key):
+        tasks = pipeline.TaskSupervisor("test")
+        self.addAsyncCleanup(tasks.cancel_all)
+        return await conversation_context.open_call_context(key, tasks)
+
+    async def test_older_messages_are_folded_into_the_summary(self):
+        context = await self.open("s1")
+        messages = [message("user", 396), message("assistant", 396), message("user", 396)]
+        await conversation_context.append_conversation_messages("s1", messages[:1])
+        conversation_context.summarize_later("s1", self.summarize)
+        self.assertIsNone(context.summary_task)
+
+        await conversation_context.append_conversation_messages("s1", messages[1:])
+        conversation_context.summarize_later("s1", self.summarize)
+        await context.summary_task
+        self.summarize.assert_awaited_once_with("", messages[:2])
+        self.assertEqual((context.summary, context.messages), ("They asked about rain.", messages[2:]))
+        self.assertEqual(await self.redis.get("conversation_summary:s1"), "They asked about rain.")
+        self.assertEqual(await self.redis.llen("conversation:s1"), 1)
+
+        # Another worker taking the call over reads the summary and only the unsummarized tail.
+        conversation_context.live_contexts.clear()
+        self.assertEqual(await conversation_context.get_conversation_context("s1"),
+                         [conversation_context.summary_message("They asked about rain.")] + messages[2:])
+
+    async def test_a_failed_summary_keeps_the_messages(self):
+        context = await self.open("s1")
+        self.summarize.return_value = None
+        await conversation_context.append_conversation_messages("s1", [message("user", 396), message("user", 396)])
+        conversation_context.summarize_later("s1", self.summarize)
+        await context.summary_task
+        self.assertEqual((context.summary, len(context.messages)), ("", 2))
+
+
+class SynthesizeTests(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.env = mock.patch.dict(os.environ, {"TTS_CACHE_ENABLED": "false", "DEEPGRAM_TTS_RETRIES": "0"})
+        self.env.start()
+        self.session = ClientSession()
+        self.servers = []
+
+    async def asyncTearDown(self):
+        backend_router.routers.pop("tts", None)
+        await self.session.close()
+        for server in self.servers:
+            await server.close()
+        self.env.stop()
+
+    async def serve(self, handler):
+        server, url = await start_server(handler, "/v1/speak")
+        self.servers.append(server)
+        backend_router.routers["tts"] = backend_router.Router("tts", [
+            backend_router.Backend("tts", upstream.DEEPGRAM_TTS, "stub", url, "aura", "key")
+        ])
+
+    async def collect(self, text="Hello there"):
+        return [chunk async for chunk in speech_synthesis.synthesize(self.session, text, speech_synthesis.TWILIO_AUDIO)]
+
+    async def test_error_status_raises_before_yielding(self):
+        async def payment_required(request):
+            return web.json_response({"err_code": "INSUFFICIENT_CREDITS"}, status=402)
+        await self.serve(payment_required)
+        chunks = []
+        with self.assertRaises(upstream.UpstreamError):
+            async for chunk in speech_synthesis.synthesize(self.session, "Hello there", speech_synthesis.TWILIO_AUDIO):
+                chunks.append(chunk)
+        self.assertEqual(chunks, [])
+
+    async def test_json_body_with_ok_status_raises(self):
+        async def json_ok(request):
+            return web.json_response({"error": "no audio"})
+        await self.serve(json_ok)
+        with self.assertRaises(upstream.UpstreamError):
+            await self.collect()
+
+    async def test_audio_is_streamed(self):
+        async def audio(request):
+            return web.Response(body=b"\xff" * 3000, content_type="audio/basic")
+        await self.serve(audio)
+        self.assertEqual(b"".join(await self.collect()), b"\xff" * 3000)
+
+    async def test_one_off_sentences_skip_the_shared_tier(self):
+        async def audio(request):
+            return web.Response(body=b"\xff" * 1000, content_type="audio/basic")
+        await self.serve(audio)
+        with mock.patch.dict(os.environ, {"TTS_CACHE_ENABLED": "true"}), \
+                mock.patch.object(speech_synthesis, "get_audio_redis_client", side_effect=AssertionError("Redis used")):
+            self.assertEqual(len(b"".join(await self.collect("A sentence only this reply says."))), 1000)
+            self.assertEqual(len(b"".join(await self.collect("A sentence only this reply says."))), 1000)
+
+    async def test_failover_audio_is_not_cached_under_the_primary_voice(self):
+        async def down(request):
+            return web.Response(status=503)
+
+        async def audio(request):
+            return web.Response(body=b"\xfe" * 1000, content_type="audio/basic")
+        urls = []
+        for handler in (down, audio):
+            server, url = await start_server(handler, "/v1/speak")
+            self.servers.append(server)
+            urls.append(url)
+        backend_router.routers["tts"] = backend_router.Router("tts", [
+            backend_router.Backend("tts", upstream.DEEPGRAM_TTS, "primary", urls[0], "aura-asteria", "key"),
+            backend_router.Backend("tts", upstream.DEEPGRAM_TTS, "fallback", urls[1], "other-voice", "key"),
+        ])
+        text = "A sentence the fallback voice says."
+        with mock.patch.dict(os.environ, {"TTS_CACHE_ENABLED": "true"}):
+            self.assertEqual(b"".join(await self.collect(text)), b"\xfe" * 1000)
+            await asyncio.sleep(0)
+        for model in ("aura-asteria", "other-voice"):
+            key = speech_synthesis.cache_key(text, speech_synthesis.TWILIO_AUDIO, model)
+            self.assertIsNone(speech_synthesis.memory_cache.get(key))
+
+
+class IsAudioTests(SimpleTestCase):
+    def test_rejects_empty_and_error_bodies(self):
+        self.assertFalse(speech_synthesis.is_audio(b""))
+        self.assertFalse(speech_synthesis.is_audio(b'{"err_code": "INSUFFICIENT_CREDITS"}'))
+        self.assertFalse(speech_synthesis.is_audio(b"<html><body>Bad gateway</body></html>"))
+
+    def test_accepts_audio(self):
+        self.assertTrue(speech_synthesis.is_audio(b"ID3\x04\x00" + b"\x00" * 100))
+        # Raw mulaw that happens to start with a brace is not JSON.
+        self.assertTrue(speech_synthesis.is_audio(b"{\xff\x7f\xfe" * 50))
@@ -0,0 +1,105 @@
+import asyncio, base64, json, time
+from . import speech_synthesis
+
+MULAW_BYTES_PER_MS = 8      # 8 kHz, 1 byte per sample
+TWILIO_FRAME_MS = 20
+
+
+class TwilioAudioWriter:
+    """
+    Outbound audio writer for a Twilio media stream.
+    - Re-frames mulaw audio into fixed-size payloads (a whole number of Twilio's 20 ms / 160 byte frames).
+    - Splices each base64 payload into a pre-serialized JSON envelope instead of building and dumping a dict per chunk.
+    - Paces sends to real time plus `lead_ms`, so only a little audio sits in Twilio's buffer.
+    - Sends `mark` events and tracks which ones Twilio has acknowledged, i.e. how much audio has actually been played.
+    """
+    audio_format = speech_synthesis.TWILIO_AUDIO
+
+    def __init__(self, send, stream_sid, frame_ms=100, lead_ms=500, mark_interval_ms=1000):
+        self.send = send
+        self.stream_sid = stream_sid
+        self.frame_bytes = max(1, frame_ms // TWILIO_FRAME_MS) * TWILIO_FRAME_MS * MULAW_BYTES_PER_MS
+        self.lead = lead_ms / 1000
+        self.mark_interval_ms = mark_interval_ms
+
+        sid = json.dumps(stream_sid)
+        self.media_prefix = '{"event":"media","streamSid":%s,"media":{"payload":"' % sid
+        self.media_suffix = '"}}'
+        self.mark_prefix = '{"event":"mark","streamSid":%s,"mark":{"name":"' % sid
+        self.mark_suffix = '"}}'
+        self.clear_message = '{"event":"clear","streamSid":%s}' % sid
+
+        self.pending = bytearray()
+        self.buffered_until = 0.0        # loop time at which Twilio runs out of audio we have sent
+        self.sent_ms = 0                 # audio position sent so far
+        self.last_mark_ms = 0
+        self.mark_seq = 0
+        self.marks = {}                  # unacknowledged mark name -> audio position (ms)
+        self.played_ms = 0               # audio position acknowledged by Twilio
+        self.finished_at = time.time()   # wall time the last acknowledged playback ended
+
+    @property
+    def playing(self):
+        return bool(self.marks or self.pending)
+
+    async def write(self, audio):
+        self.pending += audio
+        while len(self.pending) >= self.frame_bytes:
+            frame = bytes(self.pending[:self.frame_bytes])
+            del self.pending[:self.frame_bytes]
+            await self.send_frame(frame)
+
+    async def finish(self):
+        """
+        Sends any remaining partial frame followed by a mark for the end of the utterance.
+        """
+        if self.pending:
+            frame = bytes(self.pending)
+            self.pending.clear()
+            await self.send_frame(frame)
+        if self.sent_ms > self.last_mark_ms or not self.marks:
+            await self.mark()
+
+    async def send_frame(self, frame):
+        await self.pace(len(frame) / MULAW_BYTES_PER_MS / 1000)
+        await self.send(text_data=self.media_prefix + base64.b64encode(frame).decode("ascii") + self.media_suffix)
+        self.sent_ms += len(frame) // MULAW_BYTES_PER_MS
+
+        if self.mark_interval_ms and self.sent_ms - self.last_mark_ms >= self.mark_interval_ms:
+            await self.mark()
+
+    async def pace(self, duration):
+        now = asyncio.get_running_loop().time()
+        ahead = self.buffered_until - now
+        if ahead > self.lead:
+            await asyncio.sleep(ahead - self.lead)
+            now = asyncio.get_running_loop().time()
+        self.buffered_until = max(self.buffered_until, now) + duration
+
+    async def mark(self):
+        self.mark_seq += 1
+        name = str(self.mark_seq)
+        self.marks[name] = self.sent_ms
+        self.last_mark_ms = self.sent_ms
+        await self.send(text_data=self.mark_prefix + name + self.mark_suffix)
+
+    def acknowledge(self, name):
+        """
+        Handles a `mark` event echoed by Twilio once playback has reached it.
+        """
+        position = self.marks.pop(name, None)
+        if position is None:
+            return
+        self.played_ms = max(self.played_ms, position)
+        if not self.marks:
+            self.finished_at = time.time()
+
+    async def clear(self):
+        """
+        Flushes audio buffered on Twilio's side and drops anything not yet sent.
+        """
+        self.pending.clear()
+        self.marks.clear()
+        self.buffered_until = 0.0
+        self.finished_at = time.time()
+        await self.send(text_data=self.clear_message)
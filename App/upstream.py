@@ -0,0 +1,183 @@
+import asyncio, contextlib, copy, logging, random, time
+from collections import deque
+import aiohttp
+from decouple import config
+from . import logs, metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth another attempt: throttling, timeouts and transient server errors.
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class RetryableStatus(UpstreamError):
+    def __init__(self, upstream, status, retry_after=None):
+        super().__init__(f"{upstream} HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+def percentile(samples, pct):
+    """
+    `pct` percentile of `samples`, linearly interpolated between the two nearest ranks.
+    """
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * min(max(pct, 0), 100) / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+class Upstream:
+    """
+    Latency budget and request policy for one upstream HTTP API. Settings are read as `<NAME>_<SETTING>`:
+    - FIRST_BYTE_TIMEOUT: seconds one attempt may wait for response headers
+    - STALL_TIMEOUT: seconds a started response body may go without sending data
+    - DEADLINE: seconds all attempts together may take to produce a response
+    - RETRIES: extra attempts on connection errors, timeouts and retryable statuses, with full-jitter backoff
+    - HEDGE: send a second attempt if the first has no response after the HEDGE_PERCENTILE of recent
+      successful first-byte latencies (at least HEDGE_MIN_DELAY_MS, at most half the FIRST_BYTE_TIMEOUT);
+      the slower attempt is cancelled
+    """
+    def __init__(self, name, first_byte_timeout, stall_timeout, deadline, retries):
+        self.name = name
+        self.defaults = {
+            "FIRST_BYTE_TIMEOUT": first_byte_timeout, "STALL_TIMEOUT": stall_timeout,
+            "DEADLINE": deadline, "RETRIES": retries, "HEDGE": False
+        }
+        self.first_byte_samples = deque(maxlen=500)
+
+    def for_backend(self):
+        """
+        Copy with the same settings and metric labels but its own latency history, for one of several backends
+        behind a `backend_router.Router`: hedging delays should come from the backend actually being called.
+        """
+        backend = copy.copy(self)
+        backend.first_byte_samples = deque(maxlen=self.first_byte_samples.maxlen)
+        return backend
+
+    def setting(self, suffix, cast=float):
+        return config(f'{self.name.upper()}_{suffix}', default=self.defaults[suffix], cast=cast)
+
+    def hedge_delay(self):
+        """
+        Seconds to wait before hedging, or None while hedging is off or there is too little latency history.
+        """
+        if not self.setting("HEDGE", cast=bool) or len(self.first_byte_samples) < config('HEDGE_MIN_SAMPLES', default=20, cast=int):
+            return None
+        threshold = percentile(self.first_byte_samples, config('HEDGE_PERCENTILE', default=95, cast=float))
+        # Past the cap, a hedge has too little of the attempt's timeout left to help.
+        return min(max(threshold, config('HEDGE_MIN_DELAY_MS', default=100, cast=int) / 1000), self.setting("FIRST_BYTE_TIMEOUT") / 2)
+
+    def backoff(self, attempt, error):
+        if isinstance(error, RetryableStatus) and error.retry_after is not None:
+            return error.retry_after
+        base = config('UPSTREAM_RETRY_BASE_MS', default=100, cast=int) / 1000
+        cap = config('UPSTREAM_RETRY_MAX_MS', default=1000, cast=int) / 1000
+        return random.uniform(0, min(cap, base * 2 ** attempt))
+
+    async def attempt(self, session, url, kwargs):
+        started = time.perf_counter()
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=self.setting("STALL_TIMEOUT"))
+        try:
+            async with asyncio.timeout(self.setting("FIRST_BYTE_TIMEOUT")):
+                response = await session.post(url, timeout=timeout, **kwargs)
+        except (asyncio.CancelledError, TimeoutError) as e:
+            # Stalled and cancelled attempts stay out of the history: a few stalls would otherwise push the
+            # hedge delay out to the stall length, so hedging never fires when it is needed.
+            logs.record("upstream", upstream=self.name, outcome=type(e).__name__, seconds=round(time.perf_counter() - started, 3))
+            raise
+        except aiohttp.ClientError as e:
+            logs.record("upstream", upstream=self.name, outcome=repr(e))
+            raise
+
+        seconds = time.perf_counter() - started
+        logs.record("upstream", upstream=self.name, status=response.status, seconds=round(seconds, 3))
+        if response.status in RETRYABLE_STATUS:
+            error = RetryableStatus(self.name, response.status, retry_after(response))
+            response.release()
+            raise error
+        self.first_byte_samples.append(seconds)
+        return response
+
+    async def first_response(self, session, url, kwargs, hedge):
+        """
+        One attempt, plus a hedged second one if the first is slower than usual. Returns the first response.
+        """
+        first = asyncio.create_task(self.attempt(session, url, kwargs))
+        delay = self.hedge_delay() if hedge else None
+        if delay is None:
+            return await first
+
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            metrics.UPSTREAM_ATTEMPTS.inc(self.name, "hedge")
+            second = asyncio.create_task(self.attempt(session, url, kwargs))
+            pending.add(second)
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winners = [task for task in done if task.exception() is None]
+                if winners:
+                    for task in winners[1:]:
+                        task.result().close()
+                    if winners[0] is second:
+                        metrics.UPSTREAM_ATTEMPTS.inc(self.name, "hedge_won")
+                    return winners[0].result()
+                if not pending:
+                    raise done.pop().exception()
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(close_response)
+
+    @contextlib.asynccontextmanager
+    async def post(self, session, url, retries=None, hedge=True, **kwargs):
+        """
+        POSTs to the upstream within its latency budget and yields the response once its headers are in.
+        Raises `UpstreamError` (or the last connection / timeout error) when the budget is spent.
+        """
+        retries = self.setting("RETRIES", cast=int) if retries is None else retries
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.setting("DEADLINE")
+
+        for attempt in range(retries + 1):
+            try:
+                async with asyncio.timeout_at(deadline):
+                    response = await self.first_response(session, url, kwargs, hedge)
+                break
+            except (UpstreamError, aiohttp.ClientConnectionError, TimeoutError) as e:
+                delay = self.backoff(attempt, e)
+                if attempt == retries or loop.time() + delay >= deadline:
+                    metrics.UPSTREAM_ATTEMPTS.inc(self.name, "gave_up")
+                    raise
+                metrics.UPSTREAM_ATTEMPTS.inc(self.name, "retry")
+                logger.warning("%s attempt %d failed, retrying: %r", self.name, attempt + 1, e)
+                await asyncio.sleep(delay)
+
+        try:
+            yield response
+        finally:
+            response.release()
+
+def close_response(task):
+    # A hedged attempt that lost the race but still produced a response gives its connection back.
+    if not task.cancelled() and task.exception() is None:
+        task.result().close()
+
+
+OPENAI = Upstream("openai", first_byte_timeout=5, stall_timeout=5, deadline=8, retries=2)
+DEEPGRAM_TTS = Upstream("deepgram_tts", first_byte_timeout=3, stall_timeout=5, deadline=5, retries=2)
@@ -0,0 +1,167 @@
+import asyncio, itertools, json, random, time
+from aiohttp import web
+
+STUB_TRANSCRIPT = "Tell me something funny about your day."
+STUB_REPLY = ("Oh, you would not believe it... um, I tried to bake bread this morning. "
+              "It came out so flat that my neighbor asked if I was making a frisbee. "
+              "So, what did you have for breakfast?")
+
+# Approximate encoded audio rates, used to size stub TTS output and to turn received bytes into audio time.
+BYTES_PER_SECOND = {"mulaw": 8000, "mp3": 6000, "linear16": 16000}
+
+
+class StubLatency:
+    """
+    Configurable upstream latencies (seconds) for the stub servers.
+    - stt: final transcript delay after the endpointing silence
+    - llm_ttft / llm_tps: OpenAI time to first token, then tokens per second
+    - tts_ttfb / tts_speed: Deepgram TTS time to first byte, then multiple of real time
+    - stall_rate / stall_seconds: fraction of LLM and TTS requests that stall this much longer before the first byte
+    """
+    def __init__(self, stt=0.05, llm_ttft=0.3, llm_tps=60, tts_ttfb=0.15, tts_speed=4.0, stall_rate=0.0, stall_seconds=2.0):
+        self.stt = stt
+        self.llm_ttft = llm_ttft
+        self.llm_tps = llm_tps
+        self.tts_ttfb = tts_ttfb
+        self.tts_speed = tts_speed
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+
+    def first_byte(self, delay):
+        # Upstream tail latency: an occasional request sits much longer before answering.
+        return delay + (self.stall_seconds if random.random() < self.stall_rate else 0.0)
+
+
+def is_speech(chunk, threshold=20):
+    """
+    Crude energy check on mulaw-style bytes: silence encodes near 0xFF/0x7F, loud samples near 0x00/0x80.
+    """
+    if not chunk:
+        return False
+    return sum(0x7F - (b & 0x7F) for b in chunk[::8]) / len(chunk[::8]) > threshold
+
+def results_message(transcript, is_final=True):
+    return json.dumps({
+        "type": "Results",
+        "is_final": is_final,
+        "speech_final": is_final,
+        "channel": {"alternatives": [{"transcript": transcript, "confidence": 0.99}]}
+    })
+
+
+def create_stub_app(latency=None, transcripts=(STUB_TRANSCRIPT,), replies=(STUB_REPLY,)):
+    """
+    aiohttp application standing in for Deepgram STT (websocket), Deepgram TTS (streaming HTTP)
+    and OpenAI chat completions (JSON or SSE), for load tests and offline replay.
+    Each utterance is transcribed as the next of `transcripts`, and each completion is the next of `replies`.
+    """
+    latency = latency or StubLatency()
+    transcripts, replies = itertools.cycle(transcripts), itertools.cycle(replies)
+
+    async def listen(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+
+        query = request.query
+        rate = BYTES_PER_SECOND.get(query.get("encoding"), 4000)
+        endpointing = int(query.get("endpointing", 300)) / 1000
+        vad_events = query.get("vad_events") == "true"
+        interim_results = query.get("interim_results") == "true"
+        in_speech, heard, silence = False, 0.0, 0.0
+        transcript = next(transcripts)
+
+        async def send_later(delay, message):
+            await asyncio.sleep(delay)
+            if not ws.closed:
+                await ws.send_str(message)
+
+        async for message in ws:
+            if message.type == web.WSMsgType.TEXT:
+                # KeepAlive / Finalize / CloseStream control messages.
+                if json.loads(message.data).get("type") == "CloseStream":
+                    break
+                continue
+            if message.type != web.WSMsgType.BINARY:
+                continue
+
+            duration = len(message.data) / rate
+            if is_speech(message.data):
+                if not in_speech and vad_events:
+                    await ws.send_str(json.dumps({"type": "SpeechStarted", "timestamp": time.time()}))
+                in_speech, silence = True, 0.0
+                heard += duration
+                if interim_results and heard >= 0.5:
+                    words = transcript.split()
+                    partial = " ".join(words[:max(1, int(len(words) * min(1.0, heard / 1.5)))])
+                    await ws.send_str(results_message(partial, is_final=False))
+            else:
+                silence += duration
+                if in_speech and silence >= endpointing:
+                    in_speech, heard = False, 0.0
+                    asyncio.create_task(send_later(latency.stt, results_message(transcript)))
+                    transcript = next(transcripts)
+                elif not in_speech and silence >= 2.0:
+                    silence = 0.0
+                    await ws.send_str(results_message(""))
+        return ws
+
+    async def speak(request):
+        text = (await request.json()).get("text", "")
+        rate = BYTES_PER_SECOND.get(request.query.get("encoding"), 8000)
+        audio_bytes = int(len(text) / 15 * rate)   # ~15 characters of speech per second
+
+        await asyncio.sleep(latency.first_byte(latency.tts_ttfb))
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        await response.prepare(request)
+
+        chunk = b"\x55" * 1024
+        interval = len(chunk) / rate / latency.tts_speed
+        for start in range(0, audio_bytes, len(chunk)):
+            await response.write(chunk[:audio_bytes - start])
+            await asyncio.sleep(interval)
+        await response.write_eof()
+        return response
+
+    async def chat(request):
+        payload = await request.json()
+        reply = next(replies)
+        await asyncio.sleep(latency.first_byte(latency.llm_ttft))
+
+        if not payload.get("stream"):
+            await asyncio.sleep(len(reply.split()) / latency.llm_tps)
+            return web.json_response({"choices": [{"message": {"role": "assistant", "content": reply}}]})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for index, word in enumerate(reply.split(" ")):
+            delta = {"choices": [{"delta": {"content": word if index == 0 else " " + word}}]}
+            await response.write(f"data: {json.dumps(delta)}\n\n".encode())
+            await asyncio.sleep(1 / latency.llm_tps)
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def ok(request):
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_get("/v1/listen", listen)
+    app.router.add_post("/v1/speak", speak)
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_route("HEAD", "/v1/speak", ok)
+    app.router.add_route("HEAD", "/v1/chat/completions", ok)
+    return app
+
+def stub_environment(host, port):
+    """
+    Settings that point the app at stub servers listening on host:port.
+    """
+    base = f"{host}:{port}"
+    return {
+        "DEEPGRAM_WS_URL": f"ws://{base}/v1/listen",
+        "DEEPGRAM_TTS_API_ENDPOINT": f"http://{base}/v1/speak",
+        "OPENAI_API_ENDPOINT": f"http://{base}/v1/chat/completions",
+    }
+
+def run_stub_server(host, port, latency=None, transcripts=(STUB_TRANSCRIPT,), replies=(STUB_REPLY,)):
+    web.run_app(create_stub_app(latency, transcripts, replies), host=host, port=port, print=None)
@@ -6,5 +6,7 @@ app_name = 'App'
 
 urlpatterns = [
     path('', views.index, name="home"),
-    path('iris-inbound-via-twilio/', views.receive_twilio_call, name="twilio_inbound_handler")
+    path('iris-inbound-via-twilio/', views.receive_twilio_call, name="twilio_inbound_handler"),
+    path('metrics/', views.metrics_view, name="metrics"),
+    path('healthz/', views.health, name="health")
 ]
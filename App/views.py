@@ -4,6 +4,7 @@ from django.views.decorators.csrf import csrf_exempt
 from django.shortcuts import render
 from django.http import HttpResponse
 from decouple import config
+from . import metrics, call_registry, admission
 
 
 def index(request):
@@ -11,13 +12,54 @@ def index(request):
 
 @csrf_exempt
 @require_POST
-def receive_twilio_call(request):
+async def receive_twilio_call(request):
     response = VoiceResponse()
-    # Connect the call and stream audio to your WebSocket endpoint.
+    reservation = await admission.admit("twilio", local=False)
+    if reservation is None:
+        return busy_response(request)
+
+    # Connect the call and stream audio to your WebSocket endpoint; the media stream consumes the reserved slot.
     connect = Connect()
     stream = Stream(url=config('TWILIO_STREAM_WS_URL'))
+    stream.parameter(name="reservation", value=reservation)
     connect.append(stream)
     response.append(connect)
     
     return HttpResponse(str(response), content_type="application/xml")
-    
+
+def busy_response(request):
+    """
+    TwiML for a call that cannot be admitted. With ADMISSION_BUSY_ACTION=queue (default) the caller holds
+    and the webhook is retried every ADMISSION_QUEUE_WAIT seconds, up to ADMISSION_QUEUE_ATTEMPTS times;
+    with "reject" the call is refused with a busy signal before it is answered.
+    """
+    response = VoiceResponse()
+    try:
+        attempt = max(0, int(request.GET.get("attempt", 0)))
+    except ValueError:
+        attempt = 0         # not from our own redirect: start the hold over
+    if config('ADMISSION_BUSY_ACTION', default="queue") == "reject":
+        response.reject(reason="busy")
+    elif attempt < config('ADMISSION_QUEUE_ATTEMPTS', default=6, cast=int):
+        if attempt == 0:
+            response.say(admission.HOLD_MESSAGE)
+        response.pause(length=config('ADMISSION_QUEUE_WAIT', default=10, cast=int))
+        response.redirect(f"{request.path}?attempt={attempt + 1}", method="POST")
+    else:
+        response.say(admission.BUSY_MESSAGE)
+        response.hangup()
+    return HttpResponse(str(response), content_type="application/xml")
+
+async def metrics_view(request):
+    """
+    Per-process latency histograms and call/error/byte counters in the Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+def health(request):
+    """
+    Load balancer health check; fails while the worker drains so new calls go elsewhere.
+    """
+    if call_registry.draining:
+        return HttpResponse("draining", status=503)
+    return HttpResponse("ok")
@@ -0,0 +1,124 @@
+import collections
+import numpy as np
+from . import audio, metrics
+
+
+def frame_features(pcm, frame_samples):
+    """
+    Per-frame RMS energy and zero-crossing rate for PCM samples, computed over all whole frames at once.
+    """
+    frames = pcm[:len(pcm) - len(pcm) % frame_samples].reshape(-1, frame_samples).astype(np.float32)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    signs = np.signbit(frames)
+    zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (frame_samples - 1)
+    return rms, zcr
+
+
+class VoiceActivityGate:
+    """
+    Local VAD in front of the STT websocket: only speech, plus some pre-roll before it and a hangover of silence
+    after it (long enough for the upstream endpointing to close the utterance), is forwarded.
+
+    Frames are classified by energy against an adaptive noise floor, with the zero-crossing rate admitting
+    quieter unvoiced sounds. The floor follows a low percentile of the energy of every frame over the last
+    `noise_window_ms`, whether or not it was speech, so it settles on a noisy line's background level; it
+    drops at once but rises by at most `noise_rise` times per second, so a caller who starts talking
+    before any background was heard does not become the floor. `on_speech_start` / `on_speech_end` are called as the caller starts and stops
+    talking; `keepalive` is called instead of sending audio while silence is being suppressed.
+    """
+    def __init__(self, forward, keepalive=None, on_speech_start=None, on_speech_end=None, channel="twilio", sample_rate=8000,
+                 frame_ms=20, pre_roll_ms=300, hangover_ms=800, start_frames=2, min_rms=200.0,
+                 noise_ratio=3.0, noise_window_ms=3000, noise_percentile=10, noise_rise=3.0, keepalive_interval=5.0):
+        self.forward = forward
+        self.keepalive = keepalive
+        self.on_speech_start = on_speech_start
+        self.on_speech_end = on_speech_end
+        self.channel = channel
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.start_frames = start_frames
+        self.min_rms = min_rms
+        self.noise_ratio = noise_ratio
+        self.noise_percentile = noise_percentile
+        self.frame_rise = noise_rise ** (frame_ms / 1000)
+        self.keepalive_frames = int(keepalive_interval * 1000 // frame_ms)
+
+        self.pre_roll = collections.deque(maxlen=max(1, pre_roll_ms // frame_ms))
+        self.pending = bytearray()           # bytes short of a whole frame
+        self.noise_floor = min_rms / noise_ratio
+        self.levels = collections.deque(maxlen=max(1, noise_window_ms // frame_ms))    # recent frame RMS
+        self.speaking = False
+        self.voiced_run = 0                  # consecutive speech frames while not speaking
+        self.silent_run = 0                  # consecutive non-speech frames while speaking
+        self.suppressed = 0                  # frames dropped since the last audio or keepalive sent upstream
+
+    def classify(self, rms, zcr):
+        threshold = np.maximum(self.min_rms, self.noise_floor * self.noise_ratio)
+        voiced = rms > threshold
+        unvoiced = (rms > threshold / 2) & (zcr > 0.3)
+        return voiced | unvoiced
+
+    def update_noise_floor(self, rms):
+        # Speech leaves gaps between words, so a low percentile over a few seconds stays near the background
+        # level while the caller talks, and rises with it on a noisy line.
+        self.levels.extend(rms.tolist())
+        target = float(np.percentile(self.levels, self.noise_percentile))
+        ceiling = max(self.noise_floor, 1.0) * self.frame_rise ** len(rms)
+        self.noise_floor = min(target, ceiling)
+
+    async def add(self, chunk):
+        """
+        Feeds mu-law audio; forwards whatever the gate lets through as one write.
+        """
+        self.pending += chunk
+        usable = len(self.pending) - len(self.pending) % self.frame_samples
+        if not usable:
+            return
+        data = memoryview(bytes(self.pending[:usable]))
+        del self.pending[:usable]
+
+        pcm = audio.mulaw_to_pcm(data)
+        rms, zcr = frame_features(pcm, self.frame_samples)
+        speech = self.classify(rms, zcr)
+
+        out = bytearray()
+        dropped = 0
+        for index, is_speech in enumerate(speech.tolist()):
+            frame = data[index * self.frame_samples:(index + 1) * self.frame_samples]
+            if self.speaking:
+                out += frame
+                self.silent_run = 0 if is_speech else self.silent_run + 1
+                if self.silent_run >= self.hangover_frames:
+                    self.speaking = False
+                    if self.on_speech_end:
+                        self.on_speech_end()
+                continue
+
+            self.voiced_run = self.voiced_run + 1 if is_speech else 0
+            if self.voiced_run >= self.start_frames:
+                self.speaking, self.voiced_run, self.silent_run = True, 0, 0
+                out += b"".join(self.pre_roll)
+                out += frame
+                self.pre_roll.clear()
+                if self.on_speech_start:
+                    self.on_speech_start()
+            else:
+                if len(self.pre_roll) == self.pre_roll.maxlen:
+                    dropped += self.frame_samples
+                self.pre_roll.append(frame)
+                self.suppressed += 1
+
+        self.update_noise_floor(rms)
+        if dropped:
+            metrics.VAD_SUPPRESSED_BYTES.inc(self.channel, amount=dropped)
+
+        if out:
+            self.suppressed = 0
+            await self.forward(bytes(out))
+        elif self.keepalive and self.suppressed >= self.keepalive_frames:
+            self.suppressed = 0
+            await self.keepalive()
+
+    def close(self):
+        self.pre_roll.clear()
+        self.pending.clear()
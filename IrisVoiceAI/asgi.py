@@ -13,13 +13,14 @@ from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.sessions import SessionMiddlewareStack
 from App.routing import websocket_urlpatterns
+from App.lifespan import LifespanMiddleware
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'IrisVoiceAI.settings')
 
-application = ProtocolTypeRouter({
+application = LifespanMiddleware(ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": SessionMiddlewareStack(
         URLRouter(websocket_urlpatterns)
         ),  
-})
+}))
 